@@ -0,0 +1,275 @@
+"""HTTP client for the Django API.
+
+One keep-alive Session with a connection pool sized to the download
+threads, gzip-compressed responses, Arrow IPC streams where the endpoint offers
+them (NDJSON otherwise) and retries with exponential backoff on
+connection errors and 429/502/503/504 answers (the whole exchange is
+retried, including a body that broke off mid-stream).
+
+Full collection-detail downloads are split into independent date-range
+shards that a bounded thread pool fetches concurrently, so a long history
+costs one round trip per thread rather than one long sequential stream.
+Shards are reassembled in plan order, which is the order the server sends
+an unsharded response in, so the result does not depend on which shard
+finished first.
+"""
+import os
+import threading
+import time
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+
+import pandas as pd
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+
+from ingest import DEFAULT_BATCH_SIZE, ByteBudget, read_arrow_frame, read_ndjson_frame
+from schema import concat_frames
+
+# Base URL of the Django API
+API_URL = os.getenv('CREDIFIEL_API_URL', 'http://localhost:8000/api')
+
+# Bytes read from the socket at a time while streaming API responses
+STREAM_CHUNK_BYTES = 64 * 1024
+
+# Concurrent shard downloads (and pooled connections). Threads only pay off
+# when the server has spare cores or the network is the bottleneck: against
+# a one-core dev server 4 threads were slower than 1.
+DEFAULT_FETCH_WORKERS = int(os.getenv('DATATHON_FETCH_WORKERS', 1))
+
+# Months of fechaCobroBanco per collection-details shard
+DEFAULT_MONTHS_PER_SHARD = 3
+
+ARROW_STREAM = 'application/vnd.apache.arrow.stream'
+
+# Row endpoints answer with an Arrow stream when they can, NDJSON otherwise
+FRAME_ACCEPT = f'{ARROW_STREAM}, application/x-ndjson;q=0.5'
+
+RETRY_STATUSES = {429, 502, 503, 504}
+# Arrow streams are read straight from the urllib3 response, whose errors requests does not wrap
+RETRY_EXCEPTIONS = (
+    requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError,
+    urllib3.exceptions.ProtocolError, urllib3.exceptions.ReadTimeoutError,
+)
+
+
+class DataChanged(Exception):
+    """The collection data version changed while a sharded download was in flight"""
+
+
+def _month_start(year, month):
+    year, month = year + (month - 1) // 12, (month - 1) % 12 + 1
+    return f'{year:04d}-{month:02d}-01'
+
+
+def shard_plan(years, since=None, months_per_shard=DEFAULT_MONTHS_PER_SHARD):
+    """collection-details query parameters per shard, in the server's row order.
+
+    years are the ones /collection-stats/ lists. Shards cover everything
+    before them, each months_per_shard range within them, everything after
+    them and, for full downloads, the undated rows, so together they return
+    every row exactly once. since adds the `after` bound and drops shards
+    that end before it.
+    """
+    if not years:
+        return [{'after': pd.Timestamp(since).isoformat()}] if since is not None else [{}]
+
+    bounds = [_month_start(min(years), month) for month in range(1, 12 * (max(years) - min(years) + 1) + 1,
+                                                                months_per_shard)]
+    bounds.append(_month_start(max(years) + 1, 1))
+    shards = [{'end': bounds[0]}]
+    shards += [{'start': start, 'end': end} for start, end in zip(bounds[:-1], bounds[1:])]
+    shards.append({'start': bounds[-1]})
+
+    if since is None:
+        return shards + [{'undated': '1'}]
+    since = pd.Timestamp(since)
+    return [
+        {**shard, 'after': since.isoformat()}
+        for shard in shards
+        if 'end' not in shard or pd.Timestamp(shard['end']) > since
+    ]
+
+
+class ApiClient:
+    """Pooled, retrying client; use as a context manager to close its connections"""
+
+    def __init__(self, base_url=None, workers=DEFAULT_FETCH_WORKERS, retries=3, backoff=0.5,
+                 timeout=(10, 120), months_per_shard=DEFAULT_MONTHS_PER_SHARD):
+        self.base_url = base_url or API_URL
+        self.workers = max(1, workers)
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.months_per_shard = months_per_shard
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers['Accept-Encoding'] = 'gzip'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.session.close()
+
+    def _delay(self, attempt, response=None):
+        delay = self.backoff * 2 ** attempt
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after is not None and retry_after.isdigit():
+            delay = max(delay, int(retry_after))
+        return delay
+
+    def request(self, path, handle, params=None, headers=None):
+        """GET path and return handle(response), read while the response streams.
+
+        Connection errors, timeouts, broken bodies and RETRY_STATUSES answers
+        are retried up to `retries` times with exponential backoff; the last
+        retryable answer is handed to handle like any other.
+        """
+        url = f'{self.base_url}/{path.lstrip("/")}'
+        for attempt in range(self.retries + 1):
+            last = attempt == self.retries
+            try:
+                with self.session.get(url, params=params, headers=headers, stream=True,
+                                      timeout=self.timeout) as response:
+                    if response.status_code in RETRY_STATUSES and not last:
+                        delay = self._delay(attempt, response)
+                    else:
+                        return handle(response)
+            except RETRY_EXCEPTIONS:
+                if last:
+                    raise
+                delay = self._delay(attempt)
+            time.sleep(delay)
+
+    def get_json(self, path, params=None):
+        def handle(response):
+            if response.status_code != 200:
+                raise ValueError(f"API request failed with status code {response.status_code}")
+            return response.json()
+        return self.request(path, handle, params)
+
+    def get_frame(self, path, params=None, headers=None, column_types=None, batch_size=DEFAULT_BATCH_SIZE,
+                  max_bytes=None, progress=None, budget=None):
+        """(response headers, DataFrame) of an Arrow or NDJSON endpoint; the frame is None on 304 Not Modified
+
+        max_bytes caps this response's buffered columns; a ByteBudget caps
+        them together with other downloads instead.
+        """
+        kwargs = {'column_types': column_types} if column_types is not None else {}
+        headers = {'Accept': FRAME_ACCEPT, **(headers or {})}
+
+        def handle(response):
+            if response.status_code == 304:
+                return response.headers, None
+            if response.status_code == 412:
+                raise DataChanged(path)
+            if response.status_code != 200:
+                raise ValueError(f"API request failed with status code {response.status_code}")
+            attempt = budget.attempt() if budget is not None else None
+            try:
+                if response.headers.get('Content-Type', '').startswith(ARROW_STREAM):
+                    response.raw.decode_content = True
+                    return response.headers, read_arrow_frame(
+                        response.raw, max_bytes=max_bytes, progress=progress, budget=attempt, **kwargs
+                    )
+                return response.headers, read_ndjson_frame(
+                    response.iter_lines(chunk_size=STREAM_CHUNK_BYTES),
+                    batch_size=batch_size, max_bytes=max_bytes, progress=progress, budget=attempt, **kwargs
+                )
+            except RETRY_EXCEPTIONS:
+                # The exchange is retried from scratch; other errors keep their
+                # bytes charged so the remaining shards still stop at the ceiling
+                if attempt is not None:
+                    attempt.release()
+                raise
+        return self.request(path, handle, params, headers)
+
+    def fetch_details(self, since=None, headers=None, batch_size=DEFAULT_BATCH_SIZE, max_bytes=None, progress=None):
+        """(headers, DataFrame) of /collection-details/ rows, fetched in concurrent shards.
+
+        headers may carry If-None-Match/If-Modified-Since validators: they are
+        checked against /collection-stats/ (same data version), and when it
+        answers 304 the frame is None and no rows are downloaded. Every shard
+        is requested with If-Match on the version the plan was made for; if
+        the data changes mid-download the whole download starts over.
+        since: only rows with fechaCobroBanco after it.
+        max_bytes: ceiling on the columns buffered by all shards together; once
+        it is passed the download stops and MemoryLimitExceeded is raised.
+        progress: called as progress(rows, bytes_read) with totals over all shards.
+        """
+        for attempt in range(self.retries + 1):
+            stats_headers, years = self.request('/collection-stats/', self._read_years, headers=headers)
+            if years is None:
+                return stats_headers, None
+
+            plan = shard_plan(years, since, self.months_per_shard)
+            etag = stats_headers.get('ETag')
+            # Compressed responses carry a weak ETag, but If-Match only takes strong ones
+            shard_headers = {'If-Match': etag.removeprefix('W/')} if etag else None
+            shard_progress = _ProgressTotals(progress) if progress is not None else None
+            # One running total over every shard, finished ones included
+            budget = ByteBudget(max_bytes) if max_bytes is not None else None
+
+            def fetch(index, params):
+                _, frame = self.get_frame(
+                    '/collection-details/', params, shard_headers, batch_size=batch_size, budget=budget,
+                    progress=shard_progress.for_shard(index) if shard_progress is not None else None
+                )
+                return frame
+
+            try:
+                frames = self._run_shards(fetch, plan)
+            except DataChanged:
+                if attempt == self.retries:
+                    raise
+                continue
+            return stats_headers, concat_frames(frames)
+
+    def _run_shards(self, fetch, plan):
+        """fetch(index, params) for every shard on the thread pool, results in plan order.
+
+        The first shard to fail cancels the shards that have not started;
+        running ones stop at their next batch if the byte budget was the
+        cause, and are waited for otherwise.
+        """
+        executor = ThreadPoolExecutor(max_workers=min(self.workers, len(plan)), thread_name_prefix='api-fetch')
+        try:
+            futures = [executor.submit(fetch, index, params) for index, params in enumerate(plan)]
+            done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+            for future in futures:
+                if future in done and future.exception() is not None:
+                    raise future.exception()
+            return [future.result() for future in futures]
+        finally:
+            executor.shutdown(cancel_futures=True)
+
+    @staticmethod
+    def _read_years(response):
+        if response.status_code == 304:
+            return response.headers, None
+        if response.status_code != 200:
+            raise ValueError(f"API request failed with status code {response.status_code}")
+        return response.headers, sorted(int(year) for year in response.json())
+
+
+class _ProgressTotals:
+    """Adds up per-shard progress(rows, bytes_read) calls into totals over all shards"""
+
+    def __init__(self, progress):
+        self.progress = progress
+        self.lock = threading.Lock()
+        self.shards = {}
+
+    def for_shard(self, index):
+        def progress(rows, bytes_read):
+            with self.lock:
+                self.shards[index] = (rows, bytes_read)
+                self.progress(sum(rows for rows, _ in self.shards.values()),
+                              sum(read for _, read in self.shards.values()))
+        return progress
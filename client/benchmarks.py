@@ -0,0 +1,246 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import requests
+
+import datathon
+from api_client import API_URL, ARROW_STREAM, ApiClient
+from datathon import process_credits_optimized
+from reports import write_report
+from scheduler import schedule_collections
+from schema import compact
+from synthetic import credits_for_rows, generate_history, iter_history, write_csv
+
+CURRENT_DATE = datetime(2025, 6, 1)
+
+# Named benchmark scales, in rows
+SCALES = {'10k': 10_000, '1M': 1_000_000, '10M': 10_000_000}
+
+
+def bench_sharding(df, worker_counts, repeat=3):
+    """Best-of-`repeat` scoring time of a compact df for each worker count"""
+    results = []
+    for workers in worker_counts:
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            process_credits_optimized(df, CURRENT_DATE, workers=workers, cents=True)
+            timings.append(time.perf_counter() - start)
+        results.append((workers, min(timings)))
+    return results
+
+
+# Accept header that selects each /collection-details/ format
+FRAME_FORMATS = {'ndjson': 'application/x-ndjson', 'arrow': ARROW_STREAM}
+
+
+def bench_formats(params, repeat=3):
+    """Best-of-`repeat` (format, seconds, CPU seconds, rows) of downloading and decoding collection details"""
+    results = []
+    with ApiClient(workers=1) as client:
+        for name, accept in FRAME_FORMATS.items():
+            timings = []
+            for _ in range(repeat):
+                start, cpu = time.perf_counter(), time.process_time()
+                _, df = client.get_frame('/collection-details/', params, {'Accept': accept})
+                timings.append((time.perf_counter() - start, time.process_time() - cpu))
+            seconds, cpu = min(timings)
+            results.append((name, seconds, cpu, len(df)))
+    return results
+
+
+@contextlib.contextmanager
+def _timed(results, scale, stage, rows=None):
+    """Append {'scale', 'stage', 'seconds', 'rows'} for the wrapped block to results"""
+    record = {'scale': scale, 'stage': stage, 'rows': rows}
+    start = time.perf_counter()
+    yield record
+    record['seconds'] = time.perf_counter() - start
+    if record['rows']:
+        record['rows_per_s'] = record['rows'] / record['seconds']
+    results.append(record)
+    print(f"  {stage:<18} {record['seconds']:>9.3f}s" + (f"  {record['rows']:>12,} rows" if record['rows'] else ''))
+
+
+def run_suite(scales, workdir, server_dir=None, use_api=False, seed=0):
+    """Time every stage at each scale; returns a list of result records.
+
+    Ingestion runs `manage.py load_cobranza` in server_dir against its
+    configured database; the API stages call CREDIFIEL_API_URL, which
+    should serve that same, initially empty, database (fetch and scoring
+    then see every scale loaded so far). Without them only the client
+    stages run, on the generated frame.
+    """
+    results = []
+    for scale in scales:
+        rows = SCALES[scale]
+        n_credits = credits_for_rows(rows)
+        print(f"{scale} ({n_credits:,} credits)")
+
+        with _timed(results, scale, 'generate') as record:
+            df = generate_history(n_credits, seed=seed)
+            record['rows'] = len(df)
+
+        with _timed(results, scale, 'compact', len(df)):
+            df = compact(df)
+
+        if server_dir is not None:
+            path = os.path.join(workdir, f'cobranza_{scale}_{seed}.csv')
+            write_csv(iter_history(n_credits, seed=seed), path)
+            with _timed(results, scale, 'ingest', len(df)):
+                subprocess.run(
+                    [sys.executable, 'manage.py', 'load_cobranza', path, '--batch-size', '100000'],
+                    cwd=server_dir, check=True, stdout=subprocess.DEVNULL,
+                )
+
+        if use_api:
+            for stage in ['stats_api', 'stats_api_cached']:
+                with _timed(results, scale, stage):
+                    requests.get(f'{API_URL}/collection-stats/').raise_for_status()
+            with _timed(results, scale, 'fetch') as record:
+                df = datathon.fetch_data_from_api(cache_path=None)
+                record['rows'] = len(df)
+
+        with _timed(results, scale, 'scoring', len(df)):
+            output_df, points_map = process_credits_optimized(df, CURRENT_DATE, cents=True)
+
+        with _timed(results, scale, 'schedule', len(output_df)):
+            schedule_collections(output_df)
+
+        with _timed(results, scale, 'excel', len(output_df)):
+            write_report(output_df, os.path.join(workdir, 'processed_credits'))
+
+        # create_visualizations writes into the working directory
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            with _timed(results, scale, 'charts', len(df)):
+                datathon.create_visualizations(df, output_df, points_map, cents=True)
+        finally:
+            os.chdir(cwd)
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_results(current, baseline, tolerance=0.10):
+    """(scale, stage, baseline s, current s, ratio, regressed) for stages present in both runs"""
+    previous = {(r['scale'], r['stage']): r['seconds'] for r in baseline['results']}
+    rows = []
+    for record in current['results']:
+        before = previous.get((record['scale'], record['stage']))
+        if before is None:
+            continue
+        ratio = record['seconds'] / before if before else float('inf')
+        rows.append((record['scale'], record['stage'], before, record['seconds'], ratio, ratio > 1 + tolerance))
+    return rows
+
+
+def suite_main(args):
+    scales = args.scales.split(',')
+    unknown = [scale for scale in scales if scale not in SCALES]
+    if unknown:
+        sys.exit(f"Unknown scales: {', '.join(unknown)} (choose from {', '.join(SCALES)})")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        results = run_suite(scales, workdir, server_dir=args.server_dir, use_api=args.api, seed=args.seed)
+
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'git_commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'seed': args.seed,
+        'results': results,
+    }
+    output = args.output or f"benchmark_{datetime.now():%Y%m%d_%H%M%S}.json"
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results saved to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        comparison = compare_results(report, baseline, args.tolerance)
+        print(f"\n{'scale':<6} {'stage':<18} {'before s':>9} {'now s':>9} {'ratio':>7}")
+        for scale, stage, before, now, ratio, regressed in comparison:
+            flag = '  REGRESSION' if regressed else ''
+            print(f"{scale:<6} {stage:<18} {before:>9.3f} {now:>9.3f} {ratio:>6.2f}x{flag}")
+        if any(row[-1] for row in comparison):
+            sys.exit(1)
+
+
+def sharding_main(args):
+    df = compact(generate_history(args.credits, payments_per_credit=args.rows_per_credit))
+    worker_counts = [1]
+    while worker_counts[-1] * 2 <= args.max_workers:
+        worker_counts.append(worker_counts[-1] * 2)
+    if worker_counts[-1] != args.max_workers:
+        worker_counts.append(args.max_workers)
+
+    print(f"Scoring {len(df)} rows / {args.credits} credits")
+    print(f"{'workers':>8} {'seconds':>10} {'speedup':>8}")
+    results = bench_sharding(df, worker_counts, args.repeat)
+    baseline = results[0][1]
+    for workers, seconds in results:
+        print(f"{workers:>8} {seconds:>10.3f} {baseline / seconds:>7.2f}x")
+
+
+def formats_main(args):
+    params = dict(param.split('=', 1) for param in args.param)
+    print(f"/collection-details/ {params or ''} from {API_URL}, best of {args.repeat}")
+    print(f"{'format':<7} {'seconds':>9} {'cpu s':>8} {'rows':>10}")
+    for name, seconds, cpu, rows in bench_formats(params, args.repeat):
+        print(f"{name:<7} {seconds:>9.3f} {cpu:>8.3f} {rows:>10,}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Credifiel benchmarks')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    suite = commands.add_parser('suite', help='End-to-end stage timings at fixed scales, saved as JSON')
+    suite.add_argument('--scales', default='10k', help=f"Comma-separated, from {', '.join(SCALES)} (default: 10k)")
+    suite.add_argument('--server-dir', help='Django project to run load_cobranza in (enables the ingest stage)')
+    suite.add_argument('--api', action='store_true', help='Also time the stats API and fetching from CREDIFIEL_API_URL')
+    suite.add_argument('--seed', type=int, default=0)
+    suite.add_argument('--output', help='JSON results file (default: benchmark_<timestamp>.json)')
+    suite.add_argument('--compare', help='Earlier results file; exit 1 if a stage got slower than --tolerance')
+    suite.add_argument('--tolerance', type=float, default=0.10, help='Allowed slowdown ratio (default: 0.10)')
+    suite.set_defaults(run=suite_main)
+
+    sharding = commands.add_parser('sharding', help='Scoring time by number of worker processes')
+    sharding.add_argument('--credits', type=int, default=200_000)
+    sharding.add_argument('--rows-per-credit', type=int, default=10)
+    sharding.add_argument('--max-workers', type=int, default=os.cpu_count())
+    sharding.add_argument('--repeat', type=int, default=3)
+    sharding.set_defaults(run=sharding_main)
+
+    formats = commands.add_parser('formats', help='Download and decode time of NDJSON and Arrow collection details')
+    formats.add_argument('--param', action='append', default=[], metavar='NAME=VALUE',
+                         help='Query parameter to send, e.g. --param year=2024 (repeatable)')
+    formats.add_argument('--repeat', type=int, default=3)
+    formats.set_defaults(run=formats_main)
+
+    args = parser.parse_args(argv)
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""Chart rendering for datathon.py.
+
+matplotlib and seaborn are only imported when a chart is actually drawn,
+so runs without charts (or with unchanged data) never pay for them.
+"""
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from schema import compact, pesos
+
+# Bump to re-render every chart after changing how they are drawn
+CHART_VERSION = 1
+
+# Chart hashes of the last run, kept next to the PNG files
+HASHES_FILE = '.chart_hashes.json'
+
+POINTS_BINS = 20
+
+
+def summarize_for_charts(df, points_map, bank_names, cents=False):
+    """The small frames every chart is drawn from, computed in one pass over df
+
+    cents: whether df's amounts are already cents rather than pesos.
+    """
+    df = compact(df, cents=cents)
+    dated = df[df['fechaCobroBanco'].notna()]
+    month = dated['fechaCobroBanco'].to_numpy().astype('datetime64[M]')
+    monthly = (
+        dated.assign(paid=dated['montoCobrado'] > 0)
+        .groupby(month)
+        .agg(montoCobrado=('montoCobrado', 'sum'), montoCobrar=('montoCobrar', 'sum'),
+             attempts=('idCredito', 'count'), paid=('paid', 'sum'))
+    )
+    monthly.index = monthly.index.strftime('%Y-%m')
+    monthly['montoCobrado'] = pesos(monthly['montoCobrado'])
+    monthly['montoCobrar'] = pesos(monthly['montoCobrar'])
+    monthly['success_rate'] = monthly['paid'] / monthly['attempts'] * 100
+
+    bank = df.groupby('idBanco', observed=True)[['montoCobrado', 'montoCobrar']].sum()
+    bank['efficiency'] = bank['montoCobrado'] / bank['montoCobrar'] * 100
+    bank.index = bank.index.astype(object).map(lambda id_banco: bank_names.get(id_banco, str(id_banco)))
+
+    points = np.fromiter(points_map.values(), dtype=float, count=len(points_map))
+    counts, edges = np.histogram(points, bins=POINTS_BINS)
+    histogram = pd.DataFrame({'left': edges[:-1], 'right': edges[1:], 'count': counts})
+
+    return {
+        'monthly_trends': monthly[['montoCobrado', 'montoCobrar']],
+        'bank_efficiency': bank[['efficiency']],
+        'points_distribution': histogram,
+        'success_rate': monthly[['success_rate']],
+    }
+
+
+def chart_hash(name, data):
+    digest = hashlib.sha1(f'{CHART_VERSION}:{name}:{list(data.columns)}'.encode())
+    digest.update(pd.util.hash_pandas_object(data, index=True).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def _draw(name, data, plt, sns):
+    if name == 'monthly_trends':
+        plt.figure(figsize=(12, 6))
+        plt.plot(data.index, data['montoCobrado'], marker='o', label='Collected')
+        plt.plot(data.index, data['montoCobrar'], marker='o', label='Expected')
+        plt.title('Monthly Collection Trends')
+        plt.xlabel('Month')
+        plt.ylabel('Amount')
+        plt.xticks(rotation=45)
+        plt.legend()
+    elif name == 'bank_efficiency':
+        plt.figure(figsize=(10, 6))
+        sns.barplot(x=data.index, y=data['efficiency'])
+        plt.title('Collection Efficiency by Bank')
+        plt.xlabel('Bank')
+        plt.ylabel('Efficiency (%)')
+    elif name == 'points_distribution':
+        plt.figure(figsize=(10, 6))
+        edges = np.append(data['left'].to_numpy(), data['right'].to_numpy()[-1:])
+        centers = data.assign(points=(data['left'] + data['right']) / 2)
+        sns.histplot(data=centers, x='points', weights='count', bins=list(edges))
+        plt.title('Distribution of Credit Points')
+        plt.xlabel('Points')
+        plt.ylabel('Frequency')
+    else:
+        plt.figure(figsize=(12, 6))
+        plt.plot(data.index, data['success_rate'], marker='o')
+        plt.title('Monthly Collection Success Rate')
+        plt.xlabel('Month')
+        plt.ylabel('Success Rate (%)')
+        plt.xticks(rotation=45)
+
+
+def render_chart(name, data, path):
+    """Draw one chart to path with the Agg backend; safe to run in a worker process"""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    plt.style.use('ggplot')
+    _draw(name, data, plt, sns)
+    plt.tight_layout()
+    plt.savefig(path)
+    plt.close()
+    return path
+
+
+def _load_hashes(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def render_charts(summaries, output_dir='.', workers=1):
+    """Render the charts whose data changed since the last run; returns their names.
+
+    Charts are skipped when their PNG exists and its data hash matches the
+    one recorded in HASHES_FILE. With workers > 1 they are drawn in a
+    process pool.
+    """
+    hashes_path = os.path.join(output_dir, HASHES_FILE)
+    previous = _load_hashes(hashes_path)
+    hashes = {name: chart_hash(name, data) for name, data in summaries.items()}
+    stale = [
+        name for name in summaries
+        if previous.get(name) != hashes[name] or not os.path.exists(os.path.join(output_dir, f'{name}.png'))
+    ]
+
+    jobs = [(name, summaries[name], os.path.join(output_dir, f'{name}.png')) for name in stale]
+    if workers <= 1 or len(jobs) <= 1:
+        for job in jobs:
+            render_chart(*job)
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as executor:
+            list(executor.map(render_chart, *zip(*jobs)))
+
+    with open(hashes_path, 'w') as f:
+        json.dump(hashes, f, indent=2)
+    return stale
@@ -1,9 +1,22 @@
+import argparse
+import contextlib
+import json
+import os
 import pandas as pd
-import numpy as np
-from datetime import datetime, timedelta
-import requests
-import matplotlib.pyplot as plt
-import seaborn as sns
+from datetime import datetime
+from api_client import DEFAULT_FETCH_WORKERS, ApiClient, DataChanged
+from charts import render_charts, summarize_for_charts
+from emission import DecisionTable
+from fortnight_calendar import get_calendar, mexican_bank_holidays
+from incremental import STATE_PATH, ScoringState, update_state
+from reports import EXTENSIONS, load_layouts, write_report
+from scheduler import load_capacities, schedule_collections
+from schema import SCHEMA_VERSION, compact, is_cents, pesos, print_memory_report, to_cents
+from ingest import DEFAULT_BATCH_SIZE, SCORE_COLUMN_TYPES, print_progress
+from profiling import PROFILERS, Profiler, stage
+from scoring import SUMMARY_COLUMNS, summarize_credits
+from sharding import default_workers, process_credits_sharded
+from snapshot import SNAPSHOT_DIR, Snapshot
 
 # Constants for bank fees
 BBVA_COBRAR_MISMO = 1.6
@@ -13,6 +26,9 @@ BANAMEX_COBRAR_MISMO = 1.75
 BBVA_INTERBANCARIO = 6
 BBVA_MATUTINO= 8
 
+# Last full /collection-details/ download and its ETag/Last-Modified, reused on 304
+RESPONSE_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'collection_details.pkl')
+
 # Bank ID mapping
 BANK_MAPPING = {
     12: 'bbvaMexico',
@@ -43,248 +59,527 @@ EMISOR_MAPPING = {
     'bbva_matutino': '05503'
 }
 
-def create_visualizations(df, output_df, points_map):
-    """Create and save visualizations"""
-    # Set the style for all plots
-    plt.style.use('ggplot')  # Using ggplot style instead of seaborn
-    
-    # 1. Monthly Collection Trends
-    plt.figure(figsize=(12, 6))
-    monthly_data = df.groupby(df['fechaCobroBanco'].dt.to_period('M')).agg({
-        'montoCobrado': 'sum',
-        'montoCobrar': 'sum'
-    }).reset_index()
-    monthly_data['fechaCobroBanco'] = monthly_data['fechaCobroBanco'].astype(str)
-    
-    plt.plot(monthly_data['fechaCobroBanco'], monthly_data['montoCobrado'], marker='o', label='Collected')
-    plt.plot(monthly_data['fechaCobroBanco'], monthly_data['montoCobrar'], marker='o', label='Expected')
-    plt.title('Monthly Collection Trends')
-    plt.xlabel('Month')
-    plt.ylabel('Amount')
-    plt.xticks(rotation=45)
-    plt.legend()
-    plt.tight_layout()
-    plt.savefig('monthly_trends.png')
-    plt.close()
-
-    # 2. Collection Efficiency by Bank
-    plt.figure(figsize=(10, 6))
-    bank_efficiency = df.groupby('idBanco').agg({
-        'montoCobrado': 'sum',
-        'montoCobrar': 'sum'
-    })
-    bank_efficiency['efficiency'] = (bank_efficiency['montoCobrado'] / bank_efficiency['montoCobrar']) * 100
-    bank_efficiency.index = bank_efficiency.index.map(lambda x: BANK_MAPPING.get(x, str(x)))
-    
-    sns.barplot(x=bank_efficiency.index, y=bank_efficiency['efficiency'])
-    plt.title('Collection Efficiency by Bank')
-    plt.xlabel('Bank')
-    plt.ylabel('Efficiency (%)')
-    plt.tight_layout()
-    plt.savefig('bank_efficiency.png')
-    plt.close()
-
-    # 3. Points Distribution
-    plt.figure(figsize=(10, 6))
-    points_series = pd.Series(points_map)
-    sns.histplot(points_series, bins=20)
-    plt.title('Distribution of Credit Points')
-    plt.xlabel('Points')
-    plt.ylabel('Frequency')
-    plt.tight_layout()
-    plt.savefig('points_distribution.png')
-    plt.close()
-
-    # 4. Monthly Collection Success Rate
-    plt.figure(figsize=(12, 6))
-    monthly_success = df.groupby(df['fechaCobroBanco'].dt.to_period('M')).agg({
-        'idCredito': 'count',
-        'montoCobrado': lambda x: (x > 0).sum()
-    })
-    monthly_success['success_rate'] = (monthly_success['montoCobrado'] / monthly_success['idCredito']) * 100
-    monthly_success.index = monthly_success.index.astype(str)
-    
-    plt.plot(monthly_success.index, monthly_success['success_rate'], marker='o')
-    plt.title('Monthly Collection Success Rate')
-    plt.xlabel('Month')
-    plt.ylabel('Success Rate (%)')
-    plt.xticks(rotation=45)
-    plt.tight_layout()
-    plt.savefig('success_rate.png')
-    plt.close()
-
-def fetch_data_from_api():
-    """Fetch data from Django API and convert to DataFrame"""
+# The constants above as a decision table, used when none is fetched from the
+# API; the server's configuracion app seeds the same rules
+DEFAULT_DECISION_TABLE = DecisionTable({
+    'emisiones': [
+        {'nombre': name, 'idEmisor': EMISOR_MAPPING[name], 'comision': fee,
+         'horaCobro': '{hour:02d}:{minute:02d}'.format(**COLLECTION_HOURS[name])}
+        for name, fee in [
+            ('bbva_matutino', BBVA_MATUTINO),
+            ('bbva_cobrar_mismo', BBVA_COBRAR_MISMO),
+            ('bbva_interbancario', BBVA_INTERBANCARIO),
+            ('santander_cobrar_mismo', SANTANDER_COBRAR_MISMO),
+            ('banamex_cobrar_mismo', BANAMEX_COBRAR_MISMO),
+            ('banamex_interbancario', BANAMEX_INTERBANCARIO),
+        ]
+    ],
+    'reglas': [
+        {'orden': 10, 'emision': 'bbva_matutino', 'idBanco': 12, 'bancosExcluidos': [], 'emisoresPrevios': MORNING_EMISORS, 'soloIncumplidos': False},
+        {'orden': 20, 'emision': 'bbva_cobrar_mismo', 'idBanco': 12, 'bancosExcluidos': [], 'emisoresPrevios': [], 'soloIncumplidos': False},
+        {'orden': 30, 'emision': 'bbva_interbancario', 'idBanco': None, 'bancosExcluidos': [12], 'emisoresPrevios': [], 'soloIncumplidos': True},
+        {'orden': 40, 'emision': 'santander_cobrar_mismo', 'idBanco': 14, 'bancosExcluidos': [], 'emisoresPrevios': [], 'soloIncumplidos': False},
+        {'orden': 50, 'emision': 'banamex_cobrar_mismo', 'idBanco': 2, 'bancosExcluidos': [], 'emisoresPrevios': [], 'soloIncumplidos': False},
+        {'orden': 60, 'emision': 'banamex_interbancario', 'idBanco': None, 'bancosExcluidos': [], 'emisoresPrevios': [], 'soloIncumplidos': False},
+    ],
+})
+
+def create_visualizations(df, output_df, points_map, output_dir='.', workers=1, cents=False):
+    """Create and save visualizations; returns the names of the charts that were redrawn"""
+    return render_charts(summarize_for_charts(df, points_map, BANK_MAPPING, cents), output_dir, workers)
+
+def _load_validators(cache_path):
+    """ETag/Last-Modified of the cached full download, or {} when there is none"""
     try:
-        response = requests.get('http://localhost:8000/api/collection-stats/')
-        if response.status_code != 200:
-            raise ValueError(f"API request failed with status code {response.status_code}")
-        
-        data = response.json()
-        
-        # Convert the API data into a format similar to our original CSV structure
-        all_records = []
-        for year, year_data in data.items():
-            for month_data in year_data:
-                # Skip records with None month
-                if month_data['month'] is None:
-                    continue
-                    
-                record = {
-                    'idListaCobro': int(year),
-                    'idCredito': month_data['month'],
-                    'consecutivoCobro': f"{year}-{month_data['month']}",
-                    'idBanco': 12,  # Default to BBVA
-                    'montoExigible': float(month_data['total_por_cobrar']),
-                    'montoCobrar': float(month_data['total_por_cobrar']),
-                    'montoCobrado': float(month_data['total_cobrado']),
-                    'fechaCobroBanco': f"{year}-{month_data['month']:02d}-01",
-                    'idRespuestaBanco': None
-                }
-                all_records.append(record)
-        
-        df = pd.DataFrame(all_records)
-        df['fechaCobroBanco'] = pd.to_datetime(df['fechaCobroBanco'])
-        return df.sort_values(['idCredito', 'fechaCobroBanco'])
+        with open(cache_path + '.json') as f:
+            validators = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    # Frames cached with an older schema must be downloaded again
+    if validators.pop('schema', None) != SCHEMA_VERSION:
+        return {}
+    return validators if os.path.exists(cache_path) else {}
+
+
+def _save_response(df, headers, cache_path):
+    validators = {name: headers[name] for name in ['ETag', 'Last-Modified'] if name in headers}
+    if not validators:
+        return
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    df.to_pickle(cache_path)
+    with open(cache_path + '.json', 'w') as f:
+        json.dump({**validators, 'schema': SCHEMA_VERSION}, f)
+
+
+# Sent with /collection-details/?after_id=: the id the next request resumes after
+LAST_ID_HEADER = 'X-Last-Id'
+# Sent with /collection-stats/: rows stored and edits made to stored rows so far
+ROW_COUNT_HEADER = 'X-Row-Count'
+EDIT_COUNT_HEADER = 'X-Edit-Count'
+
+
+def _api_client(client):
+    """Context manager yielding client, or a new ApiClient that is closed on exit"""
+    return contextlib.nullcontext(client) if client is not None else ApiClient()
+
+
+def _get_details(client, since, headers, batch_size=DEFAULT_BATCH_SIZE, max_memory_mb=None, progress=None):
+    """(response headers, DataFrame) of collection detail rows; the frame is None on 304 Not Modified"""
+    max_bytes = max_memory_mb * 2**20 if max_memory_mb is not None else None
+    with _api_client(client) as client:
+        response_headers, df = client.fetch_details(since, headers, batch_size, max_bytes, progress)
+    if df is None:
+        return response_headers, None
+    return response_headers, df.sort_values(['idCredito', 'fechaCobroBanco'])
+
+
+def fetch_data_from_api(since=None, batch_size=DEFAULT_BATCH_SIZE, max_memory_mb=None, progress=None,
+                        cache_path=RESPONSE_CACHE_PATH, client=None):
+    """Fetch collection detail rows from the Django API as a DataFrame
+
+    Rows are downloaded in date-range shards over concurrent pooled
+    connections (see api_client.ApiClient). Each body is read line by line
+    and parsed in batches of batch_size rows straight into typed columns,
+    so peak memory stays close to the size of the final frame.
+
+    Full downloads are kept at cache_path and revalidated with
+    If-None-Match/If-Modified-Since; when the server answers 304 Not Modified
+    the cached frame is returned without transferring any rows.
+
+    since: when given, only rows with fechaCobroBanco after it are returned.
+    max_memory_mb: abort once the buffered columns grow past this many MiB.
+    progress: optional callable(rows, bytes_read) invoked after each batch.
+    cache_path: where full downloads are cached; None disables the cache.
+    client: ApiClient to use (default: a new one with its default settings).
+    """
+    if since is not None:
+        # Incremental windows change every run, caching them buys nothing
+        cache_path = None
+
+    headers = {}
+    if cache_path is not None:
+        validators = _load_validators(cache_path)
+        if 'ETag' in validators:
+            headers['If-None-Match'] = validators['ETag']
+        if 'Last-Modified' in validators:
+            headers['If-Modified-Since'] = validators['Last-Modified']
+
+    try:
+        response_headers, df = _get_details(client, since, headers, batch_size, max_memory_mb, progress)
+        if df is None:
+            print("Collection data not modified, using cached download")
+            return pd.read_pickle(cache_path)
+        if cache_path is not None:
+            _save_response(df, response_headers, cache_path)
+        return df
     
     except Exception as e:
         print(f"Error fetching data from API: {e}")
         raise
 
-def get_emision_elegida(id_banco, points, monto_exigible, monto_cobrado, last_emisor_id=None):
-    """Determine which emission to use based on bank ID and conditions"""
-    # If last payment was with a morning collection method, force morning collection
-    if last_emisor_id in MORNING_EMISORS:
-        if id_banco == 12:
-            return 'bbva_matutino', BBVA_MATUTINO
-    
-    if id_banco == 12:
-        return 'bbva_cobrar_mismo', BBVA_COBRAR_MISMO
-    
-    elif points < 0 or (monto_exigible != monto_cobrado and id_banco != 12):
-        return 'bbva_interbancario', BBVA_INTERBANCARIO
-    
-    elif id_banco == 14:
-        return 'santander_cobrar_mismo', SANTANDER_COBRAR_MISMO
-    elif id_banco == 2:
-        return 'banamex_cobrar_mismo', BANAMEX_COBRAR_MISMO
-    else:
-        return 'banamex_interbancario', BANAMEX_INTERBANCARIO
+def fetch_with_snapshot(refresh=False, directory=SNAPSHOT_DIR, batch_size=DEFAULT_BATCH_SIZE, max_memory_mb=None,
+                        progress=None, client=None):
+    """Collection detail rows from the local snapshot plus the rows the server added since
+
+    The server is asked for the rows added after the snapshot's id cursor,
+    whatever their dates, with the snapshot's ETag; a 304 means the data
+    version has not changed and nothing is downloaded. When the server's
+    edit count moved, or the snapshot and the added rows do not add up to
+    its row count, rows already in the snapshot were changed or deleted and
+    the full history is downloaded again, as refresh=True does.
+    """
+    fetch_kwargs = {'batch_size': batch_size, 'max_memory_mb': max_memory_mb, 'progress': progress}
+    snapshot = None if refresh else Snapshot.load(directory)
+    with _api_client(client) as client:
+        if snapshot is None:
+            print("No usable snapshot, fetching full history...")
+        else:
+            fetched = fetch_added_rows(client, snapshot.last_id, if_none_match=snapshot.etag, **fetch_kwargs)
+            if fetched is None:
+                print(f"Collection data not modified, reading {snapshot.rows:,} rows from snapshot")
+                return snapshot.read()
+            etag, _, rows, edits, last_id, delta = fetched
+            if edits == snapshot.edits and snapshot.rows + len(delta) == rows:
+                print(f"Fetched {len(delta):,} rows added after id {snapshot.last_id}")
+                snapshot.append(delta, etag, last_id)
+                return snapshot.read()
+            print("Rows in the snapshot were changed or deleted, fetching full history...")
+
+        etag, _, _, edits, last_id, df = fetch_added_rows(client, 0, **fetch_kwargs)
+    snapshot = snapshot or Snapshot.load(directory) or Snapshot(directory)
+    snapshot.replace(df, etag, last_id, edits)
+    return df.reset_index(drop=True)
+
+OUTPUT_COLUMNS = [
+    'idCredito', 'idEmisor', 'montoExigible', 'montoACobrar',
+    'emisionUsada', 'points', 'Parcial', 'Date'
+]
+
+def select_emisiones(id_banco, points, monto_exigible, monto_cobrado, last_emisor_id, table=None):
+    """Emission names and fees per credit, chosen by the first matching rule of the decision table"""
+    return (table or DEFAULT_DECISION_TABLE).select(id_banco, points, monto_exigible, monto_cobrado, last_emisor_id)
 
-def process_credits_optimized(df, current_date=None):
-    """Process all credits in a single pass, calculating points and generating output"""
+def credits_output(credits, holidays=None, table=None):
+    """Pick emission and collection date for summarized credits
+
+    credits: summary with amounts in cents, as summarize_credits
+    returns for compact frames and /credit-scores/ is read.
+    table: emission DecisionTable (default: DEFAULT_DECISION_TABLE); credits
+    no rule matches are not collected.
+    Returns the output DataFrame (amounts in pesos) and the points map keyed
+    by idCredito.
+    """
+    if table is None:
+        table = DEFAULT_DECISION_TABLE
+    points = credits['points']
+    last_fechas = credits['fechaCobroBanco']
+
+    points_map = dict(zip(credits.index.tolist(), points.tolist()))
+    if credits.empty:
+        return pd.DataFrame([]), points_map
+
+    for column in ['monto', 'montoExigible']:
+        if not is_cents(credits[column]):
+            raise ValueError(f"Credit {column} holds {credits[column].dtype} values, not integer cents")
+    # The fees and the report are in pesos
+    monto = pesos(credits['monto'])
+
+    with stage('select_emissions', len(credits)):
+        emision_name, emision_fee = select_emisiones(
+            credits['idBanco'], points,
+            credits['montoExigible'], credits['montoCobrado'], credits['lastEmisor'], table
+        )
+
+    # Only credits whose last attempt was paid in full get a collection date
+    paid_in_full = (
+        credits['montoExigible'].notna()
+        & credits['montoCobrado'].notna()
+        & (credits['montoCobrar'] == credits['montoCobrado'])
+        & last_fechas.notna()
+    )
+    # Unmatched credits have a NaN fee, which never compares greater
+    cobrar = pesos(credits['montoExigible']) > emision_fee
+    selected = cobrar & (monto > 0) & paid_in_full
+
+    if not selected.any():
+        return pd.DataFrame([]), points_map
+
+    emision_name = emision_name[selected]
+    fechas_sel = last_fechas[selected]
+    with stage('collection_dates', len(fechas_sel)):
+        # Keep seconds from the original timestamp; hour and minute come from the emission window
+        hours = emision_name.map(lambda name: table.hours[name]['hour'])
+        minutes = emision_name.map(lambda name: table.hours[name]['minute'])
+        fecha_cobro = (
+            get_calendar(fechas_sel, holidays).snap(fechas_sel)
+            + pd.to_timedelta(hours * 60 + minutes, unit='m')
+            + (fechas_sel - fechas_sel.dt.floor('min'))
+        )
+
+    output_df = pd.DataFrame({
+        # Ids are int32 while scoring; the report keeps the API's int64
+        'idCredito': credits.index[selected.to_numpy()].astype('int64'),
+        'idEmisor': emision_name.map(table.emisores).to_numpy(),
+        'montoExigible': monto[selected].to_numpy(),
+        'montoACobrar': monto[selected].to_numpy(),
+        'emisionUsada': emision_name.to_numpy(),
+        'points': points[selected].to_numpy(),
+        'Parcial': ((points <= 0) | (monto > 10000))[selected].to_numpy(),
+        'Date': fecha_cobro.to_numpy(),
+    }, columns=OUTPUT_COLUMNS)
+
+    return output_df, points_map
+
+def process_credits_optimized(df, current_date=None, holidays=None, workers=1, table=None, cents=False):
+    """Process all credits in a single pass, calculating points and generating output
+
+    holidays: optional callable year -> dates that collection dates must avoid
+    (e.g. mexican_bank_holidays); weekends are always avoided.
+    workers: when greater than 1, credits are sharded by idCredito hash and
+    scored in that many processes; results match a single-process run.
+    table: emission DecisionTable, see credits_output.
+    cents: whether df's amounts are already cents (frames from the API and
+    snapshots) rather than pesos.
+    """
     if current_date is None:
         current_date = datetime.now()
-    
-    output_data = []
-    points_map = {}
-
-    for id_credito, credit_group in df.groupby('idCredito'):
-        points = 0
-        monto = float(credit_group['montoExigible'].sum())
-        monto = monto - float(credit_group['montoCobrado'].sum())
-        id_banco = credit_group.iloc[0]['idBanco']
-        last_emisor_id = None
-        
-        # Get the last successful payment's emisor ID
-        last_payment = credit_group[credit_group['montoCobrado'] > 0].iloc[-1] if len(credit_group[credit_group['montoCobrado'] > 0]) > 0 else None
-        if last_payment is not None and not pd.isna(last_payment['idRespuestaBanco']):
-            last_emisor_id = last_payment['idRespuestaBanco']
-        
-        for idx, row in credit_group.iterrows():
-            record_date = row['fechaCobroBanco']
-            if pd.isna(record_date):
-                months_diff = float('inf')
+
+    # Scoring compares and sums amounts in cents, whatever unit df holds
+    if df['idCredito'].isna().any():
+        df = df[df['idCredito'].notna()]
+    df = compact(df, cents=cents)
+
+    if workers > 1:
+        return process_credits_sharded(
+            df, process_credits_optimized, workers,
+            current_date=current_date, holidays=holidays, table=table, cents=True
+        )
+
+    with stage('summarize', len(df)):
+        credits = summarize_credits(df, current_date)
+    with stage('output', len(credits)):
+        return credits_output(credits, holidays, table)
+
+def fetch_scores_from_api(current_date, batch_size=DEFAULT_BATCH_SIZE, max_memory_mb=None, progress=None,
+                          client=None):
+    """Per-credit summary computed by the server's /credit-scores/ endpoint
+
+    Returns the same frame as scoring.summarize_credits, without downloading
+    any collection rows.
+    """
+    max_bytes = max_memory_mb * 2**20 if max_memory_mb is not None else None
+    params = {'date': pd.Timestamp(current_date).isoformat()}
+    with _api_client(client) as client:
+        _, scores = client.get_frame('/credit-scores/', params, column_types=SCORE_COLUMN_TYPES,
+                                     batch_size=batch_size, max_bytes=max_bytes, progress=progress)
+    return scores.set_index('idCredito')[SUMMARY_COLUMNS]
+
+def process_credits_on_server(current_date=None, holidays=None, table=None, **fetch_kwargs):
+    """Score credits with the server's SQL scorer; only the emission dates are computed here"""
+    if current_date is None:
+        current_date = datetime.now()
+    with stage('fetch_scores') as record:
+        credits = fetch_scores_from_api(current_date, **fetch_kwargs)
+        record['rows'] = len(credits)
+    with stage('output', len(credits)):
+        return credits_output(credits, holidays, table)
+
+def fetch_decision_table(client=None):
+    """The emission rules and fees configured on the server, as a DecisionTable"""
+    with _api_client(client) as client:
+        return DecisionTable(client.get_json('/emission-table/'))
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Score credits and build the collection report')
+    parser.add_argument('--bank-holidays', action='store_true',
+                        help='Also roll collection dates back off Mexican bank holidays')
+    parser.add_argument('--workers', type=int, default=default_workers(),
+                        help='Processes used to score credits (default: $DATATHON_WORKERS or 1)')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help='Rows parsed per batch while streaming from the API')
+    parser.add_argument('--fetch-workers', type=int, default=DEFAULT_FETCH_WORKERS,
+                        help='Concurrent connections downloading collection rows in date-range shards '
+                             '(default: $DATATHON_FETCH_WORKERS or 1)')
+    parser.add_argument('--max-memory-mb', type=int,
+                        default=int(os.getenv('DATATHON_MAX_MEMORY_MB', '0')) or None,
+                        help='Abort the fetch when buffered data exceeds this many MiB '
+                             '(default: $DATATHON_MAX_MEMORY_MB, unlimited)')
+    parser.add_argument('--format', choices=list(EXTENSIONS), default='xlsx',
+                        help='Report format; fixed writes one bank layout file per emisor (default: xlsx)')
+    parser.add_argument('--layouts',
+                        help='With --format fixed, JSON file of per-emisor layouts '
+                             '(default: the placeholder reports.FIXED_WIDTH_LAYOUTS)')
+    parser.add_argument('--split-by-emisor', action='store_true',
+                        help='Write one report file per idEmisor, in parallel with --workers')
+    parser.add_argument('--no-charts', action='store_true',
+                        help='Skip the PNG charts (matplotlib is never imported)')
+    parser.add_argument('--server-scoring', action='store_true',
+                        help='Let the server compute points per credit instead of downloading every row')
+    parser.add_argument('--schedule', action='store_true',
+                        help='Spread collections over time slots within each bank\'s capacity '
+                             '(slot usage is saved to slot_utilization.csv)')
+    parser.add_argument('--capacities',
+                        help='With --schedule, JSON file of per-emisor capacities (default: scheduler.BANK_CAPACITIES)')
+    parser.add_argument('--max-delay-days', type=int, default=3,
+                        help='With --schedule, days a collection may slip past its date when slots are full')
+    parser.add_argument('--snapshot', action='store_true',
+                        help='Keep fetched rows in a local snapshot and only download rows newer than it')
+    parser.add_argument('--refresh-snapshot', action='store_true',
+                        help='With --snapshot, discard the snapshot and download the full history')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Only fetch rows added since the saved scoring state and update it')
+    parser.add_argument('--full-rescore', action='store_true',
+                        help='With --incremental, discard the saved state and rebuild it from the full history')
+    parser.add_argument('--profile', action='store_true',
+                        help='Record wall time, CPU time, peak RSS and rows per stage in --profile-output')
+    parser.add_argument('--profile-output', default='profile_report.json',
+                        help='With --profile, path of the JSON report (default: profile_report.json)')
+    parser.add_argument('--profile-stage',
+                        help='With --profile, also run this stage (e.g. score, or score/summarize) under --profiler '
+                             'and save its profile next to the report')
+    parser.add_argument('--profiler', choices=PROFILERS, default='cprofile',
+                        help='Code profiler for --profile-stage: cprofile writes a .prof file, pyinstrument '
+                             '(if installed) an HTML call tree')
+    return parser.parse_args(argv)
+
+def _read_totals(response):
+    """(ETag, TOTAL_COLUMNS sums in cents, row count, edit count) of a /collection-stats/ response, None on 304"""
+    if response.status_code == 304:
+        return None
+    if response.status_code != 200:
+        raise ValueError(f"API request failed with status code {response.status_code}")
+    months = [month for year in response.json().values() for month in year]
+    etag = response.headers.get('ETag')
+    totals = {
+        'montoCobrar': int(to_cents([month['total_por_cobrar'] for month in months]).sum()),
+        'montoCobrado': int(to_cents([month['total_cobrado'] for month in months]).sum()),
+    }
+    return (etag.removeprefix('W/') if etag else None, totals,
+            int(response.headers[ROW_COUNT_HEADER]), int(response.headers[EDIT_COUNT_HEADER]))
+
+
+def fetch_added_rows(client, after_id, batch_size=DEFAULT_BATCH_SIZE, max_memory_mb=None, progress=None,
+                     if_none_match=None):
+    """(data ETag, amount totals, row count, edit count, id cursor, DataFrame) of the rows added after id after_id
+
+    The totals and counts come from /collection-stats/ and the rows are
+    requested with If-Match on its version; if the data changes in between,
+    both are read again. Rows are ordered by (idCredito, fechaCobroBanco, id),
+    undated last. With if_none_match, an ETag, None is returned when the data
+    version is still that one.
+    """
+    max_bytes = max_memory_mb * 2**20 if max_memory_mb is not None else None
+    for attempt in range(client.retries + 1):
+        stats = client.request('/collection-stats/', _read_totals,
+                               headers={'If-None-Match': if_none_match} if if_none_match else None)
+        if stats is None:
+            return None
+        etag, totals, rows, edits = stats
+        try:
+            headers, df = client.get_frame(
+                '/collection-details/', {'after_id': after_id}, {'If-Match': etag} if etag else None,
+                batch_size=batch_size, max_bytes=max_bytes, progress=progress,
+            )
+        except DataChanged:
+            if attempt == client.retries:
+                raise
+            continue
+        df = df.sort_values(['idCredito', 'fechaCobroBanco'], kind='stable')
+        return etag, totals, rows, edits, int(headers[LAST_ID_HEADER]), df
+
+
+def process_credits_incremental(current_date=None, holidays=None, full_rescore=False, table=None, client=None,
+                                state_path=STATE_PATH, **fetch_kwargs):
+    """Score credits from the saved per-credit state plus the rows added since its id cursor
+
+    Rows loaded since the last run are picked up whatever their dates. Edits
+    and deletions of rows the state already holds are not, so the state is
+    rebuilt from the full history when the server's edit count moved since
+    the state was saved, or its row count or amount totals no longer match
+    the state's.
+    """
+    if current_date is None:
+        current_date = datetime.now()
+
+    state = None if full_rescore else ScoringState.load(state_path)
+    with _api_client(client) as client:
+        while True:
+            rebuild = state is None
+            print("No scoring state found, fetching full history..." if rebuild
+                  else f"Fetching rows added after id {state.last_id}...")
+            with stage('fetch') as record:
+                _, totals, rows, edits, last_id, df = fetch_added_rows(
+                    client, 0 if rebuild else state.last_id, **fetch_kwargs
+                )
+                record['rows'] = len(df)
+            print(f"New records: {len(df)}")
+            print_memory_report(df)
+
+            with stage('update_state', len(df)):
+                edited = not rebuild and edits != state.edits
+                state = update_state(df, current_date, state, cents=True, last_id=last_id, edits=edits)
+                if rebuild or (not edited and state.rows == rows and state.totals == totals):
+                    state.save(state_path)
+                    break
+            print("Rows already scored were changed or deleted, rebuilding the scoring state...")
+            state = None
+
+    with stage('output') as record:
+        credits = state.summary(current_date)
+        record['rows'] = len(credits)
+        output_df, points_map = credits_output(credits, holidays, table)
+    return df, output_df, points_map
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not args.profile:
+        return run(args)
+
+    output_dir = os.path.dirname(os.path.abspath(args.profile_output))
+    os.makedirs(output_dir, exist_ok=True)
+    with Profiler(args.profile_stage, args.profiler, output_dir) as profiler:
+        result = run(args)
+    profiler.save(args.profile_output, argv)
+    profiler.print_summary()
+    print(f"Profile saved to {', '.join([args.profile_output] + profiler.dumps)}")
+    return result
+
+def run(args):
+    with ApiClient(workers=args.fetch_workers) as client:
+        return _run(args, client)
+
+def _run(args, client):
+    holidays = mexican_bank_holidays if args.bank_holidays else None
+    fetch_kwargs = {
+        'batch_size': args.batch_size,
+        'max_memory_mb': args.max_memory_mb,
+        'progress': print_progress,
+        'client': client,
+    }
+    with stage('decision_table'):
+        table = fetch_decision_table(client)
+
+    if args.incremental:
+        df, output_df, points_map = process_credits_incremental(
+            holidays=holidays, full_rescore=args.full_rescore, table=table, **fetch_kwargs
+        )
+        print(f"Credits processed. Output records: {len(output_df)}")
+    elif args.server_scoring:
+        print("Scoring credits on the server...")
+        df = None
+        output_df, points_map = process_credits_on_server(holidays=holidays, table=table, **fetch_kwargs)
+        print(f"Credits processed. Output records: {len(output_df)}")
+    else:
+        print("Fetching data from Django API...")
+        with stage('fetch') as record:
+            if args.snapshot:
+                df = fetch_with_snapshot(refresh=args.refresh_snapshot, **fetch_kwargs)
             else:
-                if not isinstance(record_date, datetime):
-                    record_date = pd.to_datetime(record_date)
-                months_diff = (current_date - record_date).days / 28
-            
-            multiplier = 6 if months_diff <= 1 else (
-                5 if months_diff <= 2 else (
-                4 if months_diff <= 3 else (
-                3 if months_diff <= 4 else (
-                2 if months_diff <= 5 else 1))))
-            
-            if row['montoCobrar'] != row['montoCobrado']:
-                points -= 1 * multiplier
-            
-            selected_date = 'no pago'
-            if pd.notna(row['montoExigible']) and pd.notna(row['montoCobrado']):
-                if row['montoCobrar'] == row['montoCobrado']:
-                    points += 1 * multiplier
-                    fecha_cobro = row['fechaCobroBanco']
-                    if pd.notna(fecha_cobro):
-                        if not isinstance(fecha_cobro, datetime):
-                            fecha_cobro = pd.to_datetime(fecha_cobro)
-                        
-                        day = fecha_cobro.day
-                        if day <= 8:
-                            fortnight_date = fecha_cobro.replace(day=1)
-                        elif day >= 23:
-                            if fecha_cobro.month == 12:
-                                fortnight_date = fecha_cobro.replace(year=fecha_cobro.year + 1, month=1, day=1)
-                            else:
-                                fortnight_date = fecha_cobro.replace(month=fecha_cobro.month + 1, day=1)
-                        else:
-                            fortnight_date = fecha_cobro.replace(day=15)
-                        
-                        while fortnight_date.weekday() >= 5:
-                            fortnight_date = fortnight_date - timedelta(days=1)
-                        
-                        selected_date = fortnight_date
-                
-                if row['montoExigible'] == row['montoCobrado']:
-                    points += 1 * multiplier
-
-        points_map[id_credito] = points
-        
-        last_row = credit_group.iloc[-1]
-        monto_tot = float(last_row['montoExigible'])
-        monto_cobrado = float(last_row['montoCobrado'])
-        
-        emision_name, emision_fee = get_emision_elegida(id_banco, points, monto_tot, monto_cobrado, last_emisor_id)
-        
-        cobrar = monto_tot > emision_fee
-        parcial = points <= 0 or monto > 10000
-        
-        if cobrar and monto > 0 and selected_date != 'no pago':
-            # Adjust the collection time based on the emission method
-            collection_time = COLLECTION_HOURS[emision_name]
-            selected_date = selected_date.replace(
-                hour=collection_time['hour'],
-                minute=collection_time['minute']
+                df = fetch_data_from_api(**fetch_kwargs)
+            record['rows'] = len(df)
+        print(f"Total records: {len(df)}")
+        print_memory_report(df)
+
+        print("Processing credits...")
+        with stage('score', len(df)):
+            output_df, points_map = process_credits_optimized(
+                df, holidays=holidays, workers=args.workers, table=table, cents=True
             )
-            
-            output_data.append({
-                'idCredito': id_credito,
-                'idEmisor': EMISOR_MAPPING[emision_name],
-                'montoExigible': monto,
-                'montoACobrar': monto,
-                'emisionUsada': emision_name,
-                'points': points,
-                'Parcial': parcial,
-                'Date': selected_date
-            })
-    
-    return pd.DataFrame(output_data), points_map
+        print(f"Credits processed. Output records: {len(output_df)}")
 
-def main():
-    print("Fetching data from Django API...")
-    df = fetch_data_from_api()
-    print(f"Total records: {len(df)}")
-    
-    print("Processing credits...")
-    output_df, points_map = process_credits_optimized(df)
-    print(f"Credits processed. Output records: {len(output_df)}")
-    
-    print("Generating visualizations...")
-    create_visualizations(df, output_df, points_map)
-    print("Visualizations saved as PNG files")
+    if args.schedule:
+        capacities = load_capacities(args.capacities) if args.capacities else None
+        with stage('schedule', len(output_df)):
+            output_df, unscheduled, utilization = schedule_collections(
+                output_df, capacities, max_delay_days=args.max_delay_days, holidays=holidays
+            )
+        utilization.to_csv('slot_utilization.csv', index=False)
+        print(f"Scheduled {len(output_df)} collections into slots; slot usage saved to slot_utilization.csv")
+        if len(unscheduled):
+            unscheduled.to_csv('unscheduled_credits.csv', index=False)
+            print(f"{len(unscheduled)} credits did not fit any slot, saved to unscheduled_credits.csv")
+
+    # Incremental runs only hold the new rows, which would give misleading history charts
+    if args.no_charts:
+        print("Skipping visualizations")
+    elif df is None:
+        print("Skipping visualizations: collection rows were not downloaded")
+    elif args.incremental and not args.full_rescore:
+        print("Skipping visualizations for incremental run")
+    else:
+        print("Generating visualizations...")
+        with stage('charts', len(df)):
+            redrawn = create_visualizations(df, output_df, points_map, workers=args.workers, cents=True)
+        print(f"Visualizations saved as PNG files ({len(redrawn)} redrawn, the rest unchanged)")
     
-    output_filename = 'processed_credits.xlsx'
-    output_df.to_excel(output_filename, index=False)
-    print(f"Results saved to {output_filename}")
+    layouts = load_layouts(args.layouts) if args.layouts else None
+    with stage('report', len(output_df)):
+        paths = write_report(output_df, 'processed_credits', args.format,
+                             split_by_emisor=args.split_by_emisor, workers=args.workers, layouts=layouts)
+    if paths:
+        print(f"Results saved to {', '.join(paths)}")
+    else:
+        print("No rows to export, no report written")
     
     return output_df, points_map
 
@@ -0,0 +1,59 @@
+"""Emission decision table, evaluated on whole columns.
+
+The table has the shape served by the API's /emission-table/ endpoint
+(see the server's configuracion app): emissions with their idEmisor, fee
+and collection time, and rules tried in order where the first one whose
+criteria all hold picks the emission. Blank criteria match any credit;
+credits no rule matches get no emission.
+"""
+import numpy as np
+import pandas as pd
+
+
+class DecisionTable:
+
+    def __init__(self, data):
+        self.data = data
+        self.reglas = sorted(data['reglas'], key=lambda regla: regla['orden'])
+        hours = {}
+        for emision in data['emisiones']:
+            hour, minute = str(emision['horaCobro']).split(':')[:2]
+            hours[emision['nombre']] = {'hour': int(hour), 'minute': int(minute)}
+        self.hours = hours
+        self.fees = {emision['nombre']: float(emision['comision']) for emision in data['emisiones']}
+        self.emisores = {emision['nombre']: emision['idEmisor'] for emision in data['emisiones']}
+
+        unknown = {regla['emision'] for regla in self.reglas} - set(self.fees)
+        if unknown:
+            raise ValueError(f"Rules refer to unknown emissions: {', '.join(sorted(unknown))}")
+        self._names = np.array([regla['emision'] for regla in self.reglas], dtype=object)
+        self._fees = np.array([self.fees[regla['emision']] for regla in self.reglas], dtype=float)
+
+    def conditions(self, id_banco, points, monto_exigible, monto_cobrado, last_emisor_id):
+        """One boolean array per rule"""
+        everything = np.ones(len(id_banco), dtype=bool)
+        incumplido = None
+        conditions = []
+        for regla in self.reglas:
+            condition = everything
+            if regla['idBanco'] is not None:
+                condition = condition & (id_banco == regla['idBanco']).to_numpy()
+            if regla['bancosExcluidos']:
+                condition = condition & ~id_banco.isin(regla['bancosExcluidos']).to_numpy()
+            if regla['emisoresPrevios']:
+                condition = condition & last_emisor_id.isin(regla['emisoresPrevios']).to_numpy()
+            if regla['soloIncumplidos']:
+                if incumplido is None:
+                    incumplido = ((points < 0) | (monto_exigible != monto_cobrado)).to_numpy()
+                condition = condition & incumplido
+            conditions.append(condition)
+        return conditions
+
+    def select(self, id_banco, points, monto_exigible, monto_cobrado, last_emisor_id):
+        """Emission names (None when no rule matches) and fees (NaN) per credit, as Series"""
+        conditions = self.conditions(id_banco, points, monto_exigible, monto_cobrado, last_emisor_id)
+        if not conditions:
+            return pd.Series(None, index=id_banco.index, dtype=object), pd.Series(np.nan, index=id_banco.index)
+        names = np.select(conditions, self._names, default=None)
+        fees = np.select(conditions, self._fees, default=np.nan)
+        return pd.Series(names, index=id_banco.index), pd.Series(fees, index=id_banco.index)
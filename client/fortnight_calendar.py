@@ -0,0 +1,135 @@
+import hashlib
+import os
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+# Snapped tables are persisted here so repeat runs skip rebuilding them
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache')
+
+# In-process copy of every table built or loaded during this run
+_tables = {}
+
+
+def easter_sunday(year):
+    """Gregorian Easter Sunday (anonymous computus)"""
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return date(year, month, day + 1)
+
+
+def _nth_monday(year, month, n):
+    first = date(year, month, 1)
+    return first + timedelta(days=(7 - first.weekday()) % 7 + 7 * (n - 1))
+
+
+def mexican_bank_holidays(year):
+    """Days Mexican banks do not process charges (CNBV calendar)"""
+    easter = easter_sunday(year)
+    return [
+        date(year, 1, 1),
+        _nth_monday(year, 2, 1),    # Día de la Constitución
+        _nth_monday(year, 3, 3),    # Natalicio de Benito Juárez
+        easter - timedelta(days=3),  # Jueves Santo
+        easter - timedelta(days=2),  # Viernes Santo
+        date(year, 5, 1),
+        date(year, 9, 16),
+        date(year, 11, 2),
+        _nth_monday(year, 11, 3),   # Día de la Revolución
+        date(year, 12, 12),
+        date(year, 12, 25),
+    ]
+
+
+class FortnightCalendar:
+    """Lookup table from calendar day to its snapped collection day.
+
+    Every day maps to the 1st (days 1-8), the 15th (days 9-22) or the next
+    month's 1st (days 23+), rolled back to the closest previous business day.
+    The table is built once per distinct day for whole years and mapped over
+    date columns with a single array lookup.
+    """
+
+    def __init__(self, first_year, last_year, holidays=None, cache_dir=CACHE_DIR):
+        self.first_year = first_year
+        self.last_year = last_year
+        self.start = np.datetime64(f'{first_year}-01-01', 'D')
+        self.end = np.datetime64(f'{last_year + 1}-01-01', 'D')
+
+        holiday_days = []
+        if holidays is not None:
+            for year in range(first_year, last_year + 2):
+                holiday_days.extend(holidays(year))
+        self.holidays = np.array(sorted(set(holiday_days)), dtype='datetime64[D]')
+        self.key = self._cache_key()
+        self.table = self._load(cache_dir)
+
+    def _cache_key(self):
+        digest = hashlib.sha1(self.holidays.astype('int64').tobytes()).hexdigest()[:12]
+        return f'{self.first_year}-{self.last_year}-{digest}'
+
+    def _load(self, cache_dir):
+        if self.key in _tables:
+            return _tables[self.key]
+
+        path = os.path.join(cache_dir, f'fortnight_{self.key}.npy') if cache_dir else None
+        if path and os.path.exists(path):
+            table = np.load(path)
+        else:
+            table = self._build()
+            if path:
+                os.makedirs(cache_dir, exist_ok=True)
+                np.save(path, table)
+
+        _tables[self.key] = table
+        return table
+
+    def _build(self):
+        days = np.arange(self.start, self.end, dtype='datetime64[D]')
+        months = days.astype('datetime64[M]')
+        day_of_month = (days - months).astype('int64') + 1
+        month_start = months.astype('datetime64[D]')
+
+        snapped = np.where(
+            day_of_month <= 8, month_start,
+            np.where(day_of_month >= 23, (months + 1).astype('datetime64[D]'), month_start + 14)
+        )
+
+        # Previous business day for every day a snapped date can land on;
+        # the window starts a month early so rollbacks off the 1st stay in range
+        window = np.arange(self.start - 31, self.end + 1, dtype='datetime64[D]')
+        weekday = (window.astype('int64') + 3) % 7  # 1970-01-01 was a Thursday
+        business = (weekday < 5) & ~np.isin(window, self.holidays)
+        positions = np.where(business, np.arange(len(window)), -1)
+        previous_business = window[np.maximum.accumulate(positions)]
+
+        return previous_business[(snapped - window[0]).astype('int64')]
+
+    def snap(self, fechas):
+        """Map a datetime Series to snapped collection days (midnight, NaT kept)"""
+        days = fechas.to_numpy(dtype='datetime64[D]')
+        valid = ~np.isnat(days)
+        offsets = np.where(valid, (days - self.start).astype('int64'), 0)
+
+        snapped = np.full(len(days), np.datetime64('NaT'), dtype='datetime64[ns]')
+        snapped[valid] = self.table[offsets[valid]]
+        return pd.Series(snapped, index=fechas.index)
+
+
+def get_calendar(fechas, holidays=None, cache_dir=CACHE_DIR):
+    """Return a calendar covering every year present in fechas"""
+    years = fechas.dropna().dt.year
+    if years.empty:
+        first_year = last_year = date.today().year
+    else:
+        first_year, last_year = int(years.min()), int(years.max())
+    return FortnightCalendar(first_year, last_year, holidays=holidays, cache_dir=cache_dir)
@@ -0,0 +1,210 @@
+import os
+
+import pandas as pd
+
+from schema import compact
+from scoring import (
+    RECENCY_BUCKET_DAYS, RECENCY_MULTIPLIERS, SUMMARY_COLUMNS,
+    recency_multiplier, row_point_deltas
+)
+
+STATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'scoring_state.pkl')
+STATE_VERSION = 4
+
+# Rows older than this always weigh 1, whatever the current date becomes
+SETTLED_AFTER_DAYS = RECENCY_BUCKET_DAYS * len(RECENCY_MULTIPLIERS)
+
+LAST_ROW_COLUMNS = ['montoExigible', 'montoCobrar', 'montoCobrado', 'fechaCobroBanco']
+
+# Amounts summed over the dated rows applied, as /collection-stats/ sums them
+TOTAL_COLUMNS = ['montoCobrar', 'montoCobrado']
+
+
+def _credit_records(rows):
+    """One state record per credit present in rows, ordered by (idCredito, fechaCobroBanco, id)"""
+    grouped = rows.groupby('idCredito', sort=True)
+    credit_ids = grouped.size().index
+    first_rows = rows.drop_duplicates('idCredito', keep='first').set_index('idCredito')
+    last_rows = rows.drop_duplicates('idCredito', keep='last').set_index('idCredito')
+    paid_rows = (
+        rows[rows['montoCobrado'] > 0]
+        .drop_duplicates('idCredito', keep='last')
+        .set_index('idCredito')
+    )
+
+    records = last_rows[LAST_ROW_COLUMNS].reindex(credit_ids)
+    records['idBanco'] = first_rows['idBanco'].reindex(credit_ids)
+    records['firstFecha'] = first_rows['fechaCobroBanco'].reindex(credit_ids)
+    records['sumExigible'] = grouped['montoExigible'].sum()
+    records['sumCobrado'] = grouped['montoCobrado'].sum()
+    records['settledPoints'] = 0
+    records['hasPaid'] = credit_ids.isin(paid_rows.index)
+    records['lastEmisor'] = paid_rows['idRespuestaBanco'].reindex(credit_ids)
+    records['paidFecha'] = paid_rows['fechaCobroBanco'].reindex(credit_ids)
+    return records
+
+
+def _last_by(records, fecha):
+    """Per credit, the record whose fecha row sorts last: undated last, ties to the later record"""
+    ordered = records.sort_values(fecha, kind='stable')
+    return ordered[~ordered.index.duplicated(keep='last')]
+
+
+def _merge_records(older, newer):
+    """Fold newer credit records into older ones.
+
+    Newer rows were added later, so they follow the older ones with the same
+    fechaCobroBanco, but may be dated before them: first, last and last paid
+    rows are picked by date, as a full rescore orders them.
+    """
+    combined = pd.concat([older, newer])
+    grouped = combined.groupby(level=0, sort=True)
+
+    merged = _last_by(combined, 'fechaCobroBanco').sort_index()
+    ordered = combined.sort_values('firstFecha', kind='stable')
+    first = ordered[~ordered.index.duplicated(keep='first')]
+    merged['idBanco'] = first['idBanco']
+    merged['firstFecha'] = first['firstFecha']
+    for column in ['sumExigible', 'sumCobrado', 'settledPoints']:
+        merged[column] = grouped[column].sum()
+
+    paid = _last_by(combined[combined['hasPaid']], 'paidFecha')
+    merged['hasPaid'] = merged.index.isin(paid.index)
+    merged['lastEmisor'] = paid['lastEmisor'].reindex(merged.index)
+    merged['paidFecha'] = paid['paidFecha'].reindex(merged.index)
+    return merged
+
+
+class ScoringState:
+    """Per-credit scoring state that can be advanced with new collection rows.
+
+    Points of rows older than SETTLED_AFTER_DAYS (or without a date) can no
+    longer change, so they are folded into each credit's settledPoints. Newer
+    rows are kept as point deltas per (idCredito, fechaCobroBanco) and are
+    re-weighted every time the state is scored.
+
+    Each apply() takes the rows added since the previous one, whatever their
+    dates: last_id is the server's id cursor after them. totals are the
+    amounts of the dated rows applied and rows how many rows were applied;
+    edits is the server's edit count the rows were read at. The caller
+    compares all three with the server's to notice rows changed or deleted
+    after they were applied.
+    """
+
+    def __init__(self):
+        self.credits = None
+        self.recent = pd.DataFrame({
+            'idCredito': pd.Series(dtype='int64'),
+            'fechaCobroBanco': pd.Series(dtype='datetime64[ns]'),
+            'delta': pd.Series(dtype='int64'),
+        })
+        self.last_id = 0
+        self.edits = None
+        self.rows = 0
+        self.totals = {column: 0 for column in TOTAL_COLUMNS}
+        self.as_of = None
+
+    @classmethod
+    def load(cls, path=STATE_PATH):
+        """Return the saved state, or None when there is nothing usable"""
+        if not os.path.exists(path):
+            return None
+        saved = pd.read_pickle(path)
+        if saved.get('version') != STATE_VERSION:
+            return None
+        state = cls()
+        state.credits = saved['credits']
+        state.recent = saved['recent']
+        state.last_id = saved['last_id']
+        state.edits = saved['edits']
+        state.rows = saved['rows']
+        state.totals = saved['totals']
+        state.as_of = saved['as_of']
+        return state
+
+    def save(self, path=STATE_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        pd.to_pickle({
+            'version': STATE_VERSION,
+            'credits': self.credits,
+            'recent': self.recent,
+            'last_id': self.last_id,
+            'edits': self.edits,
+            'rows': self.rows,
+            'totals': self.totals,
+            'as_of': self.as_of,
+        }, path)
+
+    def _advance(self, current_date):
+        current_date = pd.Timestamp(current_date)
+        if self.as_of is not None and current_date < self.as_of:
+            raise ValueError(
+                f"Scoring state is as of {self.as_of}, cannot score at {current_date}; "
+                "run a full rescore"
+            )
+        self.as_of = current_date
+
+        # Re-bucket: rows that aged past the last multiplier bucket become settled
+        age = (current_date - self.recent['fechaCobroBanco']).dt.days
+        settled = self.recent['fechaCobroBanco'].isna() | (age > SETTLED_AFTER_DAYS)
+        if settled.any():
+            settled_points = self.recent[settled].groupby('idCredito')['delta'].sum()
+            self.credits['settledPoints'] += settled_points.reindex(self.credits.index, fill_value=0)
+            self.recent = self.recent[~settled].reset_index(drop=True)
+
+    def apply(self, df, current_date, last_id=None, edits=None):
+        """Add the collection rows added since the last apply, up to id last_id"""
+        self.rows += len(df)
+        rows = df[df['idCredito'].notna()].reset_index(drop=True)
+        rows['fechaCobroBanco'] = pd.to_datetime(rows['fechaCobroBanco'])
+        if last_id is not None:
+            self.last_id = last_id
+        if edits is not None:
+            self.edits = edits
+
+        if not rows.empty:
+            dated = rows[rows['fechaCobroBanco'].notna()]
+            self.totals = {column: self.totals[column] + int(dated[column].sum()) for column in TOTAL_COLUMNS}
+            records = _credit_records(rows)
+            self.credits = records if self.credits is None else _merge_records(self.credits, records)
+
+            new_deltas = pd.DataFrame({
+                'idCredito': rows['idCredito'],
+                'fechaCobroBanco': rows['fechaCobroBanco'],
+                'delta': row_point_deltas(rows),
+            })
+            self.recent = (
+                pd.concat([self.recent, new_deltas], ignore_index=True)
+                .groupby(['idCredito', 'fechaCobroBanco'], sort=False, dropna=False)['delta']
+                .sum()
+                .reset_index()
+            )
+
+        if self.credits is not None:
+            self._advance(current_date)
+        return self
+
+    def summary(self, current_date):
+        """Per-credit summary at current_date, as scoring.summarize_credits returns"""
+        if self.credits is None:
+            return pd.DataFrame(columns=SUMMARY_COLUMNS)
+        self._advance(current_date)
+
+        weighted = self.recent['delta'] * recency_multiplier(self.recent['fechaCobroBanco'], current_date)
+        recent_points = weighted.groupby(self.recent['idCredito']).sum()
+
+        credits = self.credits.copy()
+        credits['points'] = credits['settledPoints'] + recent_points.reindex(credits.index, fill_value=0)
+        credits['monto'] = credits['sumExigible'] - credits['sumCobrado']
+        return credits[SUMMARY_COLUMNS]
+
+
+def update_state(df, current_date, state=None, cents=False, last_id=None, edits=None):
+    """Build a new state from df, or advance an existing one with it
+
+    df must be ordered by (idCredito, fechaCobroBanco, id), undated rows
+    last. The state holds amounts in cents; cents says whether df's already are.
+    """
+    if state is None:
+        state = ScoringState()
+    return state.apply(compact(df, cents=cents), current_date, last_id, edits)
@@ -0,0 +1,287 @@
+import json
+import sys
+import threading
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from schema import COLLECTION_SCHEMA, ZERO_WHEN_MISSING, to_cents
+
+# How each /collection-details/ column is buffered while streaming
+DETAIL_COLUMN_TYPES = COLLECTION_SCHEMA
+
+# How each /credit-scores/ column is buffered
+SCORE_COLUMN_TYPES = {
+    'idCredito': 'int',
+    'idBanco': 'category',
+    'points': 'int',
+    'monto': 'cents',
+    'montoExigible': 'cents',
+    'montoCobrar': 'cents',
+    'montoCobrado': 'cents',
+    'fechaCobroBanco': 'datetime',
+    'lastEmisor': 'category',
+}
+
+DEFAULT_BATCH_SIZE = 50_000
+
+
+class MemoryLimitExceeded(MemoryError):
+    """Raised when buffered columns grow past the configured ceiling"""
+
+
+class ByteBudget:
+    """Ceiling on the bytes buffered by one or more readers together (e.g. concurrent shards)
+
+    Once the total passes max_bytes, every reader charging it raises
+    MemoryLimitExceeded at its next batch.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.buffered = 0
+        self.lock = threading.Lock()
+
+    def charge(self, nbytes):
+        with self.lock:
+            self.buffered += nbytes
+            buffered = self.buffered
+        if buffered > self.max_bytes:
+            raise MemoryLimitExceeded(
+                f"Buffered {buffered / 2**20:.0f} MiB, over the {self.max_bytes / 2**20:.0f} MiB limit; "
+                "narrow the request with year or date filters"
+            )
+
+    def release(self, nbytes):
+        with self.lock:
+            self.buffered -= nbytes
+
+    def attempt(self):
+        """Share of the budget for one try at a download, see BudgetAttempt"""
+        return BudgetAttempt(self)
+
+
+class BudgetAttempt:
+    """Charges one try at a download against a ByteBudget and remembers how much.
+
+    A try that fails gives its bytes back with release(), so a retry is not
+    charged for the buffers the failed one dropped.
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.charged = 0
+
+    def charge(self, nbytes):
+        self.charged += nbytes
+        self.budget.charge(nbytes)
+
+    def release(self):
+        self.budget.release(self.charged)
+        self.charged = 0
+
+
+class _ArrayBuffer:
+    """Column stored as a list of typed numpy chunks"""
+
+    def __init__(self, kind, name=None):
+        self.kind = kind
+        self.name = name
+        self.chunks = []
+        self.nbytes = 0
+
+    def append(self, values):
+        if self.kind == 'int':
+            chunk = np.asarray(values, dtype=np.int64)
+        elif self.kind == 'int32':
+            chunk = np.asarray(values, dtype=np.int32)
+        elif self.kind == 'cents':
+            chunk = to_cents(values, self.name)
+        elif self.kind == 'float':
+            chunk = pd.to_numeric(pd.Series(values, dtype=object)).to_numpy(dtype=np.float64)
+        else:
+            chunk = (
+                pd.to_datetime(pd.Series(values, dtype=object), utc=True, format='ISO8601')
+                .dt.tz_localize(None)
+                .to_numpy(dtype='datetime64[ns]')
+            )
+        self.chunks.append(chunk)
+        self.nbytes += chunk.nbytes
+
+    def finish(self):
+        if not self.chunks:
+            dtype = {'int': np.int64, 'int32': np.int32, 'cents': np.int64,
+                     'float': np.float64}.get(self.kind, 'datetime64[ns]')
+            return np.array([], dtype=dtype)
+        values = np.concatenate(self.chunks)
+        self.chunks = []
+        return values
+
+
+class _CategoryBuffer:
+    """Column stored as int32 codes into a growing list of categories"""
+
+    def __init__(self):
+        self.codes = []
+        self.categories = {}
+        self.nbytes = 0
+
+    def append(self, values):
+        categories = self.categories
+        chunk = np.empty(len(values), dtype=np.int32)
+        for i, value in enumerate(values):
+            if value is None:
+                chunk[i] = -1
+            else:
+                code = categories.get(value)
+                if code is None:
+                    code = categories[value] = len(categories)
+                    self.nbytes += sys.getsizeof(value)
+                chunk[i] = code
+        self.codes.append(chunk)
+        self.nbytes += chunk.nbytes
+
+    def finish(self):
+        codes = np.concatenate(self.codes) if self.codes else np.array([], dtype=np.int32)
+        self.codes = []
+        return pd.Categorical.from_codes(codes, categories=list(self.categories))
+
+
+def read_ndjson_frame(lines, column_types=DETAIL_COLUMN_TYPES, batch_size=DEFAULT_BATCH_SIZE,
+                      max_bytes=None, progress=None, budget=None):
+    """Build a DataFrame from NDJSON lines in fixed-size batches.
+
+    Only one batch of parsed records exists at a time; each batch is turned
+    into typed column chunks that are concatenated once at the end.
+
+    max_bytes: raise MemoryLimitExceeded when the buffered columns exceed it.
+    progress: called as progress(rows, bytes_read) after every batch, with
+    bytes_read counting UTF-8 bytes whether lines are bytes or str.
+    budget: ByteBudget shared with other readers, instead of max_bytes.
+    """
+    if budget is None and max_bytes is not None:
+        budget = ByteBudget(max_bytes)
+    buffers = {
+        name: _CategoryBuffer() if kind == 'category' else _ArrayBuffer(kind, name)
+        for name, kind in column_types.items()
+    }
+    rows = 0
+    bytes_read = 0
+    charged = 0
+
+    def flush(batch):
+        nonlocal charged
+        for name, buffer in buffers.items():
+            buffer.append([record.get(name) for record in batch])
+        if budget is not None:
+            buffered = sum(buffer.nbytes for buffer in buffers.values())
+            budget.charge(buffered - charged)
+            charged = buffered
+        if progress is not None:
+            progress(rows, bytes_read)
+
+    batch = []
+    for line in lines:
+        if not line:
+            continue
+        # Lines may be decoded text; count what came over the wire
+        bytes_read += (len(line.encode()) if isinstance(line, str) else len(line)) + 1
+        batch.append(json.loads(line))
+        if len(batch) == batch_size:
+            rows += len(batch)
+            flush(batch)
+            batch = []
+    if batch:
+        rows += len(batch)
+        flush(batch)
+
+    return pd.DataFrame({name: buffer.finish() for name, buffer in buffers.items()})
+
+
+class _CountingReader:
+    """File-like wrapper counting the bytes read from source"""
+
+    closed = False
+
+    def __init__(self, source):
+        self.source = source
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = self.source.read(size)
+        self.bytes_read += len(data)
+        return data
+
+
+def _arrow_cents(column, name):
+    if not pa.types.is_decimal(column.type):
+        return to_cents(column.to_pandas(), name)
+    if column.null_count:
+        if name not in ZERO_WHEN_MISSING:
+            return pc.multiply(column, pa.scalar(Decimal(100))).cast(pa.float64()).to_numpy(zero_copy_only=False)
+        column = column.fill_null(pa.scalar(Decimal(0), column.type))
+    return pc.multiply(column, pa.scalar(Decimal(100))).cast(pa.int64()).to_numpy()
+
+
+def _arrow_categorical(column):
+    if pa.types.is_dictionary(column.type):
+        column = column.cast(column.type.value_type)
+    encoded = column.combine_chunks().dictionary_encode()
+    codes = encoded.indices.fill_null(-1).to_numpy()
+    return pd.Categorical.from_codes(codes, categories=encoded.dictionary.to_pylist())
+
+
+def _arrow_column(column, kind, name):
+    """numpy array or Categorical of an Arrow column, typed like read_ndjson_frame's"""
+    if kind == 'category':
+        return _arrow_categorical(column)
+    if kind == 'cents':
+        return _arrow_cents(column, name)
+    if kind == 'datetime':
+        if pa.types.is_timestamp(column.type):
+            # Arrow keeps timestamps in UTC, so dropping the zone leaves naive UTC like the NDJSON path
+            return column.cast(pa.timestamp('ns', tz=column.type.tz)).cast(pa.timestamp('ns')).to_numpy()
+        buffer = _ArrayBuffer(kind, name)
+        buffer.append(column.to_pylist())
+        return buffer.finish()
+    dtype = {'int': pa.int64(), 'int32': pa.int32(), 'float': pa.float64()}[kind]
+    return column.cast(dtype).to_numpy()
+
+
+def arrow_to_frame(table, column_types=DETAIL_COLUMN_TYPES):
+    """DataFrame of the column_types columns of an Arrow table, with the dtypes read_ndjson_frame gives them.
+
+    Numeric and timestamp columns are converted without going through
+    Python objects; decimal amounts become int64 cents exactly.
+    """
+    return pd.DataFrame({name: _arrow_column(table.column(name), kind, name) for name, kind in column_types.items()})
+
+
+def read_arrow_frame(source, column_types=DETAIL_COLUMN_TYPES, max_bytes=None, progress=None, budget=None):
+    """Build a DataFrame from an Arrow IPC stream (a file-like object).
+
+    Record batches stay in Arrow's columnar buffers until the stream ends and
+    are then converted column by column. max_bytes, progress and budget work
+    as in read_ndjson_frame, after every record batch.
+    """
+    if budget is None and max_bytes is not None:
+        budget = ByteBudget(max_bytes)
+    reader = _CountingReader(source)
+    stream = pa.ipc.open_stream(reader)
+    batches = []
+    rows = 0
+    for batch in stream:
+        batches.append(batch)
+        rows += batch.num_rows
+        if budget is not None:
+            budget.charge(batch.nbytes)
+        if progress is not None:
+            progress(rows, reader.bytes_read)
+    return arrow_to_frame(pa.Table.from_batches(batches, schema=stream.schema), column_types)
+
+
+def print_progress(rows, bytes_read):
+    print(f"  {rows:,} rows ({bytes_read / 2**20:.1f} MiB) received")
@@ -0,0 +1,181 @@
+"""Stage-level profiling of a datathon run.
+
+While a Profiler is active, every `with stage(name):` block records its wall
+time, CPU time (including worker processes that finished inside it), peak
+RSS and row count; stages opened inside another one are its sub-steps and
+are reported as "outer/inner". Outside a profiled run stage() costs next to
+nothing, so library code can mark its steps unconditionally.
+
+One stage can also be run under cProfile (a .prof file for pstats or
+snakeviz) or pyinstrument (an HTML call tree; needs the pyinstrument
+package).
+"""
+import contextlib
+import json
+import os
+import platform
+import resource
+import sys
+import time
+from datetime import datetime
+
+# Bump when the report layout changes
+REPORT_VERSION = 1
+
+PROFILERS = ('cprofile', 'pyinstrument')
+
+_active = None
+
+
+def _peak_rss_mb(who=resource.RUSAGE_SELF):
+    peak = resource.getrusage(who).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+
+def _cpu_seconds():
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+class Profiler:
+    """Collects stage records; use as a context manager to make it active"""
+
+    def __init__(self, profile_stage=None, profiler='cprofile', output_dir='.'):
+        if profiler not in PROFILERS:
+            raise ValueError(f"Unknown profiler {profiler!r}, expected one of {', '.join(PROFILERS)}")
+        self.profile_stage = profile_stage
+        self.profiler = profiler
+        self.output_dir = output_dir
+        self.stages = []
+        self.dumps = []
+        self._path = []
+        self._start = None
+        self._pid = None
+
+    def __enter__(self):
+        global _active
+        if _active is not None:
+            raise RuntimeError("A profiler is already active")
+        _active = self
+        self._pid = os.getpid()
+        self._start = (time.perf_counter(), _cpu_seconds())
+        self.started = datetime.now().isoformat(timespec='seconds')
+        return self
+
+    def __exit__(self, *exc):
+        global _active
+        _active = None
+        self.wall_s = time.perf_counter() - self._start[0]
+        self.cpu_s = _cpu_seconds() - self._start[1]
+
+    @contextlib.contextmanager
+    def stage(self, name, rows=None):
+        self._path.append(name)
+        path = '/'.join(self._path)
+        record = {'stage': path, 'depth': len(self._path) - 1, 'rows': rows}
+        rss_before = _peak_rss_mb()
+        wall, cpu = time.perf_counter(), _cpu_seconds()
+        try:
+            with self._code_profiler(path):
+                yield record
+        finally:
+            record['wall_s'] = time.perf_counter() - wall
+            record['cpu_s'] = _cpu_seconds() - cpu
+            record['peak_rss_mb'] = _peak_rss_mb()
+            record['rss_growth_mb'] = record['peak_rss_mb'] - rss_before
+            if record['rows']:
+                record['rows_per_s'] = record['rows'] / record['wall_s'] if record['wall_s'] else None
+            self.stages.append(record)
+            self._path.pop()
+
+    @contextlib.contextmanager
+    def _code_profiler(self, path):
+        # The stage is chosen by its full path or just its own name
+        if self.profile_stage not in (path, self._path[-1]):
+            yield
+            return
+        file_stem = os.path.join(self.output_dir, 'profile_' + path.replace('/', '_'))
+        if self.profiler == 'pyinstrument':
+            try:
+                from pyinstrument import Profiler as CallTreeProfiler
+            except ImportError as e:
+                raise RuntimeError("--profiler pyinstrument needs the pyinstrument package") from e
+            profiler = CallTreeProfiler()
+            profiler.start()
+            try:
+                yield
+            finally:
+                profiler.stop()
+                path = file_stem + '.html'
+                with open(path, 'w') as f:
+                    f.write(profiler.output_html())
+                self.dumps.append(path)
+        else:
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+                path = file_stem + '.prof'
+                profiler.dump_stats(path)
+                self.dumps.append(path)
+
+    def report(self, argv=None):
+        """The run's totals and stage records, each stage followed by its sub-steps"""
+        return {
+            'version': REPORT_VERSION,
+            'started': self.started,
+            'argv': list(sys.argv[1:] if argv is None else argv),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'wall_s': self.wall_s,
+            'cpu_s': self.cpu_s,
+            'peak_rss_mb': _peak_rss_mb(),
+            'children_peak_rss_mb': _peak_rss_mb(resource.RUSAGE_CHILDREN),
+            'stages': _start_order(self.stages),
+            'dumps': self.dumps,
+        }
+
+    def save(self, path, argv=None):
+        with open(path, 'w') as f:
+            json.dump(self.report(argv), f, indent=2)
+
+    def print_summary(self):
+        print(f"{'stage':<40} {'wall s':>9} {'cpu s':>9} {'peak MiB':>9} {'rows':>12}")
+        for record in _start_order(self.stages):
+            name = '  ' * record['depth'] + record['stage'].rsplit('/', 1)[-1]
+            rows = f"{record['rows']:>12,}" if record['rows'] is not None else ''
+            print(f"{name:<40} {record['wall_s']:>9.3f} {record['cpu_s']:>9.3f} {record['peak_rss_mb']:>9.1f} {rows}")
+
+
+def _start_order(stages):
+    """Records are appended as stages end, so sub-steps come before their stage; put parents first"""
+    ordered = []
+    pending = []
+    for record in stages:
+        # Every deeper record finished just before this one is one of its sub-steps
+        children = []
+        while pending and pending[-1]['depth'] > record['depth']:
+            children.append(pending.pop())
+        pending.append({**record, '_children': children[::-1]})
+
+    def walk(records):
+        for record in records:
+            children = record.pop('_children')
+            ordered.append(record)
+            walk(children)
+
+    walk(pending)
+    return ordered
+
+
+def stage(name, rows=None):
+    """Record the block as a stage of the active profiler (a no-op when none is active)"""
+    # Forked workers inherit the profiler; only the profiled process records
+    if _active is None or _active._pid != os.getpid():
+        return contextlib.nullcontext({})
+    return _active.stage(name, rows)
@@ -0,0 +1,162 @@
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import pyarrow as pa
+from openpyxl import Workbook
+from pyarrow import parquet
+
+from schema import to_cents
+
+# Rows converted to Python objects / formatted text at a time
+CHUNK_ROWS = 50_000
+
+EXTENSIONS = {'xlsx': '.xlsx', 'csv': '.csv', 'parquet': '.parquet', 'fixed': '.txt'}
+
+# Fixed-width collection files per idEmisor (see datathon.EMISOR_MAPPING):
+# (column, width, kind) fields, where 'int' is zero-padded, 'cents' is an
+# amount in pesos written as zero-padded cents, 'date' uses date_format and
+# 'text' is left-aligned and space-padded.
+# Placeholders, not the banks' specifications: replace them with each bank's
+# layout through load_layouts (--layouts) before sending files. Every date
+# keeps the time of day, which carries the --schedule slot.
+_BBVA_LAYOUT = {
+    'fields': [
+        ['idEmisor', 5, 'text'],
+        ['idCredito', 20, 'int'],
+        ['montoACobrar', 15, 'cents'],
+        ['Date', 14, 'date'],
+        ['emisionUsada', 25, 'text'],
+    ],
+    'date_format': '%Y%m%d%H%M%S',
+}
+FIXED_WIDTH_LAYOUTS = {
+    '5923': _BBVA_LAYOUT,
+    '4750': _BBVA_LAYOUT,
+    '05503': _BBVA_LAYOUT,
+    '00623': {
+        'fields': [
+            ['idEmisor', 5, 'text'],
+            ['idCredito', 16, 'int'],
+            ['montoACobrar', 13, 'cents'],
+            ['Date', 12, 'date'],
+        ],
+        'date_format': '%Y%m%d%H%M',
+    },
+    '00496': {
+        'fields': [
+            ['idEmisor', 5, 'text'],
+            ['idCredito', 18, 'int'],
+            ['montoExigible', 15, 'cents'],
+            ['montoACobrar', 15, 'cents'],
+            ['Date', 12, 'date'],
+        ],
+        'date_format': '%d%m%Y%H%M',
+    },
+}
+
+
+def load_layouts(path):
+    """Per-emisor fixed-width layouts from a JSON file laid out like FIXED_WIDTH_LAYOUTS"""
+    with open(path) as f:
+        return json.load(f)
+
+
+def _chunks(df):
+    for start in range(0, len(df), CHUNK_ROWS):
+        yield df.iloc[start:start + CHUNK_ROWS]
+
+
+def write_excel(df, path):
+    """Stream rows into a write-only workbook, so memory does not grow with the row count"""
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Sheet1')
+    sheet.append(list(df.columns))
+    for chunk in _chunks(df):
+        values = chunk.astype(object).where(chunk.notna(), None)
+        for row in values.itertuples(index=False, name=None):
+            sheet.append(row)
+    workbook.save(path)
+
+
+def write_csv(df, path):
+    df.to_csv(path, index=False, chunksize=CHUNK_ROWS)
+
+
+def write_parquet(df, path):
+    """One row group per CHUNK_ROWS rows"""
+    schema = pa.Schema.from_pandas(df, preserve_index=False)
+    with parquet.ParquetWriter(path, schema) as writer:
+        for chunk in _chunks(df):
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+
+
+def _fixed_width_field(values, width, kind, date_format):
+    if kind == 'int':
+        text = values.astype('int64').astype(str).str.zfill(width)
+    elif kind == 'cents':
+        # Report amounts are pesos, integer or not
+        text = to_cents(values, values.name).astype(str)
+        text = pd.Series(text, index=values.index).str.zfill(width)
+    elif kind == 'date':
+        text = values.dt.strftime(date_format).fillna('').str.ljust(width)
+    else:
+        text = values.astype(object).fillna('').astype(str).str.ljust(width)
+    too_long = text.str.len() > width
+    if too_long.any():
+        raise ValueError(f"{values.name} value {values[too_long].iloc[0]!r} does not fit in {width} characters")
+    return text
+
+
+def write_fixed_width(df, path, layout):
+    """One line per row, laid out by layout['fields']"""
+    with open(path, 'w', newline='') as f:
+        for chunk in _chunks(df):
+            lines = pd.Series('', index=chunk.index)
+            for column, width, kind in layout['fields']:
+                lines += _fixed_width_field(chunk[column], width, kind, layout.get('date_format'))
+            f.write('\r\n'.join(lines) + '\r\n')
+
+
+def _write(df, path, fmt, layouts=None):
+    if fmt == 'xlsx':
+        write_excel(df, path)
+    elif fmt == 'csv':
+        write_csv(df, path)
+    elif fmt == 'parquet':
+        write_parquet(df, path)
+    else:
+        layouts = FIXED_WIDTH_LAYOUTS if layouts is None else layouts
+        emisor = df['idEmisor'].iloc[0]
+        if emisor not in layouts:
+            raise ValueError(f"No fixed-width layout for emisor {emisor}")
+        write_fixed_width(df, path, layouts[emisor])
+    return path
+
+
+def write_report(df, base_path='processed_credits', fmt='xlsx', split_by_emisor=False, workers=1, layouts=None):
+    """Write the output report; returns the paths written.
+
+    With split_by_emisor each idEmisor gets its own <base_path>_<idEmisor>
+    file, written by up to `workers` processes; no paths when no row has an
+    idEmisor. Fixed-width layouts are
+    bank-specific, so 'fixed' always splits; layouts replaces
+    FIXED_WIDTH_LAYOUTS.
+    """
+    if fmt not in EXTENSIONS:
+        raise ValueError(f"Unknown report format {fmt!r} (choose from {', '.join(EXTENSIONS)})")
+    extension = EXTENSIONS[fmt]
+
+    if not (split_by_emisor or fmt == 'fixed'):
+        return [_write(df, base_path + extension, fmt)]
+    if df.empty:
+        return []
+
+    jobs = [
+        (group, f'{base_path}_{emisor}{extension}', fmt, layouts)
+        for emisor, group in df.groupby('idEmisor', sort=True, observed=True)
+    ]
+    if workers <= 1 or len(jobs) == 1:
+        return [_write(*job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as executor:
+        return list(executor.map(_write, *zip(*jobs)))
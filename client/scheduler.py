@@ -0,0 +1,171 @@
+"""Capacity-aware assignment of output credits to collection slots.
+
+Each idEmisor sends its charges in time slots of a daily window, and the
+bank accepts at most per_slot charges per slot and per_day per file. Credits
+are taken in priority order (points, then amount, highest first) and each
+one goes to the first slot with room at or after its emission's collection
+time, rolling over to later business days up to max_delay_days after its
+collection day. Credits that still do not fit are left unscheduled.
+
+The free slots of an emisor form one timeline; full slots point to the next
+candidate (a union-find "next free bucket" structure with path halving), so
+every credit finds its slot in near-constant time.
+"""
+import json
+
+import numpy as np
+import pandas as pd
+
+# Window, slot length and limits per idEmisor (see datathon.EMISOR_MAPPING).
+# Starting values: tune them to what each bank actually accepts.
+DEFAULT_CAPACITY = {'start': '08:00', 'end': '14:00', 'slot_minutes': 30, 'per_slot': 10_000, 'per_day': 100_000}
+BANK_CAPACITIES = {
+    '05503': {'start': '08:00', 'end': '10:00', 'per_slot': 5_000, 'per_day': 20_000},
+    '5923': {'start': '09:00', 'per_slot': 10_000, 'per_day': 80_000},
+    '4750': {'start': '09:00', 'per_slot': 5_000, 'per_day': 40_000},
+    '00623': {'start': '09:30', 'per_slot': 8_000, 'per_day': 60_000},
+    '00496': {'start': '08:30', 'per_slot': 10_000, 'per_day': 100_000},
+}
+
+# Output columns credits are ranked by, highest first; ties go to the lower idCredito
+PRIORITY = ['points', 'montoACobrar']
+
+UTILIZATION_COLUMNS = ['idEmisor', 'slot', 'assigned', 'capacity', 'utilization']
+
+
+def _minutes(value):
+    hour, minute = value.split(':')
+    return int(hour) * 60 + int(minute)
+
+
+def load_capacities(path):
+    """Per-emisor capacities from a JSON file laid out like BANK_CAPACITIES"""
+    with open(path) as f:
+        return json.load(f)
+
+
+def _capacity(capacities, emisor):
+    capacity = {**DEFAULT_CAPACITY, **capacities.get(emisor, {})}
+    start, end, step = _minutes(capacity['start']), _minutes(capacity['end']), capacity['slot_minutes']
+    if end <= start or step <= 0:
+        raise ValueError(f"Empty collection window for emisor {emisor}")
+    capacity['slot_starts'] = np.arange(start, end, step)
+    return capacity
+
+
+def _business_days(days, holidays):
+    weekday = (days.astype('int64') + 3) % 7  # 1970-01-01 was a Thursday
+    business = weekday < 5
+    if holidays is not None:
+        years = range(days[0].astype('datetime64[Y]').astype(int) + 1970,
+                      days[-1].astype('datetime64[Y]').astype(int) + 1971)
+        holiday_days = np.array([day for year in years for day in holidays(year)], dtype='datetime64[D]')
+        business &= ~np.isin(days, holiday_days)
+    return business
+
+
+def _assign(order, earliest, limit, n_days, slots_per_day, per_slot, per_day, business):
+    """Timeline position per credit (in `order`), -1 when no slot before its limit has room"""
+    size = n_days * slots_per_day
+    slot_left = [per_slot] * size
+    day_left = [per_day] * n_days
+    # nxt[p] == p for open slots; closed slots point further along the timeline
+    nxt = list(range(size + 1))
+    for day in np.flatnonzero(~business).tolist():
+        for p in range(day * slots_per_day, (day + 1) * slots_per_day):
+            nxt[p] = p + 1
+
+    positions = [-1] * len(order)
+    earliest = earliest.tolist()
+    limit = limit.tolist()
+    for i in order.tolist():
+        p = earliest[i]
+        while nxt[p] != p:
+            nxt[p] = nxt[nxt[p]]
+            p = nxt[p]
+        if p >= limit[i]:
+            continue
+        positions[i] = p
+        slot_left[p] -= 1
+        if not slot_left[p]:
+            nxt[p] = p + 1
+        day = p // slots_per_day
+        day_left[day] -= 1
+        if not day_left[day]:
+            for q in range(day * slots_per_day, (day + 1) * slots_per_day):
+                nxt[q] = q + 1
+    return np.array(positions, dtype=np.int64)
+
+
+def schedule_collections(output_df, capacities=None, max_delay_days=3, holidays=None, priority=PRIORITY):
+    """Assign each output credit a collection slot under the per-emisor capacities.
+
+    output_df is datathon's output; its Date gives the collection day and
+    the earliest time of day. capacities maps idEmisor to overrides of
+    DEFAULT_CAPACITY (default BANK_CAPACITIES); holidays, as in
+    get_calendar, are skipped along with weekends when rolling over.
+
+    Returns (scheduled, unscheduled, utilization): the output rows with
+    Date set to their slot's start, the rows that did not fit (Date
+    unchanged) and the assigned count and capacity of every slot of each
+    (idEmisor, day) that received credits.
+    """
+    if capacities is None:
+        capacities = BANK_CAPACITIES
+    if output_df.empty:
+        return output_df, output_df, pd.DataFrame(columns=UTILIZATION_COLUMNS)
+
+    keys = [output_df[column].to_numpy() for column in reversed(priority)]
+    # lexsort sorts ascending by the last key first; negate for highest first
+    ranking = np.lexsort([output_df['idCredito'].to_numpy()] + [-key for key in keys])
+    rank = np.empty(len(ranking), dtype=np.int64)
+    rank[ranking] = np.arange(len(ranking))
+
+    dates = output_df['Date'].to_numpy(dtype='datetime64[ns]')
+    days = dates.astype('datetime64[D]')
+    minute_of_day = (dates - days).astype('timedelta64[m]').astype(np.int64)
+    emisores = output_df['idEmisor'].to_numpy()
+
+    slot_dates = np.full(len(output_df), np.datetime64('NaT'), dtype='datetime64[ns]')
+    utilization = []
+    for emisor in pd.unique(emisores):
+        capacity = _capacity(capacities, emisor)
+        slot_starts = capacity['slot_starts']
+        slots_per_day = len(slot_starts)
+
+        rows = np.flatnonzero(emisores == emisor)
+        order = np.argsort(rank[rows])
+        first_day = days[rows].min()
+        timeline = np.arange(first_day, days[rows].max() + max_delay_days + 1, dtype='datetime64[D]')
+        day_index = (days[rows] - first_day).astype(np.int64)
+        # First slot starting at or after the emission's time (the next day's first when past the window)
+        earliest_slot = np.searchsorted(slot_starts, minute_of_day[rows], side='left')
+        earliest = day_index * slots_per_day + earliest_slot
+        limit = (day_index + max_delay_days + 1) * slots_per_day
+
+        positions = _assign(order, earliest, limit, len(timeline), slots_per_day,
+                            capacity['per_slot'], capacity['per_day'], _business_days(timeline, holidays))
+        assigned = positions >= 0
+        slot_day, slot = np.divmod(positions[assigned], slots_per_day)
+        slot_dates[rows[assigned]] = (
+            timeline[slot_day].astype('datetime64[ns]') + slot_starts[slot].astype('timedelta64[m]')
+        )
+
+        counts = np.bincount(positions[assigned], minlength=len(timeline) * slots_per_day)
+        used_days = np.unique(slot_day)
+        for day in used_days.tolist():
+            day_counts = counts[day * slots_per_day:(day + 1) * slots_per_day]
+            utilization.append(pd.DataFrame({
+                'idEmisor': emisor,
+                'slot': timeline[day].astype('datetime64[ns]') + slot_starts.astype('timedelta64[m]'),
+                'assigned': day_counts,
+                'capacity': capacity['per_slot'],
+            }))
+
+    fits = ~np.isnat(slot_dates)
+    scheduled = output_df[fits].assign(Date=slot_dates[fits]).reset_index(drop=True)
+    utilization = pd.concat(utilization, ignore_index=True) if utilization else pd.DataFrame(columns=UTILIZATION_COLUMNS)
+    if not utilization.empty:
+        utilization['utilization'] = utilization['assigned'] / utilization['capacity']
+        utilization = utilization.sort_values(['idEmisor', 'slot'], ignore_index=True)[UTILIZATION_COLUMNS]
+    return scheduled, output_df[~fits].reset_index(drop=True), utilization
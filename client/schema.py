@@ -0,0 +1,143 @@
+"""Compact dtypes for collection detail frames.
+
+Amounts are held as int64 cents, so amount comparisons in scoring are
+exact; a column with missing amounts stays float64 cents (whole numbers
+and NaN, still exact), as the baseline pipeline kept them. Ids are int32 and the bank, emisor and response codes are
+categoricals. A column's dtype does not say which unit it holds (whole pesos
+are integers too), so compact() is told whether the amounts it gets are
+already cents, and pesos() only ever converts cents back.
+"""
+import sys
+
+import numpy as np
+import pandas as pd
+
+# Bump when the layout changes, so frames cached with the old one are dropped
+SCHEMA_VERSION = 2
+
+COLLECTION_SCHEMA = {
+    'idListaCobro': 'int32',
+    'idCredito': 'int32',
+    'consecutivoCobro': 'category',
+    'idBanco': 'category',
+    'montoExigible': 'cents',
+    'montoCobrar': 'cents',
+    'montoCobrado': 'cents',
+    'fechaCobroBanco': 'datetime',
+    'idRespuestaBanco': 'category',
+}
+
+MONEY_COLUMNS = ['montoExigible', 'montoCobrar', 'montoCobrado']
+
+# A missing montoCobrado means nothing was collected (the server's default);
+# other missing amounts are kept as NaN, which scoring skips
+ZERO_WHEN_MISSING = {'montoCobrado'}
+
+
+def to_cents(values, name=None):
+    """Amounts in pesos (numbers or decimal strings) as an int64 cents array
+
+    Missing amounts are 0 for ZERO_WHEN_MISSING columns; for others the
+    array is float64 cents with NaN where the amount is missing.
+    """
+    amounts = pd.to_numeric(pd.Series(values, dtype=object) if not isinstance(values, pd.Series) else values)
+    amounts = amounts.to_numpy(dtype=np.float64, na_value=np.nan)
+    missing = np.isnan(amounts)
+    if missing.any():
+        if name not in ZERO_WHEN_MISSING:
+            return np.round(amounts * 100)
+        amounts = np.where(missing, 0.0, amounts)
+    return np.round(amounts * 100).astype(np.int64)
+
+
+def is_cents(values):
+    """Whether an amount column holds cents: integers, or whole floats with NaN gaps"""
+    if pd.api.types.is_integer_dtype(values.dtype):
+        return True
+    if not pd.api.types.is_float_dtype(values.dtype):
+        return False
+    amounts = np.asarray(values, dtype=np.float64)
+    return bool(np.all(np.isnan(amounts) | (amounts == np.round(amounts))))
+
+
+def pesos(values):
+    """Amount column in cents as pesos"""
+    return values / 100
+
+
+def compact(df, cents=False):
+    """Collection frame with COLLECTION_SCHEMA dtypes (columns outside it are kept)
+
+    Amounts are taken as pesos unless cents=True, which frames from ingest,
+    snapshots and compact() itself hold. A frame that already has every
+    dtype is returned as it is.
+    """
+    columns = {}
+    changed = False
+    for name, values in df.items():
+        kind = COLLECTION_SCHEMA.get(name)
+        original = values
+        if kind == 'cents':
+            if not cents:
+                values = pd.Series(to_cents(values, name), index=values.index)
+            elif not is_cents(values):
+                raise ValueError(f"{name} holds {values.dtype} values, not integer cents")
+            elif pd.api.types.is_integer_dtype(values.dtype) and values.dtype != np.int64:
+                values = values.astype(np.int64)
+        elif kind == 'datetime':
+            if not pd.api.types.is_datetime64_any_dtype(values.dtype):
+                values = pd.to_datetime(values)
+        elif kind is not None and values.dtype != kind:
+            values = values.astype(kind)
+        changed = changed or values is not original
+        columns[name] = values
+    if not changed:
+        return df
+    return pd.DataFrame(columns, index=df.index)
+
+
+def concat_frames(frames):
+    """Concatenate frames with the same columns, keeping categoricals (their categories are unioned)"""
+    frames = list(frames)
+    # Empty frames may type their categories differently; they add no rows anyway
+    frames = [frame for frame in frames if len(frame)] or frames[:1]
+    if len(frames) == 1:
+        return frames[0].reset_index(drop=True)
+    columns = {}
+    for name, values in frames[0].items():
+        parts = [frame[name] for frame in frames]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            columns[name] = pd.api.types.union_categoricals(parts, ignore_order=True)
+        else:
+            columns[name] = pd.concat(parts, ignore_index=True)
+    return pd.DataFrame(columns)
+
+
+def _default_bytes(values):
+    """Deep size of a column with pandas' default dtypes (int64/float64, object strings)"""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        categories = values.cat.categories
+        if categories.dtype.kind in 'iuf':
+            return len(values) * 8
+        sizes = np.array([sys.getsizeof(category) for category in categories] + [0])
+        return int(sizes[values.cat.codes.to_numpy()].sum()) + len(values) * 8
+    if values.dtype == object:
+        return int(values.memory_usage(index=False, deep=True))
+    return len(values) * 8
+
+
+def memory_report(df):
+    """Bytes per column as loaded and with default dtypes, plus a 'total' row"""
+    report = pd.DataFrame({
+        'dtype': df.dtypes.astype(str),
+        'bytes': df.memory_usage(index=False, deep=True),
+        'default_bytes': pd.Series({name: _default_bytes(values) for name, values in df.items()}, dtype='int64'),
+    })
+    report.loc['total'] = ['', report['bytes'].sum(), report['default_bytes'].sum()]
+    return report
+
+
+def print_memory_report(df, label='Collection frame'):
+    total = memory_report(df).loc['total']
+    print(f"{label}: {total['bytes'] / 2**20:.1f} MiB in memory "
+          f"({total['default_bytes'] / 2**20:.1f} MiB with default dtypes)")
@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+
+# Recency buckets: each bucket spans 28 days, newest records weigh the most
+RECENCY_BUCKET_DAYS = 28
+RECENCY_MULTIPLIERS = [6, 5, 4, 3, 2]
+
+def recency_multiplier(fechas, current_date):
+    """Return the recency multiplier (6..1) for a column of collection dates"""
+    months_diff = (pd.Timestamp(current_date) - fechas).dt.days / RECENCY_BUCKET_DAYS
+    conditions = [months_diff <= bucket for bucket in range(1, len(RECENCY_MULTIPLIERS) + 1)]
+    # Missing dates compare as False everywhere and fall back to the lowest weight
+    return np.select(conditions, RECENCY_MULTIPLIERS, default=1)
+
+def row_point_deltas(df):
+    """Return the per-row point delta (before the recency multiplier)"""
+    monto_cobrar = df['montoCobrar']
+    monto_cobrado = df['montoCobrado']
+    complete = df['montoExigible'].notna() & monto_cobrado.notna()
+
+    deltas = np.where(monto_cobrar != monto_cobrado, -1, 0)
+    deltas += np.where(complete & (monto_cobrar == monto_cobrado), 1, 0)
+    deltas += np.where(complete & (df['montoExigible'] == monto_cobrado), 1, 0)
+    return deltas
+
+# Columns of the per-credit summary shared by full, sharded and incremental scoring
+SUMMARY_COLUMNS = [
+    'points', 'monto', 'idBanco', 'montoExigible', 'montoCobrar',
+    'montoCobrado', 'fechaCobroBanco', 'lastEmisor'
+]
+
+def summarize_credits(df, current_date):
+    """Reduce collection rows to one row per credit (sorted by idCredito)
+
+    points and monto cover the whole history; idBanco comes from the first
+    row, the monto*/fecha columns from the last row and lastEmisor from the
+    last successful payment.
+    """
+    rows = df[df['idCredito'].notna()].reset_index(drop=True)
+    if rows.empty:
+        return pd.DataFrame(columns=SUMMARY_COLUMNS)
+    rows['fechaCobroBanco'] = pd.to_datetime(rows['fechaCobroBanco'])
+
+    # Per-row points, weighted by how recent the collection attempt is
+    rows['points'] = row_point_deltas(rows) * recency_multiplier(rows['fechaCobroBanco'], current_date)
+
+    grouped = rows.groupby('idCredito', sort=True)
+    credit_ids = grouped.size().index
+    first_rows = rows.drop_duplicates('idCredito', keep='first').set_index('idCredito').reindex(credit_ids)
+    last_rows = rows.drop_duplicates('idCredito', keep='last').set_index('idCredito').reindex(credit_ids)
+
+    credits = last_rows[['montoExigible', 'montoCobrar', 'montoCobrado', 'fechaCobroBanco']].copy()
+    credits['points'] = grouped['points'].sum()
+    credits['monto'] = grouped['montoExigible'].sum() - grouped['montoCobrado'].sum()
+    credits['idBanco'] = first_rows['idBanco']
+
+    # Emisor of the last successful payment per credit
+    paid_rows = rows[rows['montoCobrado'] > 0]
+    credits['lastEmisor'] = (
+        paid_rows.drop_duplicates('idCredito', keep='last')
+        .set_index('idCredito')['idRespuestaBanco']
+        .reindex(credit_ids)
+    )
+    return credits[SUMMARY_COLUMNS]
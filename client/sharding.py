@@ -0,0 +1,126 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from profiling import stage
+
+# Columns the scorer reads; everything else stays in the parent process
+SCORING_COLUMNS = [
+    'idCredito', 'idBanco', 'montoExigible', 'montoCobrar',
+    'montoCobrado', 'fechaCobroBanco', 'idRespuestaBanco'
+]
+
+
+def default_workers():
+    """Worker count from DATATHON_WORKERS, falling back to a single process"""
+    return int(os.getenv('DATATHON_WORKERS', '1'))
+
+
+def shard_ids(id_credito, n_shards):
+    """Stable shard number per row, derived from a hash of idCredito"""
+    hashes = pd.util.hash_pandas_object(id_credito, index=False).to_numpy()
+    return (hashes % np.uint64(n_shards)).astype(np.int64)
+
+
+def _share_columns(df):
+    """Copy scoring columns into shared memory blocks.
+
+    Numeric and datetime columns are shared as-is; categoricals share their
+    codes and anything else (e.g. idRespuestaBanco strings) is factorized,
+    so only the small list of distinct values travels with each task.
+    Workers rebuild both as categoricals.
+    """
+    blocks = []
+    columns = {}
+    for name in SCORING_COLUMNS:
+        series = df[name]
+        uniques = None
+        if series.dtype.kind in 'biufM' and getattr(series.dtype, 'tz', None) is None:
+            values = series.to_numpy()
+        elif isinstance(series.dtype, pd.CategoricalDtype):
+            values = series.cat.codes.to_numpy()
+            uniques = list(series.cat.categories)
+        else:
+            values, uniques = pd.factorize(series)
+            uniques = list(uniques)
+
+        shm = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+        blocks.append(shm)
+        np.ndarray(values.shape, dtype=values.dtype, buffer=shm.buf)[:] = values
+        columns[name] = (shm.name, values.dtype.str, len(values), uniques)
+    return blocks, columns
+
+
+def _score_shard(score, columns, start, stop, kwargs):
+    """Worker: rebuild one shard from shared memory and score it"""
+    blocks = []
+    data = {}
+    try:
+        for name, (shm_name, dtype, length, uniques) in columns.items():
+            shm = shared_memory.SharedMemory(name=shm_name)
+            blocks.append(shm)
+            view = np.ndarray(length, dtype=dtype, buffer=shm.buf)[start:stop]
+            if uniques is None:
+                data[name] = view.copy()
+            else:
+                data[name] = pd.Categorical.from_codes(view.copy(), categories=uniques)
+            del view
+        return score(pd.DataFrame(data), **kwargs)
+    finally:
+        for shm in blocks:
+            shm.close()
+
+
+def merge_shard_results(results):
+    """Combine per-shard (output_df, points_map) pairs in single-process order"""
+    frames = [output_df for output_df, _ in results if not output_df.empty]
+    if frames:
+        output_df = (
+            pd.concat(frames, ignore_index=True)
+            .sort_values('idCredito', kind='stable')
+            .reset_index(drop=True)
+        )
+    else:
+        output_df = pd.DataFrame([])
+
+    merged = {}
+    for _, points_map in results:
+        merged.update(points_map)
+    points_map = {id_credito: merged[id_credito] for id_credito in sorted(merged)}
+    return output_df, points_map
+
+
+def process_credits_sharded(df, score, workers, **kwargs):
+    """Score df with `score` across `workers` processes, sharded by idCredito.
+
+    Each credit lands entirely in one shard, so shard results only need to be
+    merged and re-sorted to match a single-process run.
+    """
+    with stage('split', len(df)):
+        rows = df.loc[df['idCredito'].notna(), SCORING_COLUMNS]
+        shards = shard_ids(rows['idCredito'], workers)
+        # Stable sort keeps each credit's rows in their original relative order
+        order = np.argsort(shards, kind='stable')
+        rows = rows.take(order)
+        bounds = np.searchsorted(shards[order], np.arange(workers + 1))
+
+        blocks, columns = _share_columns(rows)
+    try:
+        # Worker CPU time is added to the stage once the pool has shut down
+        with stage('score_shards', len(rows)), ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(_score_shard, score, columns, int(start), int(stop), kwargs)
+                for start, stop in zip(bounds[:-1], bounds[1:])
+                if stop > start
+            ]
+            results = [future.result() for future in futures]
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+
+    with stage('merge'):
+        return merge_shard_results(results)
@@ -0,0 +1,132 @@
+import json
+import os
+
+from pyarrow import feather
+
+from schema import concat_frames
+
+SNAPSHOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'snapshot')
+MANIFEST_VERSION = 3
+
+# Segments kept before append() merges them into one
+MAX_SEGMENTS = 8
+
+SORT_COLUMNS = ['idCredito', 'fechaCobroBanco']
+
+
+class Snapshot:
+    """Collection detail rows kept on disk as a list of Feather segments.
+
+    Every fetch appends one uncompressed Feather (Arrow IPC) file, which is
+    memory-mapped on read; compact() merges them. manifest.json lists the
+    segments with the server's ETag, the id cursor the next fetch resumes
+    after and the server's edit count when they were fetched. Segments are
+    written before the manifest that refers to them, so an interrupted run
+    leaves the previous snapshot readable.
+    """
+
+    def __init__(self, directory=SNAPSHOT_DIR):
+        self.directory = directory
+        self.segments = []
+        self.next_segment = 1
+        self.etag = None
+        self.last_id = 0
+        self.edits = None
+
+    @classmethod
+    def load(cls, directory=SNAPSHOT_DIR):
+        """Return the saved snapshot, or None when there is nothing usable"""
+        try:
+            with open(os.path.join(directory, 'manifest.json')) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if manifest.get('version') != MANIFEST_VERSION:
+            return None
+
+        snapshot = cls(directory)
+        snapshot.segments = manifest['segments']
+        snapshot.next_segment = manifest['next_segment']
+        snapshot.etag = manifest['etag']
+        snapshot.last_id = manifest['last_id']
+        snapshot.edits = manifest['edits']
+        if not all(os.path.exists(snapshot._path(segment['file'])) for segment in snapshot.segments):
+            return None
+        return snapshot
+
+    @property
+    def rows(self):
+        return sum(segment['rows'] for segment in self.segments)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _save(self):
+        manifest = {
+            'version': MANIFEST_VERSION,
+            'segments': self.segments,
+            'next_segment': self.next_segment,
+            'etag': self.etag,
+            'last_id': self.last_id,
+            'edits': self.edits,
+        }
+        path = self._path('manifest.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(path + '.tmp', path)
+
+    def _write_segment(self, df):
+        name = f'segment_{self.next_segment:06d}.feather'
+        self.next_segment += 1
+        path = self._path(name)
+        feather.write_feather(df.reset_index(drop=True), path + '.tmp', compression='uncompressed')
+        os.replace(path + '.tmp', path)
+        self.segments.append({'file': name, 'rows': len(df)})
+
+    def _remove(self, segments):
+        for segment in segments:
+            try:
+                os.remove(self._path(segment['file']))
+            except FileNotFoundError:
+                pass
+
+    def replace(self, df, etag, last_id, edits):
+        """Make df, a full download up to id last_id at edit count edits, the whole snapshot"""
+        os.makedirs(self.directory, exist_ok=True)
+        old_segments, self.segments = self.segments, []
+        self._write_segment(df)
+        self.etag, self.last_id, self.edits = etag, last_id, edits
+        self._save()
+        self._remove(old_segments)
+
+    def append(self, df, etag, last_id):
+        """Add the rows added after the id cursor, up to id last_id, as a new segment"""
+        if len(df):
+            self._write_segment(df)
+        self.etag, self.last_id = etag, last_id
+        self._save()
+        if len(self.segments) > MAX_SEGMENTS:
+            self.compact()
+
+    def read(self):
+        """All rows, sorted by idCredito and fechaCobroBanco"""
+        # Each segment's dictionaries have their own index width and value type
+        # (an all-null column has none), so segments are joined as frames
+        frames = [
+            feather.read_table(self._path(segment['file']), memory_map=True).to_pandas()
+            for segment in self.segments
+        ]
+        df = concat_frames(frames)
+        if len(frames) > 1:
+            df = df.sort_values(SORT_COLUMNS, kind='stable', ignore_index=True)
+        return df
+
+    def compact(self):
+        """Merge all segments into one"""
+        if len(self.segments) > 1:
+            old_segments = self.segments
+            df = self.read()
+            self.segments = []
+            self._write_segment(df)
+            self._save()
+            self._remove(old_segments)
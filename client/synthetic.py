@@ -0,0 +1,153 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+
+# Share of credits per idBanco (BBVA, Santander, Banamex, other)
+DEFAULT_BANK_MIX = {12: 0.45, 14: 0.25, 2: 0.2, 72: 0.1}
+
+# Emisor ids seen in idRespuestaBanco, per bank
+BANK_EMISORS = {
+    12: ['5923', '4750', '05503'],
+    14: ['00623'],
+    2: ['00496', '06114'],
+}
+OTHER_EMISORS = ['00496']
+
+# Credits generated per random stream; fixed so output does not depend on
+# how the caller chunks it
+CHUNK_CREDITS = 100_000
+
+COLUMNS = [
+    'idListaCobro', 'idCredito', 'consecutivoCobro', 'idBanco', 'montoExigible',
+    'montoCobrar', 'montoCobrado', 'fechaCobroBanco', 'idRespuestaBanco',
+]
+
+
+def fortnight_dates(start, end):
+    """Collection days between start and end: the 15th and the last day of each month"""
+    months = pd.date_range(pd.Timestamp(start).to_period('M').to_timestamp(), end, freq='MS')
+    days = np.sort(np.concatenate([
+        (months + pd.Timedelta(days=14)).to_numpy(),
+        (months + pd.offsets.MonthEnd(0)).to_numpy(),
+    ]))
+    return days[(days >= np.datetime64(pd.Timestamp(start))) & (days <= np.datetime64(pd.Timestamp(end)))]
+
+
+def _chunk(rng, first_credit, n_credits, days, payments_per_credit, bank_ids, bank_weights,
+           failure_rate, partial_rate):
+    n_days = len(days)
+    counts = np.minimum(1 + rng.poisson(payments_per_credit - 1, size=n_credits), n_days)
+    n_rows = int(counts.sum())
+    credit_index = np.repeat(np.arange(n_credits), counts)
+    # Row position within its credit: 0, 1, ..., count - 1
+    position = np.arange(n_rows) - np.repeat(np.cumsum(counts) - counts, counts)
+
+    banks = rng.choice(bank_ids, size=n_credits, p=bank_weights)
+    # Installments are log-normal around 1,500, in whole pesos
+    installment = np.clip(np.round(rng.lognormal(np.log(1500), 0.8, size=n_credits)), 150, 50_000)
+    # Each credit is charged on consecutive collection days from a random start
+    first_day = (rng.random(n_credits) * (n_days - counts + 1)).astype(np.int64)
+
+    day_index = first_day[credit_index] + position
+    fecha = days[day_index] + (8 * 3600 + rng.integers(0, 3 * 3600, size=n_rows)) * np.timedelta64(1, 's')
+
+    monto = installment[credit_index]
+    outcome = rng.random(n_rows)
+    cobrado = np.where(
+        outcome < failure_rate, 0.0,
+        np.where(outcome < failure_rate + partial_rate,
+                 np.round(monto * rng.uniform(0.2, 0.9, size=n_rows), 2), monto)
+    )
+
+    row_banks = banks[credit_index]
+    emisor = np.empty(n_rows, dtype=object)
+    for bank in np.unique(row_banks):
+        rows = row_banks == bank
+        emisor[rows] = rng.choice(BANK_EMISORS.get(int(bank), OTHER_EMISORS), size=int(rows.sum()))
+
+    return pd.DataFrame({
+        'idListaCobro': day_index + 1,
+        'idCredito': first_credit + credit_index,
+        'consecutivoCobro': (position + 1).astype(str).astype(object),
+        'idBanco': row_banks,
+        'montoExigible': monto,
+        'montoCobrar': monto,
+        'montoCobrado': cobrado,
+        'fechaCobroBanco': fecha,
+        'idRespuestaBanco': emisor,
+    }, columns=COLUMNS)
+
+
+def iter_history(n_credits, payments_per_credit=10, bank_mix=None, failure_rate=0.35, partial_rate=0.1,
+                 start='2022-01-01', end='2025-06-30', seed=0):
+    """Yield a synthetic ListaCobroDetalle history CHUNK_CREDITS credits at a time.
+
+    Every credit belongs to one bank (drawn from bank_mix) and is charged a
+    fixed installment on consecutive fortnight collection days; each attempt
+    fails (failure_rate), is paid partially (partial_rate) or in full. Rows
+    come sorted by (idCredito, fechaCobroBanco). The same arguments always
+    give the same rows.
+    """
+    bank_mix = bank_mix or DEFAULT_BANK_MIX
+    bank_ids = np.array(list(bank_mix))
+    bank_weights = np.array(list(bank_mix.values()), dtype=float)
+    bank_weights /= bank_weights.sum()
+    days = fortnight_dates(start, end)
+
+    seeds = np.random.SeedSequence(seed).spawn(-(-n_credits // CHUNK_CREDITS))
+    for chunk, chunk_seed in enumerate(seeds):
+        first = chunk * CHUNK_CREDITS
+        size = min(CHUNK_CREDITS, n_credits - first)
+        yield _chunk(np.random.default_rng(chunk_seed), first + 1, size, days, payments_per_credit,
+                     bank_ids, bank_weights, failure_rate, partial_rate)
+
+
+def generate_history(n_credits, **kwargs):
+    """The whole iter_history() output as one DataFrame"""
+    return pd.concat(iter_history(n_credits, **kwargs), ignore_index=True)
+
+
+def credits_for_rows(rows, payments_per_credit=10):
+    """Credits needed for roughly `rows` rows"""
+    return max(1, round(rows / payments_per_credit))
+
+
+def write_csv(chunks, path):
+    """Write history chunks as a load_cobranza CSV; returns the row count"""
+    rows = 0
+    with open(path, 'w', newline='') as f:
+        for i, df in enumerate(chunks):
+            df = df.assign(fechaCobroBanco=df['fechaCobroBanco'].dt.strftime('%Y-%m-%dT%H:%M:%S'))
+            df.to_csv(f, index=False, header=i == 0, float_format='%.2f')
+            rows += len(df)
+    return rows
+
+
+def parse_bank_mix(text):
+    """'12:0.5,14:0.3,2:0.2' -> {12: 0.5, 14: 0.3, 2: 0.2}"""
+    return {int(bank): float(weight) for bank, weight in (item.split(':') for item in text.split(','))}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write a synthetic collection history as CSV for load_cobranza')
+    parser.add_argument('output')
+    parser.add_argument('--rows', type=int, default=1_000_000, help='Approximate number of rows')
+    parser.add_argument('--payments-per-credit', type=float, default=10)
+    parser.add_argument('--bank-mix', type=parse_bank_mix, default=DEFAULT_BANK_MIX,
+                        help='idBanco:weight pairs, e.g. 12:0.5,14:0.3,2:0.2')
+    parser.add_argument('--failure-rate', type=float, default=0.35)
+    parser.add_argument('--partial-rate', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    chunks = iter_history(
+        credits_for_rows(args.rows, args.payments_per_credit), payments_per_credit=args.payments_per_credit,
+        bank_mix=args.bank_mix, failure_rate=args.failure_rate, partial_rate=args.partial_rate, seed=args.seed,
+    )
+    rows = write_csv(chunks, args.output)
+    print(f"Wrote {rows:,} rows to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
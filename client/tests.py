@@ -0,0 +1,1295 @@
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+from datetime import datetime, timedelta
+from decimal import Decimal
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import requests
+
+import datathon
+from api_client import API_URL, ARROW_STREAM, FRAME_ACCEPT, ApiClient, shard_plan
+from benchmarks import compare_results
+from charts import render_charts, summarize_for_charts
+from emission import DecisionTable
+from fortnight_calendar import FortnightCalendar, mexican_bank_holidays
+from incremental import ScoringState, update_state
+from ingest import ByteBudget, MemoryLimitExceeded, read_arrow_frame, read_ndjson_frame
+from profiling import Profiler, stage
+from reports import FIXED_WIDTH_LAYOUTS, load_layouts, write_report
+from scheduler import schedule_collections
+from schema import compact, concat_frames, memory_report, pesos
+from scoring import summarize_credits
+from snapshot import Snapshot
+from synthetic import generate_history, write_csv
+
+
+def legacy_emision_elegida(id_banco, points, monto_exigible, monto_cobrado, last_emisor_id=None):
+    """If-chain the emission decision table replaced; DEFAULT_DECISION_TABLE must choose the same"""
+    if last_emisor_id in datathon.MORNING_EMISORS and id_banco == 12:
+        return 'bbva_matutino', datathon.BBVA_MATUTINO
+    if id_banco == 12:
+        return 'bbva_cobrar_mismo', datathon.BBVA_COBRAR_MISMO
+    elif points < 0 or (monto_exigible != monto_cobrado and id_banco != 12):
+        return 'bbva_interbancario', datathon.BBVA_INTERBANCARIO
+    elif id_banco == 14:
+        return 'santander_cobrar_mismo', datathon.SANTANDER_COBRAR_MISMO
+    elif id_banco == 2:
+        return 'banamex_cobrar_mismo', datathon.BANAMEX_COBRAR_MISMO
+    else:
+        return 'banamex_interbancario', datathon.BANAMEX_INTERBANCARIO
+
+
+def legacy_process_credits(df, current_date):
+    """Row-by-row reference implementation the vectorized scorer must match"""
+    output_data = []
+    points_map = {}
+
+    for id_credito, credit_group in df.groupby('idCredito'):
+        points = 0
+        monto = float(credit_group['montoExigible'].sum())
+        monto = monto - float(credit_group['montoCobrado'].sum())
+        id_banco = credit_group.iloc[0]['idBanco']
+        last_emisor_id = None
+
+        paid = credit_group[credit_group['montoCobrado'] > 0]
+        last_payment = paid.iloc[-1] if len(paid) > 0 else None
+        if last_payment is not None and not pd.isna(last_payment['idRespuestaBanco']):
+            last_emisor_id = last_payment['idRespuestaBanco']
+
+        for idx, row in credit_group.iterrows():
+            record_date = row['fechaCobroBanco']
+            if pd.isna(record_date):
+                months_diff = float('inf')
+            else:
+                months_diff = (current_date - record_date).days / 28
+
+            multiplier = 6 if months_diff <= 1 else (
+                5 if months_diff <= 2 else (
+                4 if months_diff <= 3 else (
+                3 if months_diff <= 4 else (
+                2 if months_diff <= 5 else 1))))
+
+            if row['montoCobrar'] != row['montoCobrado']:
+                points -= 1 * multiplier
+
+            selected_date = 'no pago'
+            if pd.notna(row['montoExigible']) and pd.notna(row['montoCobrado']):
+                if row['montoCobrar'] == row['montoCobrado']:
+                    points += 1 * multiplier
+                    fecha_cobro = row['fechaCobroBanco']
+                    if pd.notna(fecha_cobro):
+                        day = fecha_cobro.day
+                        if day <= 8:
+                            fortnight_date = fecha_cobro.replace(day=1)
+                        elif day >= 23:
+                            if fecha_cobro.month == 12:
+                                fortnight_date = fecha_cobro.replace(year=fecha_cobro.year + 1, month=1, day=1)
+                            else:
+                                fortnight_date = fecha_cobro.replace(month=fecha_cobro.month + 1, day=1)
+                        else:
+                            fortnight_date = fecha_cobro.replace(day=15)
+
+                        while fortnight_date.weekday() >= 5:
+                            fortnight_date = fortnight_date - timedelta(days=1)
+
+                        selected_date = fortnight_date
+
+                if row['montoExigible'] == row['montoCobrado']:
+                    points += 1 * multiplier
+
+        points_map[id_credito] = points
+
+        last_row = credit_group.iloc[-1]
+        monto_tot = float(last_row['montoExigible'])
+        monto_cobrado = float(last_row['montoCobrado'])
+
+        emision_name, emision_fee = legacy_emision_elegida(
+            id_banco, points, monto_tot, monto_cobrado, last_emisor_id
+        )
+
+        cobrar = monto_tot > emision_fee
+        parcial = points <= 0 or monto > 10000
+
+        if cobrar and monto > 0 and selected_date != 'no pago':
+            collection_time = datathon.COLLECTION_HOURS[emision_name]
+            selected_date = selected_date.replace(
+                hour=collection_time['hour'],
+                minute=collection_time['minute']
+            )
+            output_data.append({
+                'idCredito': id_credito,
+                'idEmisor': datathon.EMISOR_MAPPING[emision_name],
+                'montoExigible': monto,
+                'montoACobrar': monto,
+                'emisionUsada': emision_name,
+                'points': points,
+                'Parcial': parcial,
+                'Date': selected_date
+            })
+
+    return pd.DataFrame(output_data), points_map
+
+
+def make_collection_history(n_credits=300, max_rows=12, seed=7):
+    """Random collection history covering paid, partial, failed and missing rows"""
+    rng = np.random.default_rng(seed)
+    records = []
+    start = datetime(2024, 1, 1)
+    for id_credito in rng.permutation(np.arange(1, n_credits + 1)):
+        id_banco = int(rng.choice([12, 14, 2, 72]))
+        for _ in range(int(rng.integers(1, max_rows + 1))):
+            monto = float(rng.choice([150.0, 500.0, 1250.5, 12000.0, 4.0]))
+            outcome = rng.random()
+            if outcome < 0.5:
+                cobrado = monto
+            elif outcome < 0.7:
+                cobrado = round(monto / 2, 2)
+            elif outcome < 0.95:
+                cobrado = 0.0
+            else:
+                cobrado = np.nan
+            fecha = start + timedelta(days=int(rng.integers(0, 540)), seconds=int(rng.integers(0, 86400)))
+            records.append({
+                'idListaCobro': 1,
+                'idCredito': int(id_credito),
+                'consecutivoCobro': '1',
+                'idBanco': id_banco,
+                'montoExigible': monto,
+                'montoCobrar': monto,
+                'montoCobrado': cobrado,
+                'fechaCobroBanco': fecha if rng.random() > 0.03 else pd.NaT,
+                'idRespuestaBanco': rng.choice(['05503', '06114', '00623', None]),
+            })
+    df = pd.DataFrame(records)
+    df['fechaCobroBanco'] = pd.to_datetime(df['fechaCobroBanco'])
+    return df.sort_values(['idCredito', 'fechaCobroBanco']).reset_index(drop=True)
+
+
+class ProcessCreditsParityTest(unittest.TestCase):
+    current_date = datetime(2025, 6, 1, 12, 0)
+
+    def assert_matches_legacy(self, df):
+        expected_df, expected_points = legacy_process_credits(df, self.current_date)
+        output_df, points_map = datathon.process_credits_optimized(df, self.current_date)
+
+        self.assertEqual(points_map, expected_points)
+        pd.testing.assert_frame_equal(output_df, expected_df)
+        return output_df, expected_df
+
+    def test_matches_row_by_row_loop(self):
+        self.assert_matches_legacy(make_collection_history())
+
+    def test_integer_pesos_match_legacy_scoring_and_export(self):
+        df = make_collection_history(seed=17)
+        df = df[(df['montoExigible'] % 1 == 0) & (df['montoCobrado'] % 1 == 0)]
+        df = df.astype({column: 'int64' for column in ['montoExigible', 'montoCobrar', 'montoCobrado']})
+        output_df, expected_df = self.assert_matches_legacy(df)
+        self.assertFalse(output_df.empty)
+
+        directory = tempfile.mkdtemp()
+        paths = write_report(output_df, os.path.join(directory, 'output'), 'fixed')
+        expected_paths = write_report(expected_df, os.path.join(directory, 'expected'), 'fixed')
+        for path, expected_path in zip(paths, expected_paths, strict=True):
+            with open(path) as f, open(expected_path) as expected:
+                self.assertEqual(f.read(), expected.read())
+
+    def test_matches_unsorted_input(self):
+        df = make_collection_history(seed=11).sample(frac=1, random_state=3)
+        self.assert_matches_legacy(df)
+
+    def test_sharded_run_matches_single_process(self):
+        df = make_collection_history(seed=5)
+        expected_df, expected_points = datathon.process_credits_optimized(df, self.current_date)
+        output_df, points_map = datathon.process_credits_optimized(df, self.current_date, workers=3)
+
+        self.assertEqual(list(points_map.items()), list(expected_points.items()))
+        pd.testing.assert_frame_equal(output_df, expected_df)
+
+    def test_empty_frame(self):
+        df = make_collection_history().iloc[0:0]
+        output_df, points_map = datathon.process_credits_optimized(df, self.current_date)
+        self.assertTrue(output_df.empty)
+        self.assertEqual(points_map, {})
+
+
+class CompactSchemaTest(unittest.TestCase):
+    current_date = datetime(2025, 6, 1, 12, 0)
+
+    def setUp(self):
+        self.df = make_collection_history(seed=29)
+        self.compact = compact(self.df)
+
+    def assert_same_output(self, result, expected):
+        output_df, points_map = result
+        expected_df, expected_points = expected
+        self.assertEqual(points_map, expected_points)
+        pd.testing.assert_frame_equal(output_df, expected_df)
+
+    def test_dtypes_and_memory(self):
+        dtypes = self.compact.dtypes.astype(str).to_dict()
+        self.assertEqual(dtypes['idCredito'], 'int32')
+        self.assertEqual(dtypes['montoCobrar'], 'int64')
+        self.assertEqual((dtypes['idBanco'], dtypes['idRespuestaBanco']), ('category', 'category'))
+        self.assertEqual(self.compact['montoCobrar'].iloc[0], round(self.df['montoCobrar'].iloc[0] * 100))
+
+        report = memory_report(self.compact)
+        self.assertLess(report.loc['total', 'bytes'], report.loc['total', 'default_bytes'] / 2)
+        # The default-dtype estimate is close to what the float/object frame really takes
+        actual = memory_report(self.df).loc['total', 'bytes']
+        self.assertAlmostEqual(report.loc['total', 'default_bytes'], actual, delta=actual * 0.05)
+
+    def test_missing_amounts_stay_nan(self):
+        df = self.df.copy()
+        df.loc[[3, 40], 'montoExigible'] = np.nan
+        df.loc[7, 'montoCobrar'] = np.nan
+        result = compact(df)
+        self.assertEqual(result['montoExigible'].dtype, np.float64)
+        self.assertEqual(result['montoExigible'].isna().sum(), 2)
+        self.assertEqual(result['montoExigible'].iloc[4], round(df['montoExigible'].iloc[4] * 100))
+        self.assertEqual(result['montoCobrado'].dtype, np.int64)
+        self.assertIs(compact(result, cents=True), result)
+
+        expected_df, expected_points = legacy_process_credits(df, self.current_date)
+        output_df, points_map = datathon.process_credits_optimized(df, self.current_date)
+        self.assertEqual(points_map, expected_points)
+        pd.testing.assert_frame_equal(output_df, expected_df)
+
+    def test_cents_flag(self):
+        self.assertIs(compact(self.compact, cents=True), self.compact)
+        # Whole pesos held as integers are still pesos
+        whole = self.df.assign(montoCobrar=self.df['montoCobrar'].round().astype('int64'))
+        self.assertEqual(compact(whole)['montoCobrar'].iloc[0], whole['montoCobrar'].iloc[0] * 100)
+        with self.assertRaisesRegex(ValueError, 'montoExigible holds float64 values, not integer cents'):
+            compact(self.df, cents=True)
+
+    def test_amounts_compare_exactly(self):
+        rows = make_collection_history(n_credits=1, max_rows=1, seed=3).assign(
+            montoExigible=0.3, montoCobrar=0.3, montoCobrado=0.1 + 0.2, idRespuestaBanco=None,
+        )
+        # Float pesos are converted to cents before they are compared
+        _, points = datathon.process_credits_optimized(rows, self.current_date)
+        self.assertGreater(list(points.values())[0], 0)
+
+    def test_credits_output_needs_cents(self):
+        with self.assertRaisesRegex(ValueError, 'monto holds float64 values, not integer cents'):
+            datathon.credits_output(summarize_credits(self.df, self.current_date))
+
+    def test_scoring_paths_match_float_frame(self):
+        expected = datathon.process_credits_optimized(self.df, self.current_date)
+        self.assert_same_output(
+            datathon.process_credits_optimized(self.compact, self.current_date, cents=True), expected
+        )
+        self.assert_same_output(
+            datathon.process_credits_optimized(self.compact, self.current_date, workers=2, cents=True), expected
+        )
+
+        dated = self.df['fechaCobroBanco'].notna()
+        state = update_state(self.compact[dated], self.current_date, cents=True)
+        self.assert_same_output(
+            datathon.credits_output(state.summary(self.current_date)),
+            datathon.process_credits_optimized(self.df[dated], self.current_date),
+        )
+
+    def test_chart_summaries_in_pesos(self):
+        points_map = datathon.process_credits_optimized(self.df, self.current_date)[1]
+        expected = summarize_for_charts(self.df, points_map, datathon.BANK_MAPPING)
+        summaries = summarize_for_charts(self.compact, points_map, datathon.BANK_MAPPING, cents=True)
+        for name, data in expected.items():
+            pd.testing.assert_frame_equal(summaries[name], data, check_dtype=False)
+
+
+def in_fetch_order(df):
+    """Rows by (idCredito, fechaCobroBanco), undated last and ties in the order they were added"""
+    return df.sort_values(['idCredito', 'fechaCobroBanco'], kind='stable', na_position='last')
+
+
+class IncrementalScoringTest(unittest.TestCase):
+
+    def setUp(self):
+        df = make_collection_history(seed=13)
+        # Rows without a date cannot be ordered against the high-water mark
+        self.df = df[df['fechaCobroBanco'].notna()].reset_index(drop=True)
+
+    def assert_matches_full_rescore(self, state, current_date):
+        expected_df, expected_points = datathon.process_credits_optimized(self.df, current_date)
+        output_df, points_map = datathon.credits_output(state.summary(current_date))
+        self.assertEqual(points_map, expected_points)
+        pd.testing.assert_frame_equal(output_df, expected_df)
+
+    def test_split_runs_match_full_rescore(self):
+        first_run = datetime(2024, 11, 1)
+        initial = self.df[self.df['fechaCobroBanco'] <= first_run]
+        state = update_state(initial, first_run)
+
+        # Several months later, so earlier contributions must move buckets
+        second_run = datetime(2025, 6, 1, 12, 0)
+        delta = self.df[self.df['fechaCobroBanco'] > first_run]
+        state = update_state(delta, second_run, state)
+        self.assert_matches_full_rescore(state, second_run)
+
+    def test_rows_added_in_any_date_order(self):
+        # Rows loaded in a random order, undated ones included: later runs get backdated rows
+        self.df = make_collection_history(seed=13).sample(frac=1, random_state=5).reset_index(drop=True)
+        runs = [(datetime(2025, 3, 1), self.df[:600]), (datetime(2025, 6, 1, 12, 0), self.df[600:])]
+        state = None
+        for run_date, rows in runs:
+            state = update_state(in_fetch_order(rows), run_date, state, last_id=rows.index[-1] + 1)
+        self.assertEqual(state.last_id, len(self.df))
+        dated = self.df[self.df['fechaCobroBanco'].notna()]
+        self.assertEqual(state.totals['montoCobrado'], int((dated['montoCobrado'].fillna(0) * 100).round().sum()))
+
+        self.df = in_fetch_order(self.df)
+        self.assert_matches_full_rescore(state, runs[-1][0])
+
+    def test_state_round_trip(self):
+        run_date = datetime(2025, 6, 1)
+        with tempfile.TemporaryDirectory() as cache_dir:
+            path = os.path.join(cache_dir, 'state.pkl')
+            update_state(self.df, run_date).save(path)
+            state = ScoringState.load(path)
+        self.assert_matches_full_rescore(state, datetime(2025, 7, 15))
+
+    def test_rejects_older_current_date(self):
+        state = update_state(self.df, datetime(2025, 6, 1))
+        with self.assertRaises(ValueError):
+            state.summary(datetime(2025, 5, 1))
+
+
+def to_ndjson_lines(df):
+    """Encode a history the way /api/collection-details/ does"""
+    lines = []
+    for record in df.to_dict('records'):
+        fecha = record['fechaCobroBanco']
+        record['fechaCobroBanco'] = None if pd.isna(fecha) else fecha.isoformat() + 'Z'
+        for column in ['montoExigible', 'montoCobrar', 'montoCobrado']:
+            record[column] = None if pd.isna(record[column]) else f"{record[column]:.2f}"
+        lines.append(json.dumps(record).encode())
+    return lines
+
+
+def to_arrow_stream(df, batch_rows=100):
+    """Encode a history the way /api/collection-details/ does for Arrow clients, in batch_rows batches"""
+    def amounts(values):
+        return pa.array([None if pd.isna(value) else Decimal(f"{value:.2f}") for value in values], pa.decimal128(10, 2))
+
+    def batch(rows):
+        return pa.record_batch({
+            'idListaCobro': pa.array(rows['idListaCobro'], pa.int32()),
+            'idCredito': pa.array(rows['idCredito'], pa.int32()),
+            'consecutivoCobro': pa.array(rows['consecutivoCobro'], pa.string()).dictionary_encode(),
+            'idBanco': pa.array(rows['idBanco'], pa.int32()),
+            'montoExigible': amounts(rows['montoExigible']),
+            'montoCobrar': amounts(rows['montoCobrar']),
+            'montoCobrado': amounts(rows['montoCobrado']),
+            'fechaCobroBanco': pa.array(rows['fechaCobroBanco'].dt.tz_localize('UTC'), pa.timestamp('us', tz='UTC')),
+            'idRespuestaBanco': pa.array(rows['idRespuestaBanco'], pa.string()).dictionary_encode(),
+        })
+
+    batches = [batch(df[start:start + batch_rows]) for start in range(0, max(len(df), 1), batch_rows)]
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, batches[0].schema) as writer:
+        for record_batch in batches:
+            if record_batch.num_rows:
+                writer.write_batch(record_batch)
+    return sink.getvalue()
+
+
+class StreamingIngestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.df = make_collection_history(n_credits=50, seed=17)
+        self.lines = to_ndjson_lines(self.df)
+
+    def test_batches_rebuild_typed_frame(self):
+        progress = []
+        df = read_ndjson_frame(self.lines, batch_size=64, progress=lambda rows, _: progress.append(rows))
+
+        self.assertEqual(progress[-1], len(self.df))
+        self.assertEqual(len(progress), -(-len(self.df) // 64))
+        self.assertEqual(df['idCredito'].dtype, np.int32)
+        self.assertEqual(df['fechaCobroBanco'].dtype, 'datetime64[ns]')
+        self.assertEqual(df['idRespuestaBanco'].dtype, 'category')
+        self.assertEqual(df['idBanco'].dtype, 'category')
+        self.assertEqual(df['montoCobrado'].dtype, np.int64)
+        # Amounts arrive as cents; a missing montoCobrado means nothing was collected
+        pd.testing.assert_series_equal(pesos(df['montoCobrado']), self.df['montoCobrado'].fillna(0))
+        pd.testing.assert_series_equal(df['fechaCobroBanco'], self.df['fechaCobroBanco'])
+
+    def test_scores_match_object_frame(self):
+        current_date = datetime(2025, 6, 1)
+        df = read_ndjson_frame(self.lines, batch_size=100)
+        expected_df, expected_points = datathon.process_credits_optimized(self.df, current_date)
+        output_df, points_map = datathon.process_credits_optimized(df, current_date, cents=True)
+        self.assertEqual(points_map, expected_points)
+        pd.testing.assert_frame_equal(output_df, expected_df)
+
+    def test_progress_counts_bytes_of_text_lines(self):
+        lines = [json.dumps({'idCredito': 1, 'idBanco': 'Bancomer Méx'}, ensure_ascii=False)]
+        progress = []
+        read_ndjson_frame(lines, column_types={'idCredito': 'int32', 'idBanco': 'category'},
+                          progress=lambda *args: progress.append(args))
+        self.assertEqual(progress, [(1, len(lines[0].encode()) + 1)])
+
+        progress = []
+        read_ndjson_frame(self.lines, progress=lambda *args: progress.append(args))
+        text = []
+        read_ndjson_frame([line.decode() for line in self.lines], progress=lambda *args: text.append(args))
+        self.assertEqual(text, progress)
+
+    def test_memory_ceiling(self):
+        with self.assertRaises(MemoryLimitExceeded):
+            read_ndjson_frame(self.lines, batch_size=10, max_bytes=1024)
+        with self.assertRaises(MemoryLimitExceeded):
+            read_arrow_frame(io.BytesIO(to_arrow_stream(self.df)), max_bytes=1024)
+
+    def test_arrow_stream_matches_ndjson(self):
+        body = to_arrow_stream(self.df)
+        progress = []
+        df = read_arrow_frame(io.BytesIO(body), progress=lambda *args: progress.append(args))
+
+        # Everything but the end-of-stream marker has been read by the last batch
+        self.assertEqual(progress[-1], (len(self.df), len(body) - 8))
+        self.assertEqual(len(progress), -(-len(self.df) // 100))
+        # Categories come in order of first appearance either way
+        pd.testing.assert_frame_equal(df, read_ndjson_frame(self.lines))
+
+        empty = read_arrow_frame(io.BytesIO(to_arrow_stream(self.df[:0])))
+        pd.testing.assert_frame_equal(empty, read_ndjson_frame([]), check_categorical=False)
+
+    def test_arrow_keeps_missing_amounts(self):
+        df = self.df.copy()
+        df.loc[3, 'montoCobrar'] = np.nan
+        result = read_arrow_frame(io.BytesIO(to_arrow_stream(df)))
+        self.assertEqual(result['montoCobrar'].dtype, np.float64)
+        self.assertTrue(np.isnan(result['montoCobrar'].iloc[3]))
+        pd.testing.assert_frame_equal(result, read_ndjson_frame(to_ndjson_lines(df), batch_size=64))
+
+
+class FakeResponse:
+    """Just enough of requests.Response for the API client"""
+
+    def __init__(self, status_code, lines=(), headers=None, error=None, body=b''):
+        self.status_code = status_code
+        self.lines = lines
+        self.headers = headers or {}
+        self.error = error
+        self.raw = io.BytesIO(body)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def iter_lines(self, chunk_size=None):
+        yield from self.lines
+        if self.error is not None:
+            raise self.error
+
+    def json(self):
+        return json.loads(b''.join(self.lines))
+
+
+class FakeApi:
+    """Stand-in for Session.get serving a collection history like the Django API.
+
+    /collection-stats/ and /collection-details/ honour the validators and
+    the date filters, and details come as an Arrow stream when `arrow` is set
+    and the client accepts one; other paths are answered from `responses`.
+    Stats report `edits` as the count of edits made to stored rows. Every
+    call is kept in `requests` as (path, params, headers).
+    """
+
+    def __init__(self, df=None, etag='"1"', headers=None, responses=None, arrow=False, edits=0):
+        self.df = df
+        self.etag = etag
+        self.arrow = arrow
+        self.edits = edits
+        self.headers = {'ETag': etag, **(headers or {})}
+        self.responses = responses or {}
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def __call__(self, url, params=None, headers=None, **kwargs):
+        path = url[len(API_URL):]
+        params, headers = dict(params or {}), dict(headers or {})
+        with self.lock:
+            self.requests.append((path, params, headers))
+        if path in self.responses:
+            return self.responses[path]
+        if headers.get('If-None-Match') == self.etag:
+            return FakeResponse(304, headers=self.headers)
+        if path == '/collection-stats/':
+            counts = {'X-Row-Count': str(len(self.df)), 'X-Edit-Count': str(self.edits)}
+            return FakeResponse(200, [json.dumps(self.stats()).encode()], {**self.headers, **counts})
+        if 'If-Match' in headers and headers['If-Match'] != self.etag:
+            return FakeResponse(412)
+        response_headers = {**self.headers, 'X-Last-Id': str(len(self.df))} if 'after_id' in params else self.headers
+        if self.arrow and ARROW_STREAM in headers.get('Accept', ''):
+            return FakeResponse(200, headers={**response_headers, 'Content-Type': ARROW_STREAM},
+                                body=to_arrow_stream(self.details(params)))
+        return FakeResponse(200, to_ndjson_lines(self.details(params)), response_headers)
+
+    def stats(self):
+        """Totals per year (as a single month) of the dated rows"""
+        dated = self.df[self.df['fechaCobroBanco'].notna()]
+        return {
+            str(year): [{'month': 1, 'total_cobrado': f"{rows['montoCobrado'].fillna(0).sum():.2f}",
+                         'total_por_cobrar': f"{rows['montoCobrar'].sum():.2f}"}]
+            for year, rows in dated.groupby(dated['fechaCobroBanco'].dt.year)
+        }
+
+    def details(self, params):
+        if 'after_id' in params:
+            # Row ids are positions in df plus one
+            return self.df[int(params['after_id']):]
+        fechas = self.df['fechaCobroBanco']
+        if params.get('undated') == '1':
+            return self.df[fechas.isna()]
+        keep = fechas.notna()
+        for name, compare in [('start', fechas.ge), ('end', fechas.lt), ('after', fechas.gt)]:
+            if name in params:
+                keep &= compare(pd.Timestamp(params[name]))
+        rows = self.df[keep].sort_values('fechaCobroBanco', kind='stable')
+        if not {'start', 'end', 'after'} & set(params):
+            rows = pd.concat([rows, self.df[fechas.isna()]])
+        return rows
+
+    def paths(self):
+        return [path for path, _, _ in self.requests]
+
+
+def fake_api(api):
+    return mock.patch('api_client.requests.Session.get', side_effect=api)
+
+
+class ConditionalFetchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.df = make_collection_history(n_credits=20, seed=23)
+        self.cache_path = os.path.join(tempfile.mkdtemp(), 'details.pkl')
+
+    def fetch(self, api, **kwargs):
+        with fake_api(api):
+            df = datathon.fetch_data_from_api(cache_path=self.cache_path, **kwargs)
+        return df, api.requests[0][2]
+
+    def test_not_modified_reuses_cached_download(self):
+        validators = {'Last-Modified': 'Sun, 01 Jun 2025 00:00:00 GMT'}
+        first, headers = self.fetch(FakeApi(self.df, '"7-20250601"', validators))
+        self.assertEqual(headers, {})
+
+        api = FakeApi(self.df, '"7-20250601"', validators)
+        second, headers = self.fetch(api)
+        self.assertEqual(headers, {'If-None-Match': '"7-20250601"',
+                                   'If-Modified-Since': 'Sun, 01 Jun 2025 00:00:00 GMT'})
+        self.assertEqual(api.paths(), ['/collection-stats/'])
+        pd.testing.assert_frame_equal(second, first)
+
+    def test_incremental_fetch_is_not_cached(self):
+        self.fetch(FakeApi(self.df), since=datetime(2025, 1, 1))
+        self.assertFalse(os.path.exists(self.cache_path))
+
+
+class IncrementalFetchTest(unittest.TestCase):
+    current_date = datetime(2025, 6, 1, 12, 0)
+
+    def setUp(self):
+        # Rows loaded in random date order, so later runs get backdated rows
+        self.df = make_collection_history(n_credits=60, seed=41).sample(frac=1, random_state=3).reset_index(drop=True)
+        self.state_path = os.path.join(tempfile.mkdtemp(), 'state.pkl')
+
+    def run_incremental(self, api):
+        client = ApiClient(backoff=0)
+        self.addCleanup(client.close)
+        with fake_api(api):
+            _, output_df, points_map = datathon.process_credits_incremental(
+                self.current_date, client=client, state_path=self.state_path
+            )
+        expected_df, expected_points = datathon.process_credits_optimized(in_fetch_order(api.df), self.current_date)
+        self.assertEqual(points_map, expected_points)
+        pd.testing.assert_frame_equal(output_df, expected_df)
+        return [params.get('after_id') for path, params, _ in api.requests if path == '/collection-details/']
+
+    def test_picks_up_added_rows_whatever_their_dates(self):
+        self.assertEqual(self.run_incremental(FakeApi(self.df[:300])), [0])
+        self.assertEqual(self.run_incremental(FakeApi(self.df, '"2"')), [300])
+        self.assertEqual(self.run_incremental(FakeApi(self.df, '"2"')), [len(self.df)])
+
+    def test_rebuilds_after_rows_are_edited(self):
+        self.run_incremental(FakeApi(self.df))
+        edited = self.df.copy()
+        paid = edited.index[(edited['montoCobrado'] > 0) & edited['fechaCobroBanco'].notna()][0]
+        edited.loc[paid, 'montoCobrado'] = 0.0
+        self.assertEqual(self.run_incremental(FakeApi(edited, '"2"', edits=1)), [len(self.df), 0])
+
+        # Edits that leave the totals alone still move the edit count
+        edited.loc[paid, 'idRespuestaBanco'] = '06114'
+        self.assertEqual(self.run_incremental(FakeApi(edited, '"3"', edits=2)), [len(self.df), 0])
+
+        # Also when rows are added in the same step
+        edited.loc[paid, 'idRespuestaBanco'] = '06116'
+        added = make_collection_history(n_credits=5, seed=43)
+        edited = pd.concat([edited, added], ignore_index=True)
+        self.assertEqual(self.run_incremental(FakeApi(edited, '"4"', edits=3)), [len(self.df), 0])
+        self.assertEqual(self.run_incremental(FakeApi(edited, '"4"', edits=3)), [len(edited)])
+
+
+class ApiClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.df = make_collection_history(n_credits=80, seed=31)
+        self.client = ApiClient(workers=3, backoff=0)
+        self.addCleanup(self.client.close)
+
+    def test_shard_plan_covers_every_row_once(self):
+        plan = shard_plan([2024, 2025], months_per_shard=6)
+        self.assertEqual(plan, [
+            {'end': '2024-01-01'},
+            {'start': '2024-01-01', 'end': '2024-07-01'}, {'start': '2024-07-01', 'end': '2025-01-01'},
+            {'start': '2025-01-01', 'end': '2025-07-01'}, {'start': '2025-07-01', 'end': '2026-01-01'},
+            {'start': '2026-01-01'},
+            {'undated': '1'},
+        ])
+        self.assertEqual(shard_plan([2024, 2025], since=datetime(2025, 3, 1), months_per_shard=6), [
+            {'start': '2025-01-01', 'end': '2025-07-01', 'after': '2025-03-01T00:00:00'},
+            {'start': '2025-07-01', 'end': '2026-01-01', 'after': '2025-03-01T00:00:00'},
+            {'start': '2026-01-01', 'after': '2025-03-01T00:00:00'},
+        ])
+        self.assertEqual(shard_plan([]), [{}])
+
+    def test_shards_reassemble_in_server_order(self):
+        api = FakeApi(self.df)
+        with fake_api(api):
+            headers, df = self.client.fetch_details()
+        expected = read_ndjson_frame(to_ndjson_lines(api.details({})))
+        pd.testing.assert_frame_equal(df, expected, check_categorical=False)
+        self.assertEqual(headers['ETag'], '"1"')
+        self.assertEqual(api.paths().count('/collection-details/'), len(shard_plan([2024, 2025])))
+        self.assertTrue(all(request[2] == {'Accept': FRAME_ACCEPT, 'If-Match': '"1"'} for request in api.requests[1:]))
+
+        with fake_api(FakeApi(self.df)):
+            _, since = self.client.fetch_details(since=datetime(2025, 1, 1))
+        self.assertEqual(len(since), (self.df['fechaCobroBanco'] > datetime(2025, 1, 1)).sum())
+
+    def test_arrow_shards_match_ndjson(self):
+        with fake_api(FakeApi(self.df)):
+            _, expected = self.client.fetch_details()
+        progress = []
+        with fake_api(FakeApi(self.df, arrow=True)):
+            _, df = self.client.fetch_details(progress=lambda rows, _: progress.append(rows))
+        pd.testing.assert_frame_equal(df, expected, check_categorical=False)
+        self.assertEqual(max(progress), len(self.df))
+
+    def test_memory_ceiling_covers_all_shards(self):
+        api = FakeApi(self.df)
+        shards = []
+        for params in shard_plan([2024, 2025]):
+            budget = ByteBudget(float('inf'))
+            read_ndjson_frame(to_ndjson_lines(api.details(params)), budget=budget)
+            shards.append(budget.buffered)
+
+        # Every shard fits on its own, the download as a whole does not
+        client = ApiClient(workers=1, backoff=0)
+        self.addCleanup(client.close)
+        with fake_api(api), self.assertRaises(MemoryLimitExceeded):
+            client.fetch_details(max_bytes=max(shards))
+        # Shards after the one that passed the ceiling are never requested
+        self.assertLess(api.paths().count('/collection-details/'), len(shards))
+
+    def test_retries_failed_exchanges(self):
+        broken = FakeResponse(200, to_ndjson_lines(self.df[:3]), error=requests.exceptions.ChunkedEncodingError())
+        responses = iter([FakeResponse(503, headers={'Retry-After': '0'}), broken])
+        api = FakeApi(self.df)
+
+        def flaky(url, **kwargs):
+            if url.endswith('/credit-scores/'):
+                return next(responses, None) or api(url, **kwargs)
+            return api(url, **kwargs)
+
+        with mock.patch('api_client.requests.Session.get', side_effect=flaky) as get, \
+                mock.patch('api_client.time.sleep') as sleep:
+            _, df = self.client.get_frame('/credit-scores/')
+        self.assertEqual(get.call_count, 3)
+        self.assertEqual([call.args[0] for call in sleep.call_args_list], [0, 0])
+        self.assertEqual(len(df), len(self.df))
+
+        with mock.patch('api_client.requests.Session.get', return_value=FakeResponse(503)), \
+                mock.patch('api_client.time.sleep'):
+            with self.assertRaises(ValueError):
+                self.client.get_json('/emission-table/')
+
+    def test_retry_is_charged_only_for_its_own_bytes(self):
+        lines = list(to_ndjson_lines(self.df))
+        whole = ByteBudget(float('inf'))
+        read_ndjson_frame(lines, batch_size=100, budget=whole)
+        # The broken try buffers almost everything before the body breaks off
+        responses = iter([
+            FakeResponse(200, lines[:-1], error=requests.exceptions.ChunkedEncodingError()),
+            FakeResponse(200, lines),
+        ])
+        budget = ByteBudget(whole.buffered)
+
+        with mock.patch('api_client.requests.Session.get', side_effect=lambda url, **kwargs: next(responses)), \
+                mock.patch('api_client.time.sleep'):
+            _, df = self.client.get_frame('/collection-details/', batch_size=100, budget=budget)
+        self.assertEqual(len(df), len(self.df))
+        self.assertEqual(budget.buffered, whole.buffered)
+
+    def test_restarts_when_data_changes_mid_download(self):
+        apis = iter([FakeApi(self.df, '"1"'), FakeApi(self.df, '"2"')])
+        api = next(apis)
+
+        def changing(url, **kwargs):
+            nonlocal api
+            response = api(url, **kwargs)
+            if url.endswith('/collection-stats/') and api.etag == '"1"':
+                api = next(apis)
+            return response
+
+        with mock.patch('api_client.requests.Session.get', side_effect=changing):
+            headers, df = self.client.fetch_details()
+        self.assertEqual(headers['ETag'], '"2"')
+        self.assertEqual(len(df), len(self.df))
+
+
+class ServerScoringTest(unittest.TestCase):
+
+    def test_scores_feed_credits_output(self):
+        df = make_collection_history(n_credits=60, seed=41)
+        current_date = datetime(2025, 6, 1)
+        summary = summarize_credits(compact(df), current_date)
+        lines = [
+            json.dumps({
+                'idCredito': id_credito, 'idBanco': row['idBanco'], 'points': row['points'],
+                'monto': f"{row['monto'] / 100:.2f}", 'montoExigible': row['montoExigible'] / 100,
+                'montoCobrar': row['montoCobrar'] / 100, 'montoCobrado': row['montoCobrado'] / 100,
+                'fechaCobroBanco': None if pd.isna(row['fechaCobroBanco']) else row['fechaCobroBanco'].isoformat() + 'Z',
+                'lastEmisor': None if pd.isna(row['lastEmisor']) else row['lastEmisor'],
+                'emisionUsada': 'bbva_cobrar_mismo', 'idEmisor': '5923',
+            }, default=int).encode()
+            for id_credito, row in summary.iterrows()
+        ]
+        api = FakeApi(responses={'/credit-scores/': FakeResponse(200, lines)})
+        with fake_api(api):
+            output_df, points_map = datathon.process_credits_on_server(current_date)
+        self.assertEqual(api.requests, [('/credit-scores/', {'date': '2025-06-01T00:00:00'}, {'Accept': FRAME_ACCEPT})])
+
+        expected_df, expected_points = datathon.credits_output(summary)
+        self.assertEqual(points_map, expected_points)
+        pd.testing.assert_frame_equal(output_df, expected_df)
+
+
+class DecisionTableTest(unittest.TestCase):
+    current_date = datetime(2025, 6, 1)
+
+    def summary(self):
+        return summarize_credits(compact(make_collection_history(seed=23)), self.current_date)
+
+    def custom_table(self):
+        data = json.loads(json.dumps(datathon.DEFAULT_DECISION_TABLE.data))
+        for emision in data['emisiones']:
+            if emision['nombre'] == 'bbva_cobrar_mismo':
+                emision.update(comision='250.00', horaCobro='07:15:00')
+        # No catch-all rule: credits of other banks are not collected
+        data['reglas'] = [regla for regla in data['reglas'] if regla['emision'] != 'banamex_interbancario']
+        return DecisionTable(data)
+
+    def test_default_table_matches_if_chain(self):
+        summary = self.summary()
+        names, fees = datathon.select_emisiones(
+            summary['idBanco'], summary['points'], summary['montoExigible'],
+            summary['montoCobrado'], summary['lastEmisor'],
+        )
+        for id_credito, row in summary.iterrows():
+            last_emisor = None if pd.isna(row['lastEmisor']) else row['lastEmisor']
+            expected = legacy_emision_elegida(
+                row['idBanco'], row['points'], row['montoExigible'], row['montoCobrado'], last_emisor
+            )
+            self.assertEqual((names[id_credito], fees[id_credito]), expected, id_credito)
+
+    def test_default_rules_do_not_depend_on_order(self):
+        summary = self.summary()
+        data = json.loads(json.dumps(datathon.DEFAULT_DECISION_TABLE.data))
+        # The interbank rule tried first still leaves bank 12 to its own rules
+        for regla in data['reglas']:
+            if regla['emision'] == 'bbva_interbancario':
+                regla['orden'] = 1
+        reordered = DecisionTable(data)
+        args = (summary['idBanco'], summary['points'], summary['montoExigible'],
+                summary['montoCobrado'], summary['lastEmisor'])
+        names, _ = reordered.select(*args)
+        expected, _ = datathon.DEFAULT_DECISION_TABLE.select(*args)
+        bank_12 = summary['idBanco'] == 12
+        self.assertTrue((names[bank_12] != 'bbva_interbancario').all())
+        pd.testing.assert_series_equal(names[bank_12], expected[bank_12])
+
+    def test_custom_fees_hours_and_unmatched_credits(self):
+        summary = self.summary()
+        table = self.custom_table()
+        names, _ = table.select(summary['idBanco'], summary['points'], summary['montoExigible'],
+                                summary['montoCobrado'], summary['lastEmisor'])
+        self.assertTrue(names.isna().any())
+
+        output_df, _ = datathon.credits_output(summary, table=table)
+        self.assertFalse(output_df['idCredito'].isin(names.index[names.isna()]).any())
+        bbva = output_df[output_df['emisionUsada'] == 'bbva_cobrar_mismo']
+        self.assertTrue((summary.loc[bbva['idCredito'], 'montoExigible'] > 25000).all())
+        self.assertTrue(((bbva['Date'].dt.hour == 7) & (bbva['Date'].dt.minute == 15)).all())
+
+        sharded_df, _ = datathon.process_credits_optimized(
+            make_collection_history(seed=23), self.current_date, workers=2, table=table
+        )
+        pd.testing.assert_frame_equal(sharded_df, output_df)
+
+    def test_fetch_decision_table(self):
+        payload = json.dumps(self.custom_table().data).encode()
+        api = FakeApi(responses={'/emission-table/': FakeResponse(200, [payload])})
+        with fake_api(api):
+            table = datathon.fetch_decision_table()
+        self.assertEqual(api.paths(), ['/emission-table/'])
+        self.assertEqual(table.fees['bbva_cobrar_mismo'], 250)
+        self.assertEqual(table.hours['bbva_cobrar_mismo'], {'hour': 7, 'minute': 15})
+
+
+def naive_schedule(output_df, capacity, max_delay_days):
+    """Slot per credit by scanning every slot in priority order, for SchedulerTest"""
+    slot_starts = pd.to_timedelta(range(9 * 60, 10 * 60, 30), unit='m')
+    used = {}
+    dates = {}
+    ranked = output_df.sort_values(['points', 'montoACobrar', 'idCredito'], ascending=[False, False, True])
+    for row in ranked.itertuples():
+        day = row.Date.normalize()
+        for delay in range(max_delay_days + 1):
+            candidate = day + timedelta(days=delay)
+            if candidate.weekday() >= 5:
+                continue
+            day_key = (row.idEmisor, candidate)
+            if used.get(day_key, 0) >= capacity['per_day']:
+                continue
+            slot = next((candidate + start for start in slot_starts
+                         if candidate + start >= row.Date.floor('min')
+                         and used.get((row.idEmisor, candidate + start), 0) < capacity['per_slot']), None)
+            if slot is not None:
+                used[day_key] = used.get(day_key, 0) + 1
+                used[(row.idEmisor, slot)] = used.get((row.idEmisor, slot), 0) + 1
+                dates[row.idCredito] = slot
+                break
+    return dates
+
+
+class SchedulerTest(unittest.TestCase):
+    capacity = {'start': '09:00', 'end': '10:00', 'slot_minutes': 30, 'per_slot': 2, 'per_day': 3}
+
+    def output(self, n, day='2025-06-13', time='09:00', emisor='5923', seed=0):
+        rng = np.random.default_rng(seed)
+        return pd.DataFrame({
+            'idCredito': np.arange(1, n + 1),
+            'idEmisor': emisor,
+            'montoACobrar': rng.choice([100.0, 250.0], n),
+            'points': rng.integers(-5, 5, n),
+            'Date': pd.Timestamp(f'{day} {time}:17'),
+        })
+
+    def test_priority_slots_and_rollover(self):
+        output_df = self.output(5)
+        scheduled, unscheduled, utilization = schedule_collections(output_df, {'5923': self.capacity})
+        self.assertTrue(unscheduled.empty)
+
+        ranked = output_df.sort_values(['points', 'montoACobrar', 'idCredito'], ascending=[False, False, True])
+        dates = scheduled.set_index('idCredito')['Date'][ranked['idCredito']].tolist()
+        # Friday's slots hold three credits; the rest roll over to Monday
+        self.assertEqual(dates, [
+            pd.Timestamp('2025-06-13 09:00'), pd.Timestamp('2025-06-13 09:00'), pd.Timestamp('2025-06-13 09:30'),
+            pd.Timestamp('2025-06-16 09:00'), pd.Timestamp('2025-06-16 09:00'),
+        ])
+        self.assertEqual(utilization['assigned'].tolist(), [2, 1, 2, 0])
+        self.assertEqual(utilization['utilization'].tolist(), [1.0, 0.5, 1.0, 0.0])
+
+    def test_emission_time_and_delay_limit(self):
+        output_df = self.output(4, time='09:20')
+        scheduled, unscheduled, _ = schedule_collections(output_df, {'5923': self.capacity}, max_delay_days=0)
+        self.assertEqual(scheduled['Date'].tolist(), [pd.Timestamp('2025-06-13 09:30')] * 2)
+        self.assertEqual(len(unscheduled), 2)
+        pd.testing.assert_frame_equal(
+            pd.concat([scheduled, unscheduled]).sort_values('idCredito', ignore_index=True).drop(columns='Date'),
+            output_df.drop(columns='Date'),
+        )
+
+    def test_matches_naive_scan(self):
+        output_df = pd.concat([
+            self.output(40, day='2025-06-02', seed=1),
+            self.output(30, day='2025-06-02', time='09:30', emisor='00623', seed=2),
+            self.output(25, day='2025-06-04', time='08:00', seed=3),
+        ], ignore_index=True)
+        output_df['idCredito'] = np.arange(1, len(output_df) + 1)
+        capacities = {'5923': self.capacity, '00623': self.capacity}
+
+        scheduled, unscheduled, utilization = schedule_collections(output_df, capacities, max_delay_days=4)
+        expected = naive_schedule(output_df, self.capacity, 4)
+        self.assertEqual(scheduled.set_index('idCredito')['Date'].to_dict(), expected)
+        self.assertEqual(len(unscheduled), len(output_df) - len(expected))
+        self.assertTrue((utilization['assigned'] <= utilization['capacity']).all())
+
+
+class SnapshotFetchTest(unittest.TestCase):
+
+    def setUp(self):
+        # Rows loaded in random date order, so later fetches get backdated rows
+        self.df = make_collection_history(n_credits=40, seed=29).sample(frac=1, random_state=5)
+        self.df = self.df.reset_index(drop=True)
+        self.directory = tempfile.mkdtemp()
+
+    def fetch(self, api, **kwargs):
+        with fake_api(api):
+            df = datathon.fetch_with_snapshot(directory=self.directory, **kwargs)
+        return df, api.requests
+
+    def expected(self, df):
+        expected = read_ndjson_frame(to_ndjson_lines(in_fetch_order(df)))
+        return expected.sort_values(['idCredito', 'fechaCobroBanco'], kind='stable', ignore_index=True)
+
+    def test_fetches_rows_added_after_cursor(self):
+        self.fetch(FakeApi(self.df[:150], '"1"'))
+        df, requests_made = self.fetch(FakeApi(self.df, '"2"'))
+        self.assertEqual(requests_made[0][2], {'If-None-Match': '"1"'})
+        self.assertEqual([params for path, params, _ in requests_made[1:]], [{'after_id': 150}])
+        pd.testing.assert_frame_equal(df, self.expected(self.df), check_categorical=False)
+
+        cached, requests_made = self.fetch(FakeApi(self.df, '"2"'))
+        self.assertEqual(requests_made, [('/collection-stats/', {}, {'If-None-Match': '"2"'})])
+        pd.testing.assert_frame_equal(cached, df)
+
+        Snapshot.load(self.directory).compact()
+        self.assertEqual(len(Snapshot.load(self.directory).segments), 1)
+        pd.testing.assert_frame_equal(Snapshot.load(self.directory).read(), df)
+
+    def test_refetches_after_rows_are_edited(self):
+        self.fetch(FakeApi(self.df, '"1"'))
+        edited = self.df.copy()
+        edited.loc[3, 'montoCobrado'] = 0.0
+        added = make_collection_history(n_credits=5, seed=43)
+        edited = pd.concat([edited, added], ignore_index=True)
+
+        df, requests_made = self.fetch(FakeApi(edited, '"2"', edits=1))
+        self.assertEqual([params for path, params, _ in requests_made if path == '/collection-details/'],
+                         [{'after_id': len(self.df)}, {'after_id': 0}])
+        pd.testing.assert_frame_equal(df, self.expected(edited), check_categorical=False)
+
+        # Rows deleted without the edit count moving do not add up to the row count
+        _, requests_made = self.fetch(FakeApi(edited[:-1], '"3"', edits=1))
+        self.assertEqual([params for path, params, _ in requests_made if path == '/collection-details/'],
+                         [{'after_id': len(edited)}, {'after_id': 0}])
+        self.assertEqual(Snapshot.load(self.directory).rows, len(edited) - 1)
+
+    def test_segments_with_different_dictionaries(self):
+        df = make_collection_history(n_credits=300, seed=29)
+        df = df[df['fechaCobroBanco'].notna()].reset_index(drop=True)
+        # Over 127 codes need int16 dictionary indices, one row's fit in int8
+        df['consecutivoCobro'] = (df.index % 400).astype(str)
+        base = read_ndjson_frame(to_ndjson_lines(df[:-1]))
+        # A delta whose emisor column is all null has no dictionary values at all
+        delta = read_ndjson_frame(to_ndjson_lines(df[-1:].assign(idRespuestaBanco=None)))
+
+        snapshot = Snapshot(self.directory)
+        snapshot.replace(base, '"1"', len(base), 0)
+        snapshot.append(delta, '"2"', len(df))
+        expected = concat_frames([base, delta]).sort_values(['idCredito', 'fechaCobroBanco'], kind='stable')
+        pd.testing.assert_frame_equal(snapshot.read(), expected.reset_index(drop=True), check_categorical=False)
+
+        snapshot.compact()
+        pd.testing.assert_frame_equal(Snapshot.load(self.directory).read(), expected.reset_index(drop=True),
+                                      check_categorical=False)
+
+    def test_refresh_replaces_segments(self):
+        self.fetch(FakeApi(self.df, '"1"'))
+        self.fetch(FakeApi(self.df[:5], '"2"'))
+        _, requests_made = self.fetch(FakeApi(self.df, '"3"'), refresh=True)
+
+        self.assertEqual(requests_made[0][2], {})
+        self.assertEqual(requests_made[-1][1], {'after_id': 0})
+        snapshot = Snapshot.load(self.directory)
+        self.assertEqual(snapshot.rows, len(self.df))
+        self.assertEqual(sorted(os.listdir(self.directory)), ['manifest.json', snapshot.segments[0]['file']])
+
+
+class ReportWriterTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.output_df, _ = datathon.process_credits_optimized(
+            make_collection_history(n_credits=400, seed=31), datetime(2025, 6, 1)
+        )
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.base = os.path.join(self.directory, 'report')
+
+    def test_excel_matches_to_excel(self):
+        expected = os.path.join(self.directory, 'expected.xlsx')
+        self.output_df.to_excel(expected, index=False)
+        [path] = write_report(self.output_df, self.base)
+        pd.testing.assert_frame_equal(pd.read_excel(path), pd.read_excel(expected))
+
+    def test_split_by_emisor_in_parallel(self):
+        paths = write_report(self.output_df, self.base, 'parquet', split_by_emisor=True, workers=2)
+        emisores = sorted(self.output_df['idEmisor'].unique())
+        self.assertEqual(paths, [f'{self.base}_{emisor}.parquet' for emisor in emisores])
+
+        combined = pd.concat([pd.read_parquet(path) for path in paths])
+        expected = self.output_df.sort_values('idEmisor', kind='stable')
+        pd.testing.assert_frame_equal(combined.reset_index(drop=True), expected.reset_index(drop=True))
+
+    def test_fixed_width_layouts(self):
+        paths = write_report(self.output_df, self.base, 'fixed')
+        self.assertEqual(len(paths), self.output_df['idEmisor'].nunique())
+        for path in paths:
+            emisor = path[len(self.base) + 1:-len('.txt')]
+            layout = FIXED_WIDTH_LAYOUTS[emisor]
+            rows = self.output_df[self.output_df['idEmisor'] == emisor]
+            with open(path, newline='') as f:
+                lines = f.read().split('\r\n')[:-1]
+            self.assertEqual(len(lines), len(rows))
+            self.assertEqual({len(line) for line in lines}, {sum(width for _, width, _ in layout['fields'])})
+
+            first, begin = rows.iloc[0], 0
+            for column, width, kind in layout['fields']:
+                field = lines[0][begin:begin + width]
+                begin += width
+                if column == 'idCredito':
+                    self.assertEqual(int(field), first['idCredito'])
+                elif kind == 'cents':
+                    self.assertEqual(int(field), round(first[column] * 100))
+
+    def test_scheduled_time_kept(self):
+        scheduled, _, _ = schedule_collections(self.output_df)
+        self.assertTrue((scheduled['Date'].dt.minute != 0).any())
+        for path in write_report(scheduled, self.base, 'fixed'):
+            emisor = path[len(self.base) + 1:-len('.txt')]
+            layout = FIXED_WIDTH_LAYOUTS[emisor]
+            begin = 0
+            for column, width, _ in layout['fields']:
+                if column == 'Date':
+                    break
+                begin += width
+            with open(path, newline='') as f:
+                dates = [line[begin:begin + width] for line in f.read().split('\r\n')[:-1]]
+            expected = scheduled.loc[scheduled['idEmisor'] == emisor, 'Date']
+            self.assertEqual(list(pd.to_datetime(dates, format=layout['date_format'])), list(expected))
+
+    def test_layouts_from_file(self):
+        layout = {'fields': [['idCredito', 10, 'int'], ['Date', 10, 'date']], 'date_format': '%d%m%H%M%S'}
+        path = os.path.join(self.directory, 'layouts.json')
+        with open(path, 'w') as f:
+            json.dump({emisor: layout for emisor in self.output_df['idEmisor'].unique()}, f)
+
+        paths = write_report(self.output_df, self.base, 'fixed', workers=2, layouts=load_layouts(path))
+        for path in paths:
+            with open(path, newline='') as f:
+                self.assertEqual({len(line) for line in f.read().split('\r\n')[:-1]}, {20})
+        with self.assertRaisesRegex(ValueError, 'No fixed-width layout'):
+            write_report(self.output_df, self.base, 'fixed', layouts={'5923': layout})
+
+    def test_value_too_wide(self):
+        df = self.output_df.assign(idCredito=10**17)
+        df = df[df['idEmisor'] == '00623']
+        with self.assertRaisesRegex(ValueError, 'does not fit in 16'):
+            write_report(df, self.base, 'fixed')
+
+
+class ChartPipelineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.df = make_collection_history(n_credits=200, seed=37)
+        self.points_map = datathon.process_credits_optimized(self.df, datetime(2025, 6, 1))[1]
+        self.directory = tempfile.mkdtemp()
+
+    def test_summaries_match_per_chart_groupbys(self):
+        summaries = summarize_for_charts(self.df, self.points_map, datathon.BANK_MAPPING)
+        by_month = self.df.groupby(self.df['fechaCobroBanco'].dt.to_period('M'))
+        success = by_month['montoCobrado'].apply(lambda x: (x > 0).sum()) / by_month['idCredito'].count() * 100
+        np.testing.assert_allclose(summaries['success_rate']['success_rate'], success)
+        np.testing.assert_allclose(summaries['monthly_trends']['montoCobrar'], by_month['montoCobrar'].sum())
+        self.assertEqual(list(summaries['monthly_trends'].index), list(success.index.astype(str)))
+        self.assertEqual(summaries['points_distribution']['count'].sum(), len(self.points_map))
+
+    def test_unchanged_charts_are_skipped(self):
+        summaries = summarize_for_charts(self.df, self.points_map, datathon.BANK_MAPPING)
+        self.assertEqual(len(render_charts(summaries, self.directory, workers=2)), 4)
+        self.assertEqual(render_charts(summaries, self.directory), [])
+
+        points_map = {**self.points_map, -1: 100}
+        summaries = summarize_for_charts(self.df, points_map, datathon.BANK_MAPPING)
+        self.assertEqual(render_charts(summaries, self.directory), ['points_distribution'])
+
+        os.remove(os.path.join(self.directory, 'success_rate.png'))
+        self.assertEqual(render_charts(summaries, self.directory), ['success_rate'])
+
+    def test_no_charts_does_not_import_matplotlib(self):
+        code = "import sys, datathon; datathon.parse_args(['--no-charts']); print('matplotlib' in sys.modules)"
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(result.stdout.strip(), 'False')
+
+
+def legacy_snap(fecha):
+    day = fecha.day
+    if day <= 8:
+        snapped = fecha.replace(day=1)
+    elif day >= 23:
+        snapped = (fecha.replace(day=1) + timedelta(days=32)).replace(day=1)
+    else:
+        snapped = fecha.replace(day=15)
+    while snapped.weekday() >= 5:
+        snapped -= timedelta(days=1)
+    return snapped
+
+
+class FortnightCalendarTest(unittest.TestCase):
+
+    def test_matches_weekend_rollback_for_every_day(self):
+        fechas = pd.Series(pd.date_range('2022-01-01', '2026-12-31', freq='D'))
+        calendar = FortnightCalendar(2022, 2026, cache_dir=None)
+        expected = fechas.map(legacy_snap)
+        pd.testing.assert_series_equal(calendar.snap(fechas), expected, check_dtype=False)
+
+    def test_missing_dates_stay_missing(self):
+        fechas = pd.Series(pd.to_datetime(['2025-03-10', None]))
+        snapped = FortnightCalendar(2025, 2025, cache_dir=None).snap(fechas)
+        self.assertEqual(snapped[0], pd.Timestamp('2025-03-14'))
+        self.assertTrue(pd.isna(snapped[1]))
+
+    def test_bank_holidays_roll_back(self):
+        calendar = FortnightCalendar(2025, 2025, holidays=mexican_bank_holidays, cache_dir=None)
+        fechas = pd.Series(pd.to_datetime(['2025-12-26', '2025-04-20', '2025-09-20']))
+        # Jan 1st is a holiday, Apr 15th and Sep 15th are regular business days
+        self.assertEqual(calendar.snap(fechas).tolist(), [
+            pd.Timestamp('2025-12-31'), pd.Timestamp('2025-04-15'), pd.Timestamp('2025-09-15'),
+        ])
+
+    def test_table_is_persisted(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            first = FortnightCalendar(2030, 2030, cache_dir=cache_dir)
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+            second = FortnightCalendar(2030, 2030, cache_dir=cache_dir)
+            np.testing.assert_array_equal(first.table, second.table)
+
+
+class SyntheticHistoryTest(unittest.TestCase):
+
+    def test_same_seed_same_rows(self):
+        pd.testing.assert_frame_equal(generate_history(500, seed=3), generate_history(500, seed=3))
+        self.assertFalse(generate_history(500, seed=3).equals(generate_history(500, seed=4)))
+
+    def test_shape_and_rates(self):
+        df = generate_history(20_000, bank_mix={12: 0.6, 14: 0.4}, failure_rate=0.3, partial_rate=0.1)
+        self.assertTrue(df.equals(df.sort_values(['idCredito', 'fechaCobroBanco'], kind='stable')))
+        self.assertEqual(df['fechaCobroBanco'].dtype, 'datetime64[ns]')
+        self.assertAlmostEqual(len(df) / 20_000, 10, delta=0.2)
+
+        banks = df.drop_duplicates('idCredito')['idBanco'].value_counts(normalize=True)
+        self.assertAlmostEqual(banks[12], 0.6, delta=0.02)
+        self.assertAlmostEqual((df['montoCobrado'] == 0).mean(), 0.3, delta=0.02)
+        self.assertAlmostEqual((df['montoCobrado'] == df['montoCobrar']).mean(), 0.6, delta=0.02)
+
+    def test_csv_round_trip(self):
+        df = generate_history(50)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'cobros.csv')
+            self.assertEqual(write_csv([df[:100], df[100:]], path), len(df))
+            loaded = pd.read_csv(path, dtype={'consecutivoCobro': str, 'idRespuestaBanco': str},
+                                 parse_dates=['fechaCobroBanco'])
+        pd.testing.assert_frame_equal(loaded, df, check_dtype=False)
+
+
+class ProfilingTest(unittest.TestCase):
+    current_date = datetime(2025, 6, 1, 12, 0)
+
+    def test_records_scoring_sub_steps(self):
+        df = make_collection_history(seed=2)
+        with tempfile.TemporaryDirectory() as tmp:
+            with Profiler(profile_stage='summarize', output_dir=tmp) as profiler:
+                with stage('score', len(df)):
+                    datathon.process_credits_optimized(df, self.current_date)
+            report = profiler.report([])
+            self.assertEqual(report['dumps'], [os.path.join(tmp, 'profile_score_summarize.prof')])
+            self.assertTrue(os.path.getsize(report['dumps'][0]))
+
+        stages = {record['stage']: record for record in report['stages']}
+        self.assertEqual(list(stages), [
+            'score', 'score/summarize', 'score/output',
+            'score/output/select_emissions', 'score/output/collection_dates',
+        ])
+        self.assertEqual(stages['score']['rows'], len(df))
+        self.assertEqual(stages['score/output']['rows'], df['idCredito'].nunique())
+        self.assertGreaterEqual(stages['score']['wall_s'], stages['score/summarize']['wall_s'])
+        self.assertGreater(stages['score']['peak_rss_mb'], 0)
+
+    def test_sharded_run_records_parent_stages_only(self):
+        df = make_collection_history(seed=2)
+        with Profiler() as profiler:
+            datathon.process_credits_optimized(df, self.current_date, workers=2)
+        self.assertEqual([record['stage'] for record in profiler.report([])['stages']],
+                         ['split', 'score_shards', 'merge'])
+
+    def test_no_op_without_profiler(self):
+        with stage('score', 10) as record:
+            record['rows'] = 20
+
+    def test_main_writes_report(self):
+        df = make_collection_history(seed=2)
+        with tempfile.TemporaryDirectory() as tmp, \
+                mock.patch('datathon.fetch_decision_table', return_value=datathon.DEFAULT_DECISION_TABLE), \
+                mock.patch('datathon.fetch_data_from_api', return_value=compact(df)), \
+                mock.patch('datathon.write_report', return_value=['processed_credits.xlsx']):
+            path = os.path.join(tmp, 'profile.json')
+            datathon.main(['--no-charts', '--workers', '1', '--profile', '--profile-output', path])
+            with open(path) as f:
+                report = json.load(f)
+
+        self.assertEqual([record['stage'] for record in report['stages'] if record['depth'] == 0],
+                         ['decision_table', 'fetch', 'score', 'report'])
+        self.assertEqual(report['stages'][1]['rows'], len(df))
+        self.assertIn('--profile', report['argv'])
+        self.assertGreaterEqual(report['wall_s'], sum(r['wall_s'] for r in report['stages'] if r['depth'] == 0))
+
+    def test_main_without_report_rows(self):
+        df = make_collection_history(n_credits=5, seed=2)
+        output = io.StringIO()
+        with mock.patch('datathon.fetch_decision_table', return_value=datathon.DEFAULT_DECISION_TABLE), \
+                mock.patch('datathon.fetch_data_from_api', return_value=compact(df)), \
+                mock.patch('datathon.write_report', return_value=[]), \
+                contextlib.redirect_stdout(output):
+            datathon.main(['--no-charts', '--workers', '1', '--split-by-emisor'])
+        self.assertIn("No rows to export", output.getvalue())
+        self.assertNotIn("Results saved to", output.getvalue())
+
+
+class CompareResultsTest(unittest.TestCase):
+
+    def test_flags_slower_stages(self):
+        baseline = {'results': [
+            {'scale': '10k', 'stage': 'scoring', 'seconds': 1.0},
+            {'scale': '10k', 'stage': 'excel', 'seconds': 1.0},
+        ]}
+        current = {'results': [
+            {'scale': '10k', 'stage': 'scoring', 'seconds': 1.05},
+            {'scale': '10k', 'stage': 'excel', 'seconds': 1.5},
+            {'scale': '1M', 'stage': 'scoring', 'seconds': 9.0},
+        ]}
+        regressed = {stage: flag for _, stage, _, _, _, flag in compare_results(current, baseline)}
+        self.assertEqual(regressed, {'scoring': False, 'excel': True})
+
+
+if __name__ == '__main__':
+    unittest.main()
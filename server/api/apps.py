@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.db.backends.signals import connection_created
 
 
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        if settings.API_METRICS:
+            from .metrics import install_query_recorder
+            connection_created.connect(install_query_recorder, dispatch_uid='api.metrics')
@@ -0,0 +1,122 @@
+"""Arrow IPC stream responses for the collection endpoints.
+
+Clients that prefer `application/vnd.apache.arrow.stream` in their Accept
+header get columns instead of JSON: every page of queryset value tuples
+becomes one record batch, built column by column without a dict per row.
+Amounts stay decimal128, so no precision is lost, and text codes are
+dictionary-encoded. Arrow support needs the pyarrow package; without it
+every request gets the JSON formats.
+"""
+import io
+from functools import cache
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+from cobranza.models import ListaCobroDetalle
+
+ARROW_STREAM = 'application/vnd.apache.arrow.stream'
+
+
+def accepts_arrow(request, default_type):
+    """Whether the request prefers an Arrow stream over default_type (which wins ties and */*)"""
+    return pa is not None and request.get_preferred_type([default_type, ARROW_STREAM]) == ARROW_STREAM
+
+
+def _field_type(field):
+    kind = field.get_internal_type()
+    if kind in ('IntegerField', 'SmallIntegerField', 'PositiveIntegerField'):
+        return pa.int32()
+    if kind in ('BigIntegerField', 'AutoField', 'BigAutoField'):
+        return pa.int64()
+    if kind == 'DecimalField':
+        return pa.decimal128(field.max_digits, field.decimal_places)
+    if kind == 'DateTimeField':
+        return pa.timestamp('us', tz='UTC')
+    if kind == 'CharField':
+        return pa.dictionary(pa.int32(), pa.string())
+    raise ValueError(f"No Arrow type for {field.name} ({kind})")
+
+
+def _model_fields(model, fields):
+    return [pa.field(name, _field_type(model._meta.get_field(name))) for name in fields]
+
+
+@cache
+def detail_schema(fields):
+    """Schema of /collection-details/ rows holding `fields` (a tuple)"""
+    return pa.schema(_model_fields(ListaCobroDetalle, fields))
+
+
+@cache
+def score_schema():
+    """Schema of /credit-scores/ rows"""
+    detail = {field.name: field for field in _model_fields(ListaCobroDetalle, (
+        'idCredito', 'idBanco', 'montoExigible', 'montoCobrar', 'montoCobrado', 'fechaCobroBanco'
+    ))}
+    text = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([
+        detail['idCredito'], detail['idBanco'], pa.field('points', pa.int64()),
+        # A sum over the credit's rows, wider than any single amount
+        pa.field('monto', pa.decimal128(18, 2)),
+        detail['montoExigible'], detail['montoCobrar'], detail['montoCobrado'], detail['fechaCobroBanco'],
+        pa.field('lastEmisor', text), pa.field('emisionUsada', text), pa.field('idEmisor', text),
+    ])
+
+
+@cache
+def stats_schema():
+    """Schema of /collection-stats/: one row per month instead of JSON's months grouped by year"""
+    return pa.schema([
+        pa.field('year', pa.int32()),
+        pa.field('month', pa.int32()),
+        pa.field('total_cobrado', pa.decimal128(18, 2)),
+        pa.field('total_por_cobrar', pa.decimal128(18, 2)),
+        pa.field('promedio_eficiencia', pa.float64()),
+    ])
+
+
+def record_batch(schema, columns):
+    """Record batch from {name: sequence of Python values} in schema order"""
+    arrays = []
+    for field in schema:
+        if pa.types.is_dictionary(field.type):
+            array = pa.array(columns[field.name], field.type.value_type).dictionary_encode()
+        else:
+            array = pa.array(columns[field.name], field.type)
+        arrays.append(array)
+    return pa.record_batch(arrays, schema=schema)
+
+
+def columns(fields, rows):
+    """{name: values} from value tuples holding `fields` in order"""
+    values = list(zip(*rows)) if rows else [()] * len(fields)
+    return dict(zip(fields, values))
+
+
+def stream(schema, batches):
+    """Yield the bytes of an Arrow IPC stream: the schema, each batch, then the end marker"""
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+            yield _drain(sink)
+    yield _drain(sink)
+
+
+async def astream(schema, batches):
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        async for batch in batches:
+            writer.write_batch(batch)
+            yield _drain(sink)
+    yield _drain(sink)
+
+
+def _drain(sink):
+    data = sink.getvalue()
+    sink.seek(0)
+    sink.truncate()
+    return data
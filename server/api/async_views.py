@@ -0,0 +1,231 @@
+"""Async versions of the API views, for ASGI deployments.
+
+Database work runs on the bounded pool in api/concurrency.py, so the event
+loop stays free while queries run and one slow request does not hold up
+the others. Responses are the same as the sync views' (api/views.py).
+"""
+import asyncio
+import csv
+from functools import wraps
+
+from django.core.cache import cache
+from django.db.models import Q
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.cache import cache_control
+from django.views.decorators.vary import vary_on_headers
+
+from cobranza.models import VersionDatos
+from configuracion.decision import decision_table, emisor_mapping
+
+from . import arrow, views
+from .concurrency import run_in_db_pool
+from .views import (
+    CONTENT_TYPES, DETAIL_FIELDS, LAST_ID_HEADER, _Echo, _credit_ids, _credit_lookup, _credit_response, _credits_response,
+    _csv_line, _detail_batch, _detail_filters, _detail_format,
+    _detail_scans, _keyset_page, _last_id, _ndjson_line, _page_fields, _row_count, _score_batch, _score_line,
+    _score_rows, _stats_content, _stats_format, _stats_headers, _stats_key, _stats_rows, _unknown_format,
+    data_conditional,
+    scores_conditional, table_conditional,
+)
+
+
+def _with_data_version(view):
+    """Load the data version off the event loop before the conditional checks read it"""
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        request.data_version = await run_in_db_pool(VersionDatos.current)
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+def _with_decision_table(view):
+    """Load the emission decision table off the event loop, like _with_data_version"""
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        request.decision_table = await run_in_db_pool(decision_table)
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+@cache_control(no_cache=True)
+@vary_on_headers('Accept')
+@_with_data_version
+@data_conditional
+async def collection_stats(request):
+    output_format = _stats_format(request)
+    key = _stats_key(request.data_version.tag, output_format)
+    content = await cache.aget(key)
+    if content is None:
+        content = _stats_content(await run_in_db_pool(_stats_rows), output_format)
+        await cache.aset(key, content)
+    rows_key = _stats_key(request.data_version.tag, 'rows')
+    rows = await cache.aget(rows_key)
+    if rows is None:
+        rows = await run_in_db_pool(_row_count)
+        await cache.aset(rows_key, rows)
+    return _stats_headers(HttpResponse(content, content_type=CONTENT_TYPES[output_format]),
+                          request.data_version, rows)
+
+
+def _fetch_page(queryset, keys, last):
+    return list(_keyset_page(queryset, keys, last))
+
+
+async def _aiter_detail_pages(filters, include_dated, include_undated, by_id=False):
+    """(fields, value tuples) per keyset page, querying the next page while the current one is sent.
+
+    A page's last key is known as soon as it arrives, so the following page
+    is requested right away; each request keeps at most one query in flight.
+    """
+    loop = asyncio.get_running_loop()
+    for queryset, keys in _detail_scans(filters, include_dated, include_undated, by_id):
+        fields = _page_fields(keys)
+        upcoming = loop.create_task(run_in_db_pool(_fetch_page, queryset, keys, None))
+        try:
+            while upcoming is not None:
+                page = await upcoming
+                upcoming = None
+                if len(page) == views.DETAIL_PAGE_SIZE:
+                    upcoming = loop.create_task(run_in_db_pool(_fetch_page, queryset, keys, page[-1]))
+                if page:
+                    yield fields, page
+        finally:
+            # Client went away mid-stream
+            if upcoming is not None:
+                upcoming.cancel()
+
+
+async def _page_rows(pages):
+    async for fields, page in pages:
+        for row in page:
+            yield dict(zip(fields, row))
+
+
+async def _detail_batches(pages):
+    async for fields, page in pages:
+        yield _detail_batch(fields, page)
+
+
+async def _ndjson_lines(rows):
+    async for row in rows:
+        yield _ndjson_line(row)
+
+
+async def _csv_lines(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(DETAIL_FIELDS)
+    async for row in rows:
+        yield _csv_line(writer, row)
+
+
+@cache_control(no_cache=True)
+@vary_on_headers('Accept')
+@_with_data_version
+@data_conditional
+async def collection_details(request):
+    """Async collection_details; pages are fetched whole on the pool, one at a time"""
+    try:
+        filters, include_dated, include_undated = _detail_filters(request.GET)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    last_id = None
+    if 'after_id' in request.GET:
+        last_id = await run_in_db_pool(_last_id, request.GET)
+        filters &= Q(id__lte=last_id)
+    output_format = _detail_format(request)
+    pages = _aiter_detail_pages(filters, include_dated, include_undated, by_id=last_id is not None)
+    if output_format == 'csv':
+        response = StreamingHttpResponse(_csv_lines(_page_rows(pages)), content_type='text/csv')
+        response['Content-Disposition'] = 'attachment; filename="collection_details.csv"'
+    elif output_format == 'ndjson':
+        response = StreamingHttpResponse(_ndjson_lines(_page_rows(pages)), content_type='application/x-ndjson')
+    elif output_format == 'arrow' and arrow.pa is not None:
+        schema = arrow.detail_schema(tuple(DETAIL_FIELDS))
+        response = StreamingHttpResponse(arrow.astream(schema, _detail_batches(pages)), content_type=arrow.ARROW_STREAM)
+    else:
+        return _unknown_format(output_format)
+    if last_id is not None:
+        response[LAST_ID_HEADER] = str(last_id)
+    return response
+
+
+def _fetch_scores(params, table, after=None):
+    """Up to DETAIL_PAGE_SIZE scored credits, those after idCredito `after`"""
+    return list(_score_rows(params, table, after)[:views.DETAIL_PAGE_SIZE])
+
+
+async def _aiter_score_pages(params, table, page):
+    """Scored credit pages starting with `page`, each next one queried on the pool once it is needed"""
+    while page:
+        yield page
+        if len(page) < views.DETAIL_PAGE_SIZE:
+            return
+        page = await run_in_db_pool(_fetch_scores, params, table, page[-1][0])
+
+
+async def _ascore_lines(pages, emisores):
+    async for page in pages:
+        for row in page:
+            yield _score_line(row, emisores)
+
+
+async def _ascore_batches(pages, emisores):
+    async for page in pages:
+        yield _score_batch(page, emisores)
+
+
+@cache_control(no_cache=True)
+@vary_on_headers('Accept')
+@_with_data_version
+@_with_decision_table
+@scores_conditional
+async def credit_scores(request):
+    """Async credit_scores; credits are scored on the pool a page at a time, by idCredito"""
+    table = request.decision_table
+    try:
+        first = await run_in_db_pool(_fetch_scores, request.GET, table)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    pages = _aiter_score_pages(request.GET, table, first)
+    if arrow.accepts_arrow(request, 'application/x-ndjson'):
+        return StreamingHttpResponse(
+            arrow.astream(arrow.score_schema(), _ascore_batches(pages, emisor_mapping(table))),
+            content_type=arrow.ARROW_STREAM,
+        )
+    return StreamingHttpResponse(_ascore_lines(pages, emisor_mapping(table)), content_type='application/x-ndjson')
+
+
+@cache_control(no_cache=True)
+@_with_data_version
+@_with_decision_table
+@scores_conditional
+async def credit_detail(request, id_credito):
+    """Async credit_detail; histories missing from the caches are read on the pool"""
+    try:
+        credits = await run_in_db_pool(_credit_lookup, request.GET, [id_credito], request.decision_table)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return _credit_response(credits, id_credito)
+
+
+@cache_control(no_cache=True)
+@_with_data_version
+@_with_decision_table
+@scores_conditional
+async def credit_batch(request):
+    """Async credit_batch"""
+    try:
+        credits = await run_in_db_pool(_credit_lookup, request.GET, _credit_ids(request.GET),
+                                       request.decision_table)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return _credits_response(credits)
+
+
+@cache_control(no_cache=True)
+@_with_decision_table
+@table_conditional
+async def emission_table(request):
+    """Async emission_table; the table is read on the pool"""
+    return JsonResponse(request.decision_table)
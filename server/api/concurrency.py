@@ -0,0 +1,58 @@
+"""Bounded thread pool for database work issued from async views.
+
+Django's async ORM runs every query in one shared thread, so queries from
+concurrent async requests never overlap. Work submitted here runs on a
+fixed set of threads instead, each holding at most one database connection,
+so API_DB_POOL_SIZE caps the connections async views use per process.
+"""
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connections
+
+_executor = None
+_pool_size = 0
+
+
+def _get_executor():
+    global _executor, _pool_size
+    if _executor is None:
+        _pool_size = settings.API_DB_POOL_SIZE
+        _executor = ThreadPoolExecutor(max_workers=_pool_size, thread_name_prefix='api-db')
+    return _executor
+
+
+def _run(func, args):
+    # Request signals never fire in pool threads; apply CONN_MAX_AGE and
+    # health checks here instead
+    close_old_connections()
+    return func(*args)
+
+
+async def run_in_db_pool(func, *args):
+    """Run func(*args) on a pool thread and await its result"""
+    loop = asyncio.get_running_loop()
+    # In the caller's context, so its queries count towards the request's metrics
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_get_executor(), context.run, _run, func, args)
+
+
+def _close_connections(barrier):
+    barrier.wait()
+    connections.close_all()
+
+
+def shutdown_db_pool():
+    """Close the pool threads' connections and stop the threads"""
+    global _executor
+    if _executor is None:
+        return
+    executor, _executor = _executor, None
+    # Every task waits at the barrier, so each one runs on a different thread
+    barrier = threading.Barrier(_pool_size)
+    for _ in range(_pool_size):
+        executor.submit(_close_connections, barrier)
+    executor.shutdown(wait=True)
@@ -0,0 +1,82 @@
+import time
+import zlib
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory, override_settings
+
+from api import arrow, views
+
+ENDPOINTS = {
+    'details': ('/api/collection-details/', views.collection_details),
+    'scores': ('/api/credit-scores/', views.credit_scores),
+    'stats': ('/api/collection-stats/', views.collection_stats),
+}
+
+# Accept header per format; JSON is what clients get without one
+FORMATS = {'json': '*/*', 'arrow': arrow.ARROW_STREAM}
+
+
+def _measure(view, request):
+    """(CPU seconds, bytes, gzip bytes) of producing the whole response.
+
+    Only the view and the iteration over its body are timed; compressing the
+    body to size it afterwards, as GZipMiddleware would, is not.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    start = time.process_time()
+    response = view(request)
+    cpu = time.process_time() - start
+    if response.status_code != 200:
+        raise CommandError(f"{request.get_full_path()} answered {response.status_code}")
+
+    size = compressed = 0
+    chunks = iter(response)
+    while True:
+        start = time.process_time()
+        chunk = next(chunks, None)
+        cpu += time.process_time() - start
+        if chunk is None:
+            break
+        size += len(chunk)
+        compressed += len(compressor.compress(chunk))
+    compressed += len(compressor.flush())
+    return cpu, size, compressed
+
+
+class Command(BaseCommand):
+    help = "Compare serialization CPU time and payload size of the JSON and Arrow API responses"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--endpoint', choices=sorted(ENDPOINTS), default='details')
+        parser.add_argument(
+            '--param', action='append', default=[], metavar='NAME=VALUE',
+            help='Query parameter to send, e.g. --param year=2024 (repeatable)'
+        )
+        parser.add_argument('--repeat', type=int, default=3, help='Report the best of this many runs (default: 3)')
+
+    def handle(self, *args, **options):
+        if arrow.pa is None:
+            raise CommandError("pyarrow is not installed")
+        path, view = ENDPOINTS[options['endpoint']]
+        params = dict(param.split('=', 1) for param in options['param'])
+        factory = RequestFactory()
+
+        self.stdout.write(f"{path} {params or ''}, best of {options['repeat']}")
+        self.stdout.write(f"{'format':<7} {'cpu s':>8} {'MiB':>9} {'gzip MiB':>9}")
+        results = {}
+        # Without the cache every request serializes its rows
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}):
+            for name, accept in FORMATS.items():
+                runs = [
+                    _measure(view, factory.get(path, params, HTTP_ACCEPT=accept))
+                    for _ in range(options['repeat'])
+                ]
+                cpu, size, compressed = min(runs)
+                results[name] = cpu, size
+                self.stdout.write(f"{name:<7} {cpu:>8.3f} {size / 2**20:>9.2f} {compressed / 2**20:>9.2f}")
+
+        (json_cpu, json_size), (arrow_cpu, arrow_size) = results['json'], results['arrow']
+        self.stdout.write(
+            f"arrow/json: {arrow_cpu / json_cpu if json_cpu else float('nan'):.2f}x CPU, "
+            f"{arrow_size / json_size:.2f}x bytes"
+        )
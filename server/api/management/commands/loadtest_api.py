@@ -0,0 +1,85 @@
+import asyncio
+import statistics
+import time
+import warnings
+
+from asgiref.sync import sync_to_async
+from django.core.management.base import BaseCommand
+from django.test import AsyncRequestFactory, override_settings
+
+from api import async_views, views
+from api.concurrency import shutdown_db_pool
+
+ENDPOINTS = {
+    'stats': ('/api/collection-stats/', 'collection_stats'),
+    'details': ('/api/collection-details/', 'collection_details'),
+}
+
+
+async def _consume(response):
+    if response.streaming:
+        async for _ in response:
+            pass
+
+
+async def _timed_requests(view, path, params, requests, concurrency):
+    """Latencies in ms of `requests` calls to view, `concurrency` in flight at a time"""
+    factory = AsyncRequestFactory()
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            response = await view(factory.get(path, params))
+            await _consume(response)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return latencies, time.perf_counter() - start
+
+
+class Command(BaseCommand):
+    help = "Compare p50/p99 latency of the sync and async API views as served under ASGI"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--endpoint', choices=sorted(ENDPOINTS), default='stats')
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument(
+            '--param', action='append', default=[], metavar='NAME=VALUE',
+            help='Query parameter to send, e.g. --param year=2024 (repeatable)'
+        )
+        parser.add_argument(
+            '--warm', action='store_true',
+            help='Keep the response cache (default: disable it so every request queries the database)'
+        )
+
+    def handle(self, *args, **options):
+        path, name = ENDPOINTS[options['endpoint']]
+        params = dict(param.split('=', 1) for param in options['param'])
+        paths = {
+            # What the ASGI handler does with a sync view: one shared thread
+            'sync': sync_to_async(getattr(views, name), thread_sensitive=True),
+            'async': getattr(async_views, name),
+        }
+
+        cache_settings = {} if options['warm'] else {
+            'CACHES': {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+        }
+        self.stdout.write(f"{options['requests']} requests to {path}, {options['concurrency']} concurrent")
+        self.stdout.write(f"{'path':<6} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9} {'req/s':>8}")
+        with override_settings(**cache_settings), warnings.catch_warnings():
+            # Sync streaming responses warn when consumed asynchronously
+            warnings.simplefilter('ignore')
+            for label, view in paths.items():
+                latencies, elapsed = asyncio.run(_timed_requests(
+                    view, path, params, options['requests'], options['concurrency']
+                ))
+                percentiles = statistics.quantiles(latencies, n=100, method='inclusive')
+                self.stdout.write(
+                    f"{label:<6} {percentiles[49]:>9.1f} {percentiles[98]:>9.1f} "
+                    f"{max(latencies):>9.1f} {len(latencies) / elapsed:>8.1f}"
+                )
+        shutdown_db_pool()
@@ -0,0 +1,245 @@
+"""In-process request and SQL metrics, rendered in Prometheus text format.
+
+api.middleware.metrics_middleware times every request and counts its
+response bytes; record_query, installed on every database connection,
+adds the request's SQL count and time and keeps samples of slow queries.
+The current request's RequestStats travels in a context variable, so
+queries run on the async views' pool threads (which copy the context) and
+while a streaming response is sent are attributed to it as well.
+
+Slow statements are labelled with a hash of their normalized SQL (literals
+and placeholder lists removed), never the SQL itself; the normalized text is
+logged with the hash once, when the statement is first seen slow.
+
+Metrics are per process: scrape every worker, or let the Prometheus
+server aggregate them.
+"""
+import hashlib
+import logging
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from contextvars import ContextVar
+
+from django.conf import settings
+
+PREFIX = 'credifiel'
+
+# Upper bounds of the histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (1_000, 10_000, 100_000, 1_000_000, 10_000_000, 100_000_000, 1_000_000_000)
+
+# String and number literals, then parenthesized lists of placeholders
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LISTS = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+
+logger = logging.getLogger(__name__)
+
+_current = ContextVar('api_request_stats', default=None)
+
+
+class RequestStats:
+    """Counters of the request being served"""
+    __slots__ = ('start', 'queries', 'query_seconds', 'slow_queries', 'bytes')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.slow_queries = []
+        self.bytes = 0
+
+
+def current_stats():
+    return _current.get()
+
+
+def activate(stats):
+    """Make stats the current request's; returns the token for deactivate()"""
+    return _current.set(stats)
+
+
+def deactivate(token):
+    _current.reset(token)
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class ViewMetrics:
+
+    def __init__(self):
+        self.statuses = {}
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.size = Histogram(SIZE_BUCKETS)
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.slow_queries = 0
+
+
+class Registry:
+    """Metrics per (view, method), updated under one lock.
+
+    Slow statements are kept as the latest duration per (view, statement),
+    for the slow_query_samples most recently seen pairs.
+    """
+
+    def __init__(self, slow_query_samples=None):
+        self.lock = threading.Lock()
+        self.views = {}
+        self.slow_query_samples = slow_query_samples or settings.API_SLOW_QUERY_SAMPLES
+        self.slow_queries = OrderedDict()
+        self.seen_statements = set()
+
+    def record(self, view, method, status, stats):
+        elapsed = time.perf_counter() - stats.start
+        with self.lock:
+            metrics = self.views.get((view, method))
+            if metrics is None:
+                metrics = self.views[(view, method)] = ViewMetrics()
+            metrics.statuses[status] = metrics.statuses.get(status, 0) + 1
+            metrics.latency.observe(elapsed)
+            metrics.size.observe(stats.bytes)
+            metrics.queries += stats.queries
+            metrics.query_seconds += stats.query_seconds
+            metrics.slow_queries += len(stats.slow_queries)
+            for seconds, statement in stats.slow_queries:
+                self.slow_queries[view, statement] = seconds
+                self.slow_queries.move_to_end((view, statement))
+            while len(self.slow_queries) > self.slow_query_samples:
+                self.slow_queries.popitem(last=False)
+
+    def reset(self):
+        with self.lock:
+            self.views.clear()
+            self.slow_queries.clear()
+            self.seen_statements.clear()
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        with self.lock:
+            views = sorted(self.views.items())
+            slow_queries = list(self.slow_queries.items())
+
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f'# HELP {PREFIX}_{name} {help_text}')
+            lines.append(f'# TYPE {PREFIX}_{name} {kind}')
+
+        def sample(name, labels, value):
+            label_text = ','.join(f'{key}="{_escape(str(label))}"' for key, label in labels.items())
+            lines.append(f'{PREFIX}_{name}{{{label_text}}} {_number(value)}')
+
+        def histogram(name, labels, histogram):
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                cumulative += count
+                sample(f'{name}_bucket', {**labels, 'le': bound}, cumulative)
+            sample(f'{name}_sum', labels, histogram.sum)
+            sample(f'{name}_count', labels, histogram.count)
+
+        family('http_requests_total', 'counter', 'Requests served, by view, method and status code.')
+        for (view, method), metrics in views:
+            for status, count in sorted(metrics.statuses.items()):
+                sample('http_requests_total', {'view': view, 'method': method, 'status': status}, count)
+
+        family('http_request_duration_seconds', 'histogram',
+               'Time from receiving a request to sending the last byte of its response.')
+        for (view, method), metrics in views:
+            histogram('http_request_duration_seconds', {'view': view, 'method': method}, metrics.latency)
+
+        family('http_response_size_bytes', 'histogram', 'Response body size, streamed responses included.')
+        for (view, method), metrics in views:
+            histogram('http_response_size_bytes', {'view': view, 'method': method}, metrics.size)
+
+        family('db_queries_total', 'counter', 'SQL statements executed while serving requests.')
+        for (view, method), metrics in views:
+            sample('db_queries_total', {'view': view, 'method': method}, metrics.queries)
+
+        family('db_query_duration_seconds_total', 'counter', 'Time spent executing SQL statements.')
+        for (view, method), metrics in views:
+            sample('db_query_duration_seconds_total', {'view': view, 'method': method}, metrics.query_seconds)
+
+        family('db_slow_queries_total', 'counter', 'SQL statements slower than API_SLOW_QUERY_MS.')
+        for (view, method), metrics in views:
+            sample('db_slow_queries_total', {'view': view, 'method': method}, metrics.slow_queries)
+
+        family('db_slow_query_seconds', 'gauge',
+               'Latest duration of recently slow SQL statements, by view and normalized statement hash.')
+        for (view, statement), seconds in slow_queries:
+            sample('db_slow_query_seconds', {'view': view, 'statement': statement}, seconds)
+
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+_registry = None
+
+
+def get_registry():
+    global _registry
+    if _registry is None:
+        _registry = Registry()
+    return _registry
+
+
+def normalize_sql(sql):
+    """sql without literal values, placeholder list lengths or extra whitespace"""
+    sql = _LITERALS.sub('?', re.sub(r'\s+', ' ', sql).replace('%s', '?'))
+    return _PLACEHOLDER_LISTS.sub('(...)', sql).strip()
+
+
+def statement_id(sql):
+    """Short hash naming sql's statement in metric labels"""
+    normalized = normalize_sql(sql)
+    statement = hashlib.sha1(normalized.encode()).hexdigest()[:12]
+    registry = get_registry()
+    with registry.lock:
+        first = statement not in registry.seen_statements
+        registry.seen_statements.add(statement)
+    if first:
+        logger.warning('Slow SQL statement %s: %s', statement, normalized)
+    return statement
+
+
+def record_query(execute, sql, params, many, context):
+    """Database execute wrapper adding the statement to the current request's stats"""
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - start
+        stats.queries += 1
+        stats.query_seconds += elapsed
+        if elapsed * 1000 >= settings.API_SLOW_QUERY_MS:
+            stats.slow_queries.append((elapsed, statement_id(sql)))
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    """connection_created receiver: wrap every statement of the new connection"""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
@@ -0,0 +1,83 @@
+from asgiref.sync import iscoroutinefunction
+from django.utils.decorators import sync_and_async_middleware
+
+from .metrics import RequestStats, activate, deactivate, get_registry
+
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match is not None else 'unmatched'
+
+
+def _record(request, response, stats):
+    get_registry().record(_view_name(request), request.method, response.status_code, stats)
+
+
+def _count_chunks(chunks, request, response, stats):
+    """Stream chunks, attributing the SQL run to produce them; record once the body is sent"""
+    chunks = iter(chunks)
+    try:
+        while True:
+            token = activate(stats)
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                return
+            finally:
+                deactivate(token)
+            stats.bytes += len(chunk)
+            yield chunk
+    finally:
+        _record(request, response, stats)
+
+
+async def _acount_chunks(chunks, request, response, stats):
+    chunks = aiter(chunks)
+    try:
+        while True:
+            token = activate(stats)
+            try:
+                chunk = await anext(chunks)
+            except StopAsyncIteration:
+                return
+            finally:
+                deactivate(token)
+            stats.bytes += len(chunk)
+            yield chunk
+    finally:
+        _record(request, response, stats)
+
+
+def _finish(request, response, stats):
+    if not response.streaming:
+        stats.bytes = len(response.content)
+        _record(request, response, stats)
+    elif response.is_async:
+        response.streaming_content = _acount_chunks(response.streaming_content, request, response, stats)
+    else:
+        response.streaming_content = _count_chunks(response.streaming_content, request, response, stats)
+    return response
+
+
+@sync_and_async_middleware
+def metrics_middleware(get_response):
+    """Record latency, SQL and response size per view (see api.metrics)"""
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            stats = RequestStats()
+            token = activate(stats)
+            try:
+                response = await get_response(request)
+            finally:
+                deactivate(token)
+            return _finish(request, response, stats)
+    else:
+        def middleware(request):
+            stats = RequestStats()
+            token = activate(stats)
+            try:
+                response = get_response(request)
+            finally:
+                deactivate(token)
+            return _finish(request, response, stats)
+    return middleware
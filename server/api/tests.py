@@ -1,3 +1,685 @@
-from django.test import TestCase
+import csv
+import gzip
+import io
+import ipaddress
+import json
+import re
+from datetime import datetime
+from decimal import Decimal
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.db import connection
+from django.db.models import Q
+from django.test import AsyncRequestFactory, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from django.utils import timezone
+
+from cobranza.historial import HISTORY_FIELDS, HISTORY_ORDER, drop_histories
+from cobranza.models import ListaCobroDetalle
+from configuracion.decision import invalidate_decision_table
+from configuracion.models import Emision
+
+from . import arrow, async_views
+from .concurrency import shutdown_db_pool
+from .metrics import get_registry, normalize_sql, statement_id
+from .middleware import metrics_middleware
+from .views import _keyset_page, _metrics_allowed
+
+
+ARROW = {'HTTP_ACCEPT': arrow.ARROW_STREAM}
+needs_arrow = skipUnless(arrow.pa is not None, 'pyarrow is not installed')
+
+
+def read_arrow(body):
+    """Rows of an Arrow IPC stream as dicts"""
+    return arrow.pa.ipc.open_stream(body).read_all().to_pylist()
+
+
+def make_detalle(id_credito, fecha, id_banco=12, monto='100.00', cobrado='100.00', **extra):
+    return ListaCobroDetalle.objects.create(
+        idListaCobro=1,
+        idCredito=id_credito,
+        consecutivoCobro='1',
+        idBanco=id_banco,
+        montoExigible=Decimal(monto),
+        montoCobrar=Decimal(monto),
+        montoCobrado=Decimal(cobrado),
+        fechaCobroBanco=timezone.make_aware(fecha) if fecha else None,
+        idRespuestaBanco=extra.get('idRespuestaBanco', '00'),
+    )
+
+
+class CollectionDetailsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        make_detalle(1, datetime(2024, 3, 1, 9, 0))
+        make_detalle(2, datetime(2024, 3, 1, 9, 0), id_banco=14, cobrado='0.00')
+        make_detalle(1, datetime(2024, 1, 15, 9, 0))
+        make_detalle(3, None)
+        make_detalle(1, datetime(2025, 2, 1, 9, 0))
+
+    def get_ndjson(self, **params):
+        response = self.client.get('/api/collection-details/', params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        body = b''.join(response.streaming_content).decode()
+        return [json.loads(line) for line in body.splitlines()]
+
+    def test_streams_rows_in_keyset_order(self):
+        rows = self.get_ndjson()
+        self.assertEqual(
+            [(row['idCredito'], row['fechaCobroBanco']) for row in rows],
+            [
+                (1, '2024-01-15T09:00:00Z'),
+                (1, '2024-03-01T09:00:00Z'),
+                (2, '2024-03-01T09:00:00Z'),
+                (1, '2025-02-01T09:00:00Z'),
+                (3, None),
+            ]
+        )
+        self.assertEqual(rows[0]['montoCobrado'], '100.00')
+
+    def test_pages_resume_after_last_key(self):
+        with mock.patch('api.views.DETAIL_PAGE_SIZE', 1):
+            rows = self.get_ndjson()
+        self.assertEqual([row['idCredito'] for row in rows], [1, 1, 2, 1, 3])
+
+    def test_filters(self):
+        self.assertEqual(len(self.get_ndjson(year=2025)), 1)
+        self.assertEqual(len(self.get_ndjson(year=[2024, 2025])), 4)
+        self.assertEqual([row['idCredito'] for row in self.get_ndjson(bank=14)], [2])
+        self.assertEqual(len(self.get_ndjson(credit=1)), 3)
+        self.assertEqual(len(self.get_ndjson(start='2024-02-01', end='2025-01-01')), 2)
+        self.assertEqual(len(self.get_ndjson(after='2024-03-01T09:00:00Z')), 1)
+        self.assertEqual([row['idCredito'] for row in self.get_ndjson(undated=1)], [3])
+
+    def test_rows_added_after_an_id(self):
+        ids = list(ListaCobroDetalle.objects.order_by('id').values_list('id', flat=True))
+        response = self.client.get('/api/collection-details/', {'after_id': ids[1]})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        # Backdated and undated rows too, in the order they were added
+        self.assertEqual([(row['idCredito'], row['fechaCobroBanco']) for row in rows],
+                         [(1, '2024-01-15T09:00:00Z'), (3, None), (1, '2025-02-01T09:00:00Z')])
+        self.assertEqual(response['X-Last-Id'], str(ids[-1]))
+
+        response = self.client.get('/api/collection-details/', {'after_id': ids[-1]})
+        self.assertEqual(b''.join(response.streaming_content), b'')
+        self.assertEqual(response['X-Last-Id'], str(ids[-1]))
+        self.assertEqual(self.client.get('/api/collection-details/', {'after_id': 'x'}).status_code, 400)
+
+    def test_date_shards_add_up_to_full_export(self):
+        shards = [{'end': '2024-01-01'}, {'start': '2024-01-01', 'end': '2024-03-01'},
+                  {'start': '2024-03-01'}, {'undated': '1'}]
+        self.assertEqual(sum([self.get_ndjson(**shard) for shard in shards], []), self.get_ndjson())
+
+    def test_gzip_when_accepted(self):
+        response = self.client.get('/api/collection-details/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        body = gzip.decompress(b''.join(response.streaming_content))
+        self.assertEqual(body, b''.join(self.client.get('/api/collection-details/').streaming_content))
+
+    def test_csv_format(self):
+        response = self.client.get('/api/collection-details/', {'format': 'csv', 'year': 2025})
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        body = b''.join(response.streaming_content).decode()
+        rows = list(csv.DictReader(io.StringIO(body)))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['idCredito'], '1')
+        self.assertEqual(rows[0]['montoExigible'], '100.00')
+
+    @needs_arrow
+    def test_arrow_when_preferred(self):
+        with mock.patch('api.views.DETAIL_PAGE_SIZE', 2):
+            response = self.client.get('/api/collection-details/', **ARROW)
+            body = b''.join(response.streaming_content)
+        self.assertEqual(response['Content-Type'], arrow.ARROW_STREAM)
+        self.assertIn('Accept', response['Vary'])
+        self.assertEqual(len(list(arrow.pa.ipc.open_stream(body))), 3)
+
+        rows = read_arrow(body)
+        self.assertEqual([(row['idCredito'], row['idBanco']) for row in rows],
+                         [(row['idCredito'], row['idBanco']) for row in self.get_ndjson()])
+        self.assertEqual(rows[1]['montoCobrado'], Decimal('100.00'))
+        self.assertEqual(rows[0]['fechaCobroBanco'], timezone.make_aware(datetime(2024, 1, 15, 9, 0)))
+        self.assertIsNone(rows[-1]['fechaCobroBanco'])
+        self.assertEqual(rows[0]['idRespuestaBanco'], '00')
+
+        response = self.client.get('/api/collection-details/', {'format': 'arrow', 'year': 2025})
+        self.assertEqual(len(read_arrow(b''.join(response.streaming_content))), 1)
+
+    @needs_arrow
+    def test_ndjson_stays_default(self):
+        for accept in ['*/*', 'application/x-ndjson', f'application/x-ndjson, {arrow.ARROW_STREAM};q=0.5']:
+            response = self.client.get('/api/collection-details/', HTTP_ACCEPT=accept)
+            self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        response = self.client.get('/api/collection-details/', {'format': 'ndjson'}, **ARROW)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+
+    def test_json_without_pyarrow(self):
+        with mock.patch('api.arrow.pa', None):
+            response = self.client.get('/api/collection-details/', **ARROW)
+            self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+            self.assertEqual(self.client.get('/api/collection-details/', {'format': 'arrow'}).status_code, 400)
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.client.get('/api/collection-details/', {'year': 'dos mil'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/collection-details/', {'start': 'ayer'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/collection-details/', {'format': 'xml'}).status_code, 400)
+
+
+class CollectionStatsTests(TestCase):
+
+    def test_groups_by_year_and_month(self):
+        make_detalle(1, datetime(2024, 3, 1, 9, 0), cobrado='50.00')
+        make_detalle(2, datetime(2024, 3, 20, 9, 0))
+        make_detalle(1, datetime(2025, 1, 5, 9, 0))
+        make_detalle(3, None)
+
+        stats = self.client.get('/api/collection-stats/').json()
+        self.assertEqual(list(stats), ['2024', '2025'])
+        self.assertEqual([row['month'] for row in stats['2024']], [3])
+        self.assertEqual(Decimal(stats['2024'][0]['total_cobrado']), Decimal('150.00'))
+        self.assertEqual(Decimal(stats['2024'][0]['total_por_cobrar']), Decimal('200.00'))
+        self.assertEqual(Decimal(stats['2024'][0]['promedio_eficiencia']), Decimal(75))
+
+    def test_reads_rollup_only(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            make_detalle(1, datetime(2022, 5, 1, 9, 0))
+            make_detalle(1, datetime(2024, 5, 1, 9, 0), id_banco=14)
+            make_detalle(2, datetime(2024, 5, 2, 9, 0), id_banco=2)
+
+        # The data version, the rollup and the row count; repeated requests hit the cache
+        with self.assertNumQueries(3):
+            stats = self.client.get('/api/collection-stats/').json()
+        self.assertEqual(stats['2023'], [])
+        self.assertEqual(Decimal(stats['2024'][0]['total_cobrado']), Decimal('200.00'))
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get('/api/collection-stats/').json(), stats)
+
+    def test_reports_row_and_edit_counts(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            detalle = make_detalle(1, datetime(2024, 3, 1, 9, 0))
+            make_detalle(2, None)
+        response = self.client.get('/api/collection-stats/')
+        self.assertEqual(response['X-Row-Count'], '2')
+        edits = int(response['X-Edit-Count'])
+
+        # Appends leave the edit count alone, changes to existing rows move it
+        with self.captureOnCommitCallbacks(execute=True):
+            make_detalle(3, datetime(2024, 3, 2, 9, 0))
+        response = self.client.get('/api/collection-stats/')
+        self.assertEqual((response['X-Row-Count'], int(response['X-Edit-Count'])), ('3', edits))
+        with self.captureOnCommitCallbacks(execute=True):
+            ListaCobroDetalle.objects.filter(pk=detalle.pk).update(idRespuestaBanco='06114')
+        self.assertEqual(int(self.client.get('/api/collection-stats/')['X-Edit-Count']), edits + 1)
+
+    @needs_arrow
+    def test_arrow_has_a_row_per_month(self):
+        make_detalle(1, datetime(2024, 3, 1, 9, 0), cobrado='50.00')
+        make_detalle(2, datetime(2024, 3, 20, 9, 0))
+        make_detalle(1, datetime(2025, 1, 5, 9, 0))
+
+        response = self.client.get('/api/collection-stats/', **ARROW)
+        self.assertEqual(response['Content-Type'], arrow.ARROW_STREAM)
+        self.assertIn('Accept', response['Vary'])
+        rows = read_arrow(response.content)
+        self.assertEqual([(row['year'], row['month']) for row in rows], [(2024, 3), (2025, 1)])
+        self.assertEqual(rows[0]['total_cobrado'], Decimal('150.00'))
+        self.assertEqual(rows[0]['promedio_eficiencia'], 75.0)
+        # Each format is cached separately
+        self.assertEqual(list(self.client.get('/api/collection-stats/').json()), ['2024', '2025'])
+
+
+class ConditionalGetTests(TestCase):
+
+    def test_not_modified_until_data_changes(self):
+        make_detalle(1, datetime(2024, 3, 1, 9, 0))
+        for url in ['/api/collection-stats/', '/api/collection-details/']:
+            response = self.client.get(url)
+            etag = response['ETag']
+            self.assertIn('no-cache', response['Cache-Control'])
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            self.assertEqual(
+                self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304
+            )
+
+        self.assertEqual(self.client.get('/api/collection-details/', HTTP_IF_MATCH=etag).status_code, 200)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            make_detalle(2, datetime(2024, 3, 2, 9, 0), cobrado='0.00')
+        # Sharded downloads pin the version they started with
+        self.assertEqual(self.client.get('/api/collection-details/', HTTP_IF_MATCH=etag).status_code, 412)
+        response = self.client.get('/api/collection-stats/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(Decimal(response.json()['2024'][0]['total_cobrado']), Decimal('100.00'))
+
+
+class CreditScoresTests(TestCase):
+
+    def setUp(self):
+        make_detalle(1, datetime(2025, 5, 20, 9, 0), idRespuestaBanco='05503')
+        make_detalle(1, datetime(2025, 5, 25, 9, 0), cobrado='0.00')
+        make_detalle(2, datetime(2025, 5, 25, 9, 0), id_banco=14)
+
+    def get_scores(self, **params):
+        response = self.client.get('/api/credit-scores/', params)
+        self.assertEqual(response.status_code, 200)
+        return [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+
+    def test_one_row_per_credit(self):
+        scores = self.get_scores(date='2025-06-01')
+        self.assertEqual([score['idCredito'] for score in scores], [1, 2])
+        self.assertEqual(scores[0]['points'], 12 - 6)
+        self.assertEqual(Decimal(scores[0]['monto']), Decimal(100))
+        self.assertEqual(scores[0]['lastEmisor'], '05503')
+        self.assertEqual((scores[0]['emisionUsada'], scores[0]['idEmisor']), ('bbva_matutino', '05503'))
+        self.assertEqual((scores[1]['idBanco'], scores[1]['idEmisor']), (14, '00623'))
+        self.assertEqual(len(self.get_scores(date='2025-06-01', bank=14)), 1)
+
+    def test_conditional_only_for_a_fixed_date(self):
+        self.assertFalse(self.client.get('/api/credit-scores/').has_header('ETag'))
+        etag = self.client.get('/api/credit-scores/', {'date': '2025-06-01'})['ETag']
+        response = self.client.get('/api/credit-scores/', {'date': '2025-06-01'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get('/api/credit-scores/', {'date': '2025-06-02'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        # The same date written another way
+        response = self.client.get('/api/credit-scores/', {'date': '2025-6-1'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_invalid_date(self):
+        self.assertEqual(self.client.get('/api/credit-scores/', {'date': 'mañana'}).status_code, 400)
+        response = self.client.get('/api/credit-scores/', {'date': '2025-06-01"'})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.has_header('ETag'))
+
+    @needs_arrow
+    def test_arrow_matches_ndjson(self):
+        with mock.patch('api.views.DETAIL_PAGE_SIZE', 1):
+            response = self.client.get('/api/credit-scores/', {'date': '2025-06-01'}, **ARROW)
+            body = b''.join(response.streaming_content)
+        self.assertEqual(response['Content-Type'], arrow.ARROW_STREAM)
+        self.assertEqual(len(list(arrow.pa.ipc.open_stream(body))), 2)
+        rows = read_arrow(body)
+        scores = self.get_scores(date='2025-06-01')
+        self.assertEqual([set(row) for row in rows], [set(score) for score in scores])
+        for row, score in zip(rows, scores):
+            self.assertEqual(row['monto'], Decimal(score['monto']))
+            self.assertEqual((row['points'], row['idBanco'], row['idEmisor']),
+                             (score['points'], score['idBanco'], score['idEmisor']))
+
+
+class CreditLookupTests(TestCase):
+
+    def setUp(self):
+        drop_histories([1, 2, 3])
+        make_detalle(1, datetime(2025, 5, 20, 9, 0), idRespuestaBanco='05503')
+        make_detalle(1, None)
+        make_detalle(1, datetime(2023, 2, 1, 9, 0), cobrado='0.00')
+        make_detalle(2, datetime(2025, 5, 25, 9, 0), id_banco=14)
+
+    def test_history_score_and_emission(self):
+        credit = self.client.get('/api/credits/1/', {'date': '2025-06-01'}).json()
+        self.assertEqual([row['fechaCobroBanco'] for row in credit.pop('cobros')],
+                         ['2023-02-01T09:00:00Z', '2025-05-20T09:00:00Z', None])
+        score = json.loads(b''.join(
+            self.client.get('/api/credit-scores/', {'date': '2025-06-01', 'credit': 1}).streaming_content
+        ))
+        # SQLite sums decimals without their scale
+        self.assertEqual(Decimal(credit.pop('monto')), Decimal(score.pop('monto')))
+        self.assertEqual({field: credit[field] for field in score}, score)
+        self.assertEqual(credit['emision']['nombre'], credit['emisionUsada'])
+        self.assertEqual(credit['emision']['idEmisor'], credit['idEmisor'])
+
+    def test_errors(self):
+        self.assertEqual(self.client.get('/api/credits/3/').status_code, 404)
+        self.assertEqual(self.client.get('/api/credits/1/', {'date': 'mañana'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/credits/').status_code, 400)
+        self.assertEqual(self.client.get('/api/credits/', {'ids': '1,dos'}).status_code, 400)
+        with mock.patch('api.views.CREDIT_BATCH_MAX', 2):
+            self.assertEqual(self.client.get('/api/credits/', {'ids': '1,2,3'}).status_code, 400)
+
+    def test_batch(self):
+        response = self.client.get('/api/credits/', {'ids': '2,3,1,2', 'date': '2025-06-01'}).json()
+        self.assertEqual([credit['idCredito'] for credit in response['credits']], [2, 1])
+        self.assertEqual(response['missing'], [3])
+        self.assertEqual(response['credits'][1], self.client.get('/api/credits/1/', {'date': '2025-06-01'}).json())
+
+    def test_cached_until_new_payment(self):
+        self.client.get('/api/credits/1/')
+        # Only the configuration version the decision table is keyed by
+        with self.assertNumQueries(1):
+            self.assertEqual(len(self.client.get('/api/credits/1/').json()['cobros']), 3)
+        with self.captureOnCommitCallbacks(execute=True):
+            make_detalle(1, datetime(2025, 6, 1, 9, 0))
+        self.assertEqual(len(self.client.get('/api/credits/1/').json()['cobros']), 4)
+
+
+class EmissionTableTests(TestCase):
+
+    def setUp(self):
+        invalidate_decision_table()
+        self.addCleanup(invalidate_decision_table)
+
+    def test_serves_seeded_rules(self):
+        response = self.client.get('/api/emission-table/')
+        table = response.json()
+        self.assertEqual([regla['emision'] for regla in table['reglas']][:2], ['bbva_matutino', 'bbva_cobrar_mismo'])
+        self.assertEqual(table['reglas'][0]['emisoresPrevios'], ['05503', '06114'])
+        self.assertEqual(
+            {emision['nombre']: emision['comision'] for emision in table['emisiones']}['santander_cobrar_mismo'],
+            '1.97',
+        )
+        self.assertEqual(response['ETag'], f'"{table["tag"]}"')
+
+    def test_config_changes_revalidate_table_and_scores(self):
+        make_detalle(1, datetime(2025, 5, 25, 9, 0), id_banco=14)
+        table_etag = self.client.get('/api/emission-table/')['ETag']
+        scores_etag = self.client.get('/api/credit-scores/', {'date': '2025-06-01'})['ETag']
+        self.assertEqual(
+            self.client.get('/api/emission-table/', HTTP_IF_NONE_MATCH=table_etag).status_code, 304
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Emision.objects.filter(nombre='santander_cobrar_mismo').update(idEmisor='00999')
+        self.assertEqual(self.client.get('/api/emission-table/', HTTP_IF_NONE_MATCH=table_etag).status_code, 200)
+        response = self.client.get('/api/credit-scores/', {'date': '2025-06-01'}, HTTP_IF_NONE_MATCH=scores_etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(b''.join(response.streaming_content))['idEmisor'], '00999')
+
+
+async def read_body(response):
+    if not response.streaming:
+        return response.content
+    return b''.join([chunk async for chunk in response])
+
+
+class AsyncViewTests(TransactionTestCase):
+    """The async views run their queries on the pool threads, outside any test transaction"""
+
+    def setUp(self):
+        make_detalle(1, datetime(2024, 3, 1, 9, 0), cobrado='50.00')
+        make_detalle(2, datetime(2024, 3, 2, 9, 0))
+        make_detalle(1, datetime(2025, 1, 5, 9, 0))
+        make_detalle(3, None)
+
+    def tearDown(self):
+        shutdown_db_pool()
+
+    def get(self, view, path, headers=None, **params):
+        response = async_to_sync(view)(AsyncRequestFactory().get(path, params, headers=headers))
+        return response, async_to_sync(read_body)(response)
+
+    def test_stats_match_sync_view(self):
+        response, body = self.get(async_views.collection_stats, '/api/collection-stats/')
+        expected = self.client.get('/api/collection-stats/')
+        self.assertEqual(json.loads(body), expected.json())
+        self.assertEqual(response['ETag'], expected['ETag'])
+        self.assertEqual(response['X-Row-Count'], expected['X-Row-Count'])
+        self.assertEqual(response['X-Edit-Count'], expected['X-Edit-Count'])
+
+    def test_details_match_sync_view_across_pages(self):
+        with mock.patch('api.views.DETAIL_PAGE_SIZE', 1):
+            _, body = self.get(async_views.collection_details, '/api/collection-details/')
+        expected = b''.join(self.client.get('/api/collection-details/').streaming_content)
+        self.assertEqual(body, expected)
+
+        _, body = self.get(async_views.collection_details, '/api/collection-details/', format='csv', year=2025)
+        self.assertEqual(len(body.decode().splitlines()), 2)
+
+        first = ListaCobroDetalle.objects.order_by('id').values_list('id', flat=True)[0]
+        response, body = self.get(async_views.collection_details, '/api/collection-details/', after_id=first)
+        expected = self.client.get('/api/collection-details/', {'after_id': first})
+        self.assertEqual(body, b''.join(expected.streaming_content))
+        self.assertEqual(response['X-Last-Id'], expected['X-Last-Id'])
+
+    def test_scores_match_sync_view(self):
+        _, body = self.get(async_views.credit_scores, '/api/credit-scores/', date='2025-06-01')
+        expected = b''.join(self.client.get('/api/credit-scores/', {'date': '2025-06-01'}).streaming_content)
+        self.assertEqual(body, expected)
+
+        # Credits are read a page at a time
+        with mock.patch('api.views.DETAIL_PAGE_SIZE', 2), \
+                mock.patch('api.async_views.run_in_db_pool', wraps=async_views.run_in_db_pool) as pool:
+            _, body = self.get(async_views.credit_scores, '/api/credit-scores/', date='2025-06-01')
+        self.assertEqual(body, expected)
+        self.assertEqual([call.args[0] for call in pool.call_args_list].count(async_views._fetch_scores), 2)
+
+    def test_credits_match_sync_view(self):
+        drop_histories([1, 2, 3])
+        for view, path, args, params in [
+            (async_views.credit_detail, '/api/credits/1/', [1], {'date': '2025-06-01'}),
+            (async_views.credit_batch, '/api/credits/', [], {'ids': '3,1,2,4'}),
+        ]:
+            response = async_to_sync(view)(AsyncRequestFactory().get(path, params), *args)
+            self.assertEqual(json.loads(response.content), self.client.get(path, params).json())
+
+    @needs_arrow
+    def test_arrow_matches_sync_view(self):
+        headers = {'Accept': arrow.ARROW_STREAM}
+        for view, path, params in [
+            (async_views.collection_stats, '/api/collection-stats/', {}),
+            (async_views.collection_details, '/api/collection-details/', {}),
+            (async_views.credit_scores, '/api/credit-scores/', {'date': '2025-06-01'}),
+        ]:
+            with mock.patch('api.views.DETAIL_PAGE_SIZE', 1):
+                response, body = self.get(view, path, headers=headers, **params)
+                expected = self.client.get(path, params, **ARROW)
+                expected = b''.join(expected.streaming_content) if expected.streaming else expected.content
+            self.assertEqual(response['Content-Type'], arrow.ARROW_STREAM)
+            self.assertEqual(read_arrow(body), read_arrow(expected))
+
+
+def metric_samples():
+    """{(name, sorted label pairs): value} from /api/metrics"""
+    samples = {}
+    for line in get_registry().render().splitlines():
+        if line.startswith('#'):
+            continue
+        name, rest = line.split('{', 1)
+        labels, value = rest.rsplit('} ', 1)
+        pairs = re.findall(r'(\w+)="((?:[^"\\]|\\.)*)"', labels)
+        samples[name, tuple(sorted(pairs))] = float(value)
+    return samples
+
+
+def sample(samples, name, **labels):
+    return samples.get((name, tuple(sorted(labels.items()))), 0)
+
+
+@override_settings(API_METRICS_ALLOWED_IPS=[ipaddress.ip_network('127.0.0.1')])
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        make_detalle(1, datetime(2024, 3, 1, 9, 0))
+        make_detalle(2, datetime(2025, 3, 1, 9, 0))
+        get_registry().reset()
+        self.addCleanup(get_registry().reset)
+
+    def test_counts_requests_sql_and_bytes(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/collection-stats/')
+        self.client.get('/api/collection-stats/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.client.get('/api/missing/')
+
+        samples = metric_samples()
+        view = {'view': 'collection-stats', 'method': 'GET'}
+        self.assertEqual(sample(samples, 'credifiel_http_requests_total', status='200', **view), 1)
+        self.assertEqual(sample(samples, 'credifiel_http_requests_total', status='304', **view), 1)
+        self.assertEqual(sample(samples, 'credifiel_http_requests_total',
+                                view='unmatched', method='GET', status='404'), 1)
+        self.assertEqual(sample(samples, 'credifiel_http_request_duration_seconds_count', **view), 2)
+        self.assertEqual(sample(samples, 'credifiel_http_request_duration_seconds_bucket', le='+Inf', **view), 2)
+        self.assertEqual(sample(samples, 'credifiel_http_response_size_bytes_sum', **view), len(response.content))
+        self.assertGreaterEqual(sample(samples, 'credifiel_db_queries_total', **view), len(queries))
+
+    def test_streamed_responses_counted_when_sent(self):
+        view = {'view': 'collection-details', 'method': 'GET'}
+        response = self.client.get('/api/collection-details/')
+        self.assertEqual(sample(metric_samples(), 'credifiel_http_requests_total', status='200', **view), 0)
+        with CaptureQueriesContext(connection) as queries:
+            body = b''.join(response.streaming_content)
+
+        samples = metric_samples()
+        self.assertEqual(sample(samples, 'credifiel_http_requests_total', status='200', **view), 1)
+        self.assertEqual(sample(samples, 'credifiel_http_response_size_bytes_sum', **view), len(body))
+        # The rows are fetched while streaming and still count towards the view
+        self.assertGreater(len(queries), 0)
+        self.assertGreaterEqual(sample(samples, 'credifiel_db_queries_total', **view), len(queries))
+
+    def test_slow_query_samples(self):
+        with self.settings(API_SLOW_QUERY_MS=0), self.assertLogs('api.metrics', 'WARNING') as logs:
+            self.client.get('/api/collection-stats/')
+            self.client.get('/api/collection-stats/', {'year': 2024})
+        text = self.client.get('/api/metrics').content.decode()
+        self.assertRegex(text, r'credifiel_db_slow_query_seconds\{view="collection-stats",statement="[0-9a-f]{12}"\}')
+        self.assertNotIn('SELECT', text)
+        self.assertGreater(sample(metric_samples(), 'credifiel_db_slow_queries_total',
+                                  view='collection-stats', method='GET'), 0)
+        # Each statement is logged with its hash once, however often it is slow
+        statements = [message.split()[3].rstrip(':') for message in logs.output]
+        self.assertEqual(len(statements), len(set(statements)))
+
+    def test_sql_normalization(self):
+        sql = """SELECT "id" FROM "ListaCobroDetalle2024" WHERE "idCredito" IN (%s, %s, %s)
+                 AND "idRespuestaBanco" = 'O''Brien' AND "montoCobrado" > 12.50"""
+        self.assertEqual(
+            normalize_sql(sql),
+            'SELECT "id" FROM "ListaCobroDetalle2024" WHERE "idCredito" IN (...) '
+            'AND "idRespuestaBanco" = ? AND "montoCobrado" > ?'
+        )
+        with self.assertLogs('api.metrics', 'WARNING'):
+            self.assertEqual(statement_id(sql), statement_id(sql.replace('(%s, %s, %s)', '(%s)')))
+            self.assertEqual(statement_id("SELECT 1 WHERE x = 'a'"), statement_id("SELECT 2 WHERE x = 'b'"))
+
+    def test_endpoint_needs_allowed_address(self):
+        self.assertEqual(self.client.get('/api/metrics', REMOTE_ADDR='10.1.2.3').status_code, 404)
+        with self.settings(API_METRICS_ALLOWED_IPS=[ipaddress.ip_network('10.0.0.0/8')]):
+            self.assertEqual(self.client.get('/api/metrics', REMOTE_ADDR='10.1.2.3').status_code, 200)
+        with self.settings(API_METRICS_ALLOWED_IPS=[]):
+            self.assertEqual(self.client.get('/api/metrics').status_code, 404)
+        # Requests without a usable client address are refused, not failed
+        for address in ['', 'unix:/run/gunicorn.sock']:
+            self.assertEqual(self.client.get('/api/metrics', REMOTE_ADDR=address).status_code, 404)
+        request = RequestFactory().get('/api/metrics')
+        del request.META['REMOTE_ADDR']
+        self.assertFalse(_metrics_allowed(request))
+
+    def test_endpoint_format(self):
+        response = self.client.get('/api/metrics')
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        self.assertIn('# TYPE credifiel_http_request_duration_seconds histogram', response.content.decode())
+
+
+class AsyncMetricsTests(TransactionTestCase):
+
+    def setUp(self):
+        make_detalle(1, datetime(2024, 3, 1, 9, 0))
+        get_registry().reset()
+
+    def tearDown(self):
+        shutdown_db_pool()
+        get_registry().reset()
+
+    def test_pool_queries_count_towards_async_view(self):
+        request = AsyncRequestFactory().get('/api/collection-details/')
+        request.resolver_match = resolve('/api/collection-details/')
+        response = async_to_sync(metrics_middleware(async_views.collection_details))(request)
+        body = async_to_sync(read_body)(response)
+
+        samples = metric_samples()
+        view = {'view': 'collection-details', 'method': 'GET'}
+        self.assertEqual(sample(samples, 'credifiel_http_requests_total', status='200', **view), 1)
+        self.assertEqual(sample(samples, 'credifiel_http_response_size_bytes_sum', **view), len(body))
+        self.assertGreater(sample(samples, 'credifiel_db_queries_total', **view), 0)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Query plans are checked on PostgreSQL')
+class QueryPlanTests(TestCase):
+    """The API's selective queries must stay on indexes as the table grows.
+
+    Full-year aggregation in collection_stats reads whole partitions by
+    design and is not checked here.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        # ~50k rows a year over 2022-2025, 2000 credits spread over 5 banks
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO "ListaCobroDetalle" (
+                    "idListaCobro", "idCredito", "consecutivoCobro", "idBanco", "montoExigible",
+                    "montoCobrar", "montoCobrado", "fechaCobroBanco", "idRespuestaBanco"
+                )
+                SELECT n % 100, n % 2000, '1', 2 + n % 5 * 6, 100, 100, 50,
+                       '2022-01-01T00:00:00Z'::timestamptz + n * interval '12 minutes', '00'
+                FROM generate_series(1, 200000) AS n
+                """
+            )
+            cursor.execute('ANALYZE "ListaCobroDetalle"')
+
+    def assertNoSeqScan(self, queryset):
+        plan = queryset.explain()
+        self.assertNotIn('Seq Scan', plan, plan)
+
+    def test_credit_history(self):
+        self.assertNoSeqScan(
+            ListaCobroDetalle.objects.filter(idCredito=1234).order_by('fechaCobroBanco')
+        )
+
+    def test_bank_date_window(self):
+        self.assertNoSeqScan(
+            ListaCobroDetalle.objects.filter(
+                idBanco=14,
+                fechaCobroBanco__gte=timezone.make_aware(datetime(2024, 3, 1)),
+                fechaCobroBanco__lt=timezone.make_aware(datetime(2024, 3, 8)),
+            )
+        )
+
+    def test_date_window(self):
+        self.assertNoSeqScan(
+            ListaCobroDetalle.objects.filter(
+                fechaCobroBanco__gte=timezone.make_aware(datetime(2023, 6, 1)),
+                fechaCobroBanco__lt=timezone.make_aware(datetime(2023, 6, 3)),
+            )
+        )
+
+    def test_detail_export_keyset_page(self):
+        dated = ListaCobroDetalle.objects.filter(fechaCobroBanco__isnull=False)
+        last = (timezone.make_aware(datetime(2023, 6, 1)), 120000)
+        self.assertNoSeqScan(_keyset_page(dated, ['fechaCobroBanco', 'id'], last))
+        self.assertNoSeqScan(_keyset_page(dated.filter(Q(idCredito=1234)), ['fechaCobroBanco', 'id'], last))
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Query plans are checked on PostgreSQL')
+class CreditHistoryPlanTests(TransactionTestCase):
+    """Index-only scans need a vacuumed visibility map, and VACUUM cannot run in a transaction"""
+
+    def test_credit_history_is_index_only(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO "ListaCobroDetalle" (
+                    "idListaCobro", "idCredito", "consecutivoCobro", "idBanco", "montoExigible",
+                    "montoCobrar", "montoCobrado", "fechaCobroBanco", "idRespuestaBanco"
+                )
+                SELECT n % 100, n % 2000, '1', 2 + n % 5 * 6, 100, 100, 50,
+                       '2022-01-01T00:00:00Z'::timestamptz + n * interval '12 minutes', '00'
+                FROM generate_series(1, 200000) AS n
+                """
+            )
+            cursor.execute('VACUUM ANALYZE "ListaCobroDetalle"')
+
+        history = (
+            ListaCobroDetalle.objects.filter(idCredito__in=[1234, 17])
+            .order_by('idCredito', *HISTORY_ORDER).values_list('idCredito', *HISTORY_FIELDS)
+        )
+        plan = history.explain()
+        self.assertIn('Index Only Scan', plan, plan)
+        self.assertNotIn('Heap Scan', plan, plan)
+        self.assertNotIn('Seq Scan', plan, plan)
@@ -1,6 +1,19 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
+
+# Async views only pay off under ASGI; see API_ASYNC_VIEWS in settings
+api_views = async_views if settings.API_ASYNC_VIEWS else views
 
 urlpatterns = [
-    path('collection-stats/', views.collection_stats, name='collection-stats'),
-]
\ No newline at end of file
+    path('collection-stats/', api_views.collection_stats, name='collection-stats'),
+    path('collection-details/', api_views.collection_details, name='collection-details'),
+    path('credit-scores/', api_views.credit_scores, name='credit-scores'),
+    path('credits/', api_views.credit_batch, name='credits'),
+    path('credits/<int:id_credito>/', api_views.credit_detail, name='credit'),
+    path('emission-table/', api_views.emission_table, name='emission-table'),
+]
+
+if settings.API_METRICS:
+    # Prometheus' default metrics path; the text is small, so it is never async
+    urlpatterns.append(path('metrics', views.metrics, name='metrics'))
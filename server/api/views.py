@@ -1,36 +1,576 @@
-from django.http import JsonResponse
-from cobranza.models import (
-    ListaCobroDetalle2022, ListaCobroDetalle2023,
-    ListaCobroDetalle2024, ListaCobroDetalle2025
-)
-from django.db.models import Sum, F, ExpressionWrapper, DecimalField, Count
-from django.db.models.functions import ExtractMonth
+import csv
+import ipaddress
+import json
+from datetime import datetime, time
+from itertools import islice
 
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+from django.views.decorators.vary import vary_on_headers
+from cobranza.historial import HISTORY_FIELDS, credit_histories
+from cobranza.models import CobranzaMensual, ListaCobroDetalle, VersionDatos
+from cobranza.partitions import year_bounds
+from cobranza import scoring
+from configuracion.decision import decision_table, emisor_mapping
+from django.db.models import Max, Sum, Q
+
+from . import arrow
+from .metrics import get_registry
+
+# Sent by after_id requests to /collection-details/, see collection_details
+LAST_ID_HEADER = 'X-Last-Id'
+# Sent by /collection-stats/: detail rows and VersionDatos.ediciones at its data version
+ROW_COUNT_HEADER = 'X-Row-Count'
+EDIT_COUNT_HEADER = 'X-Edit-Count'
+
+# Columns exported by collection_details, in output order
+DETAIL_FIELDS = [
+    'idListaCobro', 'idCredito', 'consecutivoCobro', 'idBanco',
+    'montoExigible', 'montoCobrar', 'montoCobrado',
+    'fechaCobroBanco', 'idRespuestaBanco'
+]
+
+# Rows per keyset page and per server-side cursor fetch (also used for credit scores)
+DETAIL_PAGE_SIZE = 5000
+DETAIL_CURSOR_CHUNK = 1000
+
+# Most credits one /api/credits/ request may look up
+CREDIT_BATCH_MAX = 500
+
+
+def _data_version(request):
+    """Collection data version, read once per request"""
+    if not hasattr(request, 'data_version'):
+        request.data_version = VersionDatos.current()
+    return request.data_version
+
+
+def _decision_table(request):
+    """Emission decision table, read once per request"""
+    if not hasattr(request, 'decision_table'):
+        request.decision_table = decision_table()
+    return request.decision_table
+
+
+def _data_etag(request, *args, **kwargs):
+    return _data_version(request).tag
+
+
+def _data_modified(request, *args, **kwargs):
+    return _data_version(request).modificado
+
+
+# Responses depend only on the URL and the data version: clients revalidate
+# with If-None-Match / If-Modified-Since and get a 304 until data is loaded
+data_conditional = condition(etag_func=_data_etag, last_modified_func=_data_modified)
+
+
+def _stats_rows():
+    """Monthly totals over all banks, read from the rollup (months x banks rows)"""
+    return list(
+        CobranzaMensual.objects
+        .filter(registros__gt=0)
+        .values('year', 'month')
+        .annotate(
+            total_cobrado=Sum('montoCobrado'),
+            total_por_cobrar=Sum('montoCobrar'),
+            registros=Sum('registros'),
+            eficiencia=Sum('sumaEficiencia'),
+        )
+        .order_by('year', 'month')
+    )
+
+
+def _group_years(rows):
+    """collection_stats payload from _stats_rows() rows"""
+    by_year = {}
+    for row in rows:
+        by_year.setdefault(row['year'], []).append({
+            'month': row['month'],
+            'total_cobrado': row['total_cobrado'],
+            'total_por_cobrar': row['total_por_cobrar'],
+            'promedio_eficiencia': row['eficiencia'] / row['registros'],
+        })
+
+    # Years without collections between the first and last one stay listed, empty
+    return {
+        str(year): by_year.get(year, [])
+        for year in (range(min(by_year), max(by_year) + 1) if by_year else [])
+    }
+
+
+def _stats_arrow(rows):
+    """collection_stats Arrow stream from _stats_rows() rows, one row per month"""
+    columns = {
+        'year': [row['year'] for row in rows],
+        'month': [row['month'] for row in rows],
+        'total_cobrado': [row['total_cobrado'] for row in rows],
+        'total_por_cobrar': [row['total_por_cobrar'] for row in rows],
+        'promedio_eficiencia': [float(row['eficiencia'] / row['registros']) for row in rows],
+    }
+    schema = arrow.stats_schema()
+    return b''.join(arrow.stream(schema, [arrow.record_batch(schema, columns)]))
+
+
+def _stats_content(rows, output_format):
+    if output_format == 'arrow':
+        return _stats_arrow(rows)
+    return JsonResponse(_group_years(rows)).content
+
+
+def _stats_format(request):
+    """'arrow' when the client prefers an Arrow stream over JSON, else 'json'"""
+    return 'arrow' if arrow.accepts_arrow(request, 'application/json') else 'json'
+
+
+def _stats_key(tag, output_format):
+    return f'collection_stats:{tag}' + (f':{output_format}' if output_format != 'json' else '')
+
+
+def _row_count():
+    return ListaCobroDetalle.objects.count()
+
+
+def _stats_headers(response, version, rows):
+    """Counters clients holding fetched rows check before trusting them (see collection_stats)"""
+    response[ROW_COUNT_HEADER] = str(rows)
+    response[EDIT_COUNT_HEADER] = str(version.ediciones)
+    return response
+
+
+CONTENT_TYPES = {'json': 'application/json', 'ndjson': 'application/x-ndjson', 'arrow': arrow.ARROW_STREAM}
+
+
+@cache_control(no_cache=True)
+@vary_on_headers('Accept')
+@data_conditional
 def collection_stats(request):
-    def get_yearly_stats(model):
-        return (
-            model.objects
-            .annotate(
-                month=ExtractMonth('fechaCobroBanco'),
-                efficiency=ExpressionWrapper(
-                    F('montoCobrado') * 100.0 / F('montoCobrar'),
-                    output_field=DecimalField()
-                )
-            )
-            .values('month')
-            .annotate(
-                total_cobrado=Sum('montoCobrado'),
-                total_por_cobrar=Sum('montoCobrar'),
-                promedio_eficiencia=Sum('efficiency') / Count('id')
+    """Monthly totals grouped by year as JSON, or one row per month as an Arrow stream
+
+    ROW_COUNT_HEADER and EDIT_COUNT_HEADER come along, so a client that
+    only fetches rows added since its last run can tell whether rows it
+    already holds were changed or deleted.
+    """
+    version = _data_version(request)
+    output_format = _stats_format(request)
+    key = _stats_key(version.tag, output_format)
+    content = cache.get(key)
+    if content is None:
+        content = _stats_content(_stats_rows(), output_format)
+        cache.set(key, content)
+    rows = cache.get(_stats_key(version.tag, 'rows'))
+    if rows is None:
+        rows = _row_count()
+        cache.set(_stats_key(version.tag, 'rows'), rows)
+    return _stats_headers(HttpResponse(content, content_type=CONTENT_TYPES[output_format]), version, rows)
+
+
+def _parse_moment(value):
+    """Parse a date or datetime query parameter into an aware datetime"""
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f"Invalid date: {value}")
+        moment = datetime.combine(day, time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def _detail_filters(params):
+    """Translate query parameters into (Q filter, include dated rows, include undated rows)"""
+    filters = Q()
+    dated = False
+    if 'year' in params:
+        years = Q()
+        for year in params.getlist('year'):
+            lower, upper = year_bounds(int(year))
+            years |= Q(fechaCobroBanco__gte=lower, fechaCobroBanco__lt=upper)
+        filters &= years
+        dated = True
+
+    if 'bank' in params:
+        filters &= Q(idBanco__in=[int(bank) for bank in params.getlist('bank')])
+    if 'credit' in params:
+        filters &= Q(idCredito__in=[int(credit) for credit in params.getlist('credit')])
+
+    if 'start' in params:
+        filters &= Q(fechaCobroBanco__gte=_parse_moment(params['start']))
+        dated = True
+    if 'end' in params:
+        filters &= Q(fechaCobroBanco__lt=_parse_moment(params['end']))
+        dated = True
+    if 'after' in params:
+        filters &= Q(fechaCobroBanco__gt=_parse_moment(params['after']))
+        dated = True
+    if 'after_id' in params:
+        filters &= Q(id__gt=int(params['after_id']))
+
+    if params.get('undated') == '1':
+        return filters & Q(fechaCobroBanco__isnull=True), False, True
+    return filters, True, not dated
+
+
+def _page_fields(keys):
+    """Columns of a keyset page: the keys first, then the rest of DETAIL_FIELDS"""
+    return keys + [field for field in DETAIL_FIELDS if field not in keys]
+
+
+def _keyset_page(queryset, keys, last=None):
+    """Rows of queryset ordered by keys that come after the `last` key values"""
+    fields = _page_fields(keys)
+    page = queryset.order_by(*keys)
+    if last is not None:
+        if len(keys) == 1:
+            page = page.filter(**{f'{keys[0]}__gt': last[0]})
+        else:
+            page = page.filter(
+                Q(**{f'{keys[0]}__gt': last[0]})
+                | Q(**{keys[0]: last[0], f'{keys[1]}__gt': last[1]})
             )
-            .order_by('month')
+    return page.values_list(*fields)[:DETAIL_PAGE_SIZE]
+
+
+def _keyset_pages(queryset, keys):
+    """Yield (fields, value tuples) of queryset ordered by keys, one keyset page at a time.
+
+    Each page is a fresh query resuming after the last key seen, read through
+    a server-side cursor, so neither the database nor this process ever holds
+    more than a page.
+    """
+    fields = _page_fields(keys)
+    last = None
+    while True:
+        page = list(_keyset_page(queryset, keys, last).iterator(chunk_size=DETAIL_CURSOR_CHUNK))
+        if page:
+            yield fields, page
+        if len(page) < DETAIL_PAGE_SIZE:
+            return
+        last = page[-1]
+
+
+def _last_id(params):
+    """Newest row id an after_id request covers; the client resumes after it next time"""
+    newest = ListaCobroDetalle.objects.aggregate(newest=Max('id'))['newest']
+    return max(newest or 0, int(params['after_id']))
+
+
+def _detail_scans(filters, include_dated, include_undated, by_id=False):
+    """(queryset, keyset keys) to export, in output order"""
+    queryset = ListaCobroDetalle.objects.filter(filters)
+    if by_id:
+        # Rows added after a cursor are one range of the primary key, in insertion order
+        if not include_undated:
+            queryset = queryset.filter(fechaCobroBanco__isnull=False)
+        elif not include_dated:
+            queryset = queryset.filter(fechaCobroBanco__isnull=True)
+        return [(queryset, ['id'])]
+    scans = []
+    if include_dated:
+        scans.append((queryset.filter(fechaCobroBanco__isnull=False), ['fechaCobroBanco', 'id']))
+    if include_undated:
+        scans.append((queryset.filter(fechaCobroBanco__isnull=True), ['id']))
+    return scans
+
+
+def _iter_detail_pages(filters, include_dated, include_undated, by_id=False):
+    for queryset, keys in _detail_scans(filters, include_dated, include_undated, by_id):
+        yield from _keyset_pages(queryset, keys)
+
+
+def _page_rows(pages):
+    for fields, page in pages:
+        for row in page:
+            yield dict(zip(fields, row))
+
+
+class _Echo:
+    """File-like object whose write() hands the line back to the csv writer"""
+
+    def write(self, value):
+        return value
+
+
+def _ndjson_line(row):
+    return json.dumps({field: row[field] for field in DETAIL_FIELDS}, cls=DjangoJSONEncoder) + '\n'
+
+
+def _csv_line(writer, row):
+    fecha = row['fechaCobroBanco']
+    row['fechaCobroBanco'] = fecha.isoformat() if fecha is not None else ''
+    return writer.writerow([row[field] for field in DETAIL_FIELDS])
+
+
+def _ndjson_lines(rows):
+    for row in rows:
+        yield _ndjson_line(row)
+
+
+def _csv_lines(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(DETAIL_FIELDS)
+    for row in rows:
+        yield _csv_line(writer, row)
+
+
+def _detail_batch(fields, page):
+    return arrow.record_batch(arrow.detail_schema(tuple(DETAIL_FIELDS)), arrow.columns(fields, page))
+
+
+def _detail_batches(pages):
+    for fields, page in pages:
+        yield _detail_batch(fields, page)
+
+
+def _detail_format(request):
+    """format parameter, else the Accept header's choice between NDJSON and Arrow"""
+    if 'format' in request.GET:
+        return request.GET['format']
+    return 'arrow' if arrow.accepts_arrow(request, 'application/x-ndjson') else 'ndjson'
+
+
+def _unknown_format(output_format):
+    return JsonResponse({'error': f"Unknown format: {output_format}"}, status=400)
+
+
+@cache_control(no_cache=True)
+@vary_on_headers('Accept')
+@data_conditional
+def collection_details(request):
+    """Stream raw ListaCobroDetalle rows as NDJSON (default), CSV or an Arrow stream.
+
+    Query parameters: year, bank, credit (repeatable), start/end (inclusive /
+    exclusive bounds on fechaCobroBanco), after (strict lower bound, for
+    high-water marks), undated=1 (only rows without fechaCobroBanco) and
+    format=ndjson|csv|arrow; without format, an Accept header preferring
+    application/vnd.apache.arrow.stream selects Arrow. Rows come ordered by
+    (fechaCobroBanco, id); undated rows follow at the end when no year or
+    date bound is given.
+
+    after_id returns the rows added after that id instead, dated or not, in
+    id order, up to the newest id at the start of the request, which is sent
+    as X-Last-Id for the next request to resume after.
+    """
+    try:
+        filters, include_dated, include_undated = _detail_filters(request.GET)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    last_id = None
+    if 'after_id' in request.GET:
+        last_id = _last_id(request.GET)
+        filters &= Q(id__lte=last_id)
+    output_format = _detail_format(request)
+    pages = _iter_detail_pages(filters, include_dated, include_undated, by_id=last_id is not None)
+    if output_format == 'csv':
+        response = StreamingHttpResponse(_csv_lines(_page_rows(pages)), content_type='text/csv')
+        response['Content-Disposition'] = 'attachment; filename="collection_details.csv"'
+    elif output_format == 'ndjson':
+        response = StreamingHttpResponse(_ndjson_lines(_page_rows(pages)), content_type='application/x-ndjson')
+    elif output_format == 'arrow' and arrow.pa is not None:
+        schema = arrow.detail_schema(tuple(DETAIL_FIELDS))
+        response = StreamingHttpResponse(arrow.stream(schema, _detail_batches(pages)), content_type=arrow.ARROW_STREAM)
+    else:
+        return _unknown_format(output_format)
+    if last_id is not None:
+        response[LAST_ID_HEADER] = str(last_id)
+    return response
+
+
+def _scores_etag(request, *args, **kwargs):
+    # Scores age with the scoring date, so only requests for a fixed date are revalidated
+    if 'date' not in request.GET:
+        return None
+    try:
+        # The same moment written two ways gets one tag; an invalid one gets none, and the view's 400
+        date = _parse_moment(request.GET['date']).isoformat()
+    except ValueError:
+        return None
+    return f"{_data_version(request).tag}-{_decision_table(request)['tag']}-{date}"
+
+
+scores_conditional = condition(etag_func=_scores_etag)
+
+
+def _score_rows(params, table, after=None):
+    """Per-credit scores for the query parameters, as value tuples; only credits above `after` if given"""
+    filters, _, _ = _detail_filters(params)
+    if after is not None:
+        filters &= Q(idCredito__gt=after)
+    current_date = _parse_moment(params['date']) if 'date' in params else timezone.now()
+    return (
+        ListaCobroDetalle.objects.filter(filters)
+        .credit_scores(current_date, table)
+        .values_list(*scoring.SCORE_FIELDS)
+    )
+
+
+def _score_line(row, emisores):
+    score = dict(zip(scoring.SCORE_FIELDS, row))
+    score['idBanco'] = score.pop('banco')
+    score['idEmisor'] = emisores.get(score['emisionUsada'])
+    return json.dumps(score, cls=DjangoJSONEncoder) + '\n'
+
+
+def _score_lines(rows, emisores):
+    for row in rows:
+        yield _score_line(row, emisores)
+
+
+def _score_batch(page, emisores):
+    columns = arrow.columns(scoring.SCORE_FIELDS, page)
+    columns['idBanco'] = columns.pop('banco')
+    columns['idEmisor'] = [emisores.get(emision) for emision in columns['emisionUsada']]
+    return arrow.record_batch(arrow.score_schema(), columns)
+
+
+def _score_batches(rows, emisores):
+    """Record batches of up to DETAIL_PAGE_SIZE scored credits"""
+    rows = iter(rows)
+    while page := list(islice(rows, DETAIL_PAGE_SIZE)):
+        yield _score_batch(page, emisores)
+
+
+@cache_control(no_cache=True)
+@vary_on_headers('Accept')
+@scores_conditional
+def credit_scores(request):
+    """Stream one scored row per credit as NDJSON (default) or an Arrow stream, computed in SQL.
+
+    Query parameters: date (scoring date, default now) plus the
+    collection_details filters, which restrict the rows that are scored.
+    Credits come ordered by idCredito; emisionUsada and idEmisor are null
+    for credits no emission rule matches.
+    """
+    table = _decision_table(request)
+    try:
+        rows = _score_rows(request.GET, table)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    rows = rows.iterator(chunk_size=DETAIL_CURSOR_CHUNK)
+    if arrow.accepts_arrow(request, 'application/x-ndjson'):
+        return StreamingHttpResponse(
+            arrow.stream(arrow.score_schema(), _score_batches(rows, emisor_mapping(table))),
+            content_type=arrow.ARROW_STREAM,
         )
+    return StreamingHttpResponse(_score_lines(rows, emisor_mapping(table)), content_type='application/x-ndjson')
+
 
-    stats = {
-        '2022': list(get_yearly_stats(ListaCobroDetalle2022)),
-        '2023': list(get_yearly_stats(ListaCobroDetalle2023)),
-        '2024': list(get_yearly_stats(ListaCobroDetalle2024)),
-        '2025': list(get_yearly_stats(ListaCobroDetalle2025))
+def _credit_payload(id_credito, rows, current_date, table):
+    """Score, next emission and collection rows of one credit; None when it has no rows"""
+    if not rows:
+        return None
+    rows = [dict(zip(HISTORY_FIELDS, row), idCredito=id_credito) for row in rows]
+    credit = scoring.score_history(id_credito, rows, current_date, table)
+    credit['idBanco'] = credit.pop('banco')
+    emision = next((emision for emision in table['emisiones'] if emision['nombre'] == credit['emisionUsada']), None)
+    credit['idEmisor'] = emision['idEmisor'] if emision is not None else None
+    credit['emision'] = emision
+    credit['cobros'] = [{field: row[field] for field in DETAIL_FIELDS} for row in rows]
+    return credit
+
+
+def _credit_ids(params):
+    """ids query parameter: comma-separated idCredito values"""
+    ids = [int(value) for value in params.get('ids', '').split(',') if value.strip()]
+    if not ids:
+        raise ValueError("ids is required")
+    if len(ids) > CREDIT_BATCH_MAX:
+        raise ValueError(f"At most {CREDIT_BATCH_MAX} ids per request")
+    return ids
+
+
+def _credit_lookup(params, ids, table):
+    """{idCredito: _credit_payload} of ids, scored as of the date parameter (default now)"""
+    current_date = _parse_moment(params['date']) if 'date' in params else timezone.now()
+    return {
+        id_credito: _credit_payload(id_credito, rows, current_date, table)
+        for id_credito, rows in credit_histories(ids).items()
     }
 
-    return JsonResponse(stats)
\ No newline at end of file
+
+def _credit_response(credits, id_credito):
+    if credits[id_credito] is None:
+        return JsonResponse({'error': f"Unknown credit: {id_credito}"}, status=404)
+    return JsonResponse(credits[id_credito])
+
+
+def _credits_response(credits):
+    return JsonResponse({
+        'credits': [credit for credit in credits.values() if credit is not None],
+        'missing': [id_credito for id_credito, credit in credits.items() if credit is None],
+    })
+
+
+@cache_control(no_cache=True)
+@scores_conditional
+def credit_detail(request, id_credito):
+    """One credit's collection rows across all years with its score and next emission, as JSON.
+
+    The score fields are credit_scores', computed from the cached history
+    (cobranza/historial.py) as of the date parameter (default now); emision
+    is the emission's row of the decision table, null when no rule matches.
+    """
+    table = _decision_table(request)
+    try:
+        credits = _credit_lookup(request.GET, [id_credito], table)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return _credit_response(credits, id_credito)
+
+
+@cache_control(no_cache=True)
+@scores_conditional
+def credit_batch(request):
+    """credit_detail for the credits in ids (comma-separated, at most CREDIT_BATCH_MAX) in one response.
+
+    Credits come in the order asked for, under `credits`; ids without rows
+    are listed under `missing`.
+    """
+    table = _decision_table(request)
+    try:
+        credits = _credit_lookup(request.GET, _credit_ids(request.GET), table)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return _credits_response(credits)
+
+
+def _table_etag(request, *args, **kwargs):
+    return _decision_table(request)['tag']
+
+
+table_conditional = condition(etag_func=_table_etag)
+
+
+@cache_control(no_cache=True)
+@table_conditional
+def emission_table(request):
+    """The emission rules and fees (configuracion app) the scorers use, as JSON"""
+    return JsonResponse(_decision_table(request))
+
+
+def _metrics_allowed(request):
+    try:
+        address = ipaddress.ip_address(request.META['REMOTE_ADDR'])
+    except (KeyError, ValueError):
+        # No usable client address, e.g. behind some proxies or over a unix socket
+        return False
+    return any(address in allowed for allowed in settings.API_METRICS_ALLOWED_IPS)
+
+
+@cache_control(no_cache=True)
+def metrics(request):
+    """Request, SQL and response size metrics of this process, in Prometheus text format.
+
+    Only clients in API_METRICS_ALLOWED_IPS get them; others get a 404.
+    """
+    if not _metrics_allowed(request):
+        raise Http404
+    return HttpResponse(get_registry().render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,184 @@
+"""Per-credit collection history, cached for single-credit lookups.
+
+A credit's rows are read in (fechaCobroBanco, id) order, undated rows last,
+from the covering index on idCredito, so the table itself is not touched.
+Histories are kept in two tiers: a small LRU in each process and the shared
+Django cache, under CREDIT_CACHE_LOCAL_TTL and CREDIT_CACHE_TTL seconds.
+
+Shared entries are keyed by generation tokens, one per credit and one for
+all of them, read before the rows are. Every ORM and loader write replaces
+the tokens of the credits it touches once its transaction commits (or the
+global token, past CREDIT_CACHE_MAX_DROP credits), so a reader that loaded
+the rows before the commit stores them under a key no later reader asks
+for. This process's LRU is dropped too; other processes' LRUs expire after
+their short TTL, and the longer one bounds how long a write made outside
+Django stays unseen.
+"""
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+
+# Columns of a cached history row, in order (idCredito is the key)
+HISTORY_FIELDS = [
+    'id', 'idListaCobro', 'consecutivoCobro', 'idBanco', 'montoExigible',
+    'montoCobrar', 'montoCobrado', 'fechaCobroBanco', 'idRespuestaBanco',
+]
+
+HISTORY_ORDER = [F('fechaCobroBanco').asc(nulls_last=True), 'id']
+
+
+GENERATION_KEY = 'cobranza:historial:generacion'
+
+
+def _generation_key(id_credito):
+    return f'{GENERATION_KEY}:{id_credito}'
+
+
+def _cache_key(id_credito, generations):
+    return f'cobranza:historial:{generations[GENERATION_KEY]}:{id_credito}:{generations[_generation_key(id_credito)]}'
+
+
+def _new_generations(keys):
+    """Store fresh tokens under keys; a token is never reused, so what was cached under the old one is unreachable"""
+    generations = {key: uuid.uuid4().hex for key in keys}
+    # Losing a token to expiry or eviction only costs a miss
+    cache.set_many(generations, timeout=settings.CREDIT_CACHE_TTL)
+    return generations
+
+
+def _generations(ids):
+    """Current tokens of ids and of all credits, created where missing"""
+    keys = [GENERATION_KEY] + [_generation_key(id_credito) for id_credito in ids]
+    generations = cache.get_many(keys)
+    missing = [key for key in keys if key not in generations]
+    if missing:
+        generations.update(_new_generations(missing))
+    return generations
+
+
+class LRUCache:
+    """Thread-safe mapping of at most maxsize entries, each dropped ttl seconds after it was set"""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        # Advanced by every delete, so set_many can skip values read before one
+        self.generation = 0
+
+    def get_many(self, keys):
+        found = {}
+        now = time.monotonic()
+        with self.lock:
+            for key in keys:
+                entry = self.entries.get(key)
+                if entry is None:
+                    continue
+                if entry[0] <= now:
+                    del self.entries[key]
+                    continue
+                self.entries.move_to_end(key)
+                found[key] = entry[1]
+        return found
+
+    def set_many(self, values, generation=None):
+        """Store values, unless generation is given and a delete happened since it was read"""
+        expires = time.monotonic() + self.ttl
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+            for key, value in values.items():
+                self.entries[key] = (expires, value)
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def delete_many(self, keys):
+        with self.lock:
+            self.generation += 1
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+
+_local = LRUCache(settings.CREDIT_CACHE_SIZE, settings.CREDIT_CACHE_LOCAL_TTL)
+
+
+def read_histories(ids, using='default'):
+    """{idCredito: [row tuple, ...]} straight from the database; credits without rows are left out"""
+    from .models import ListaCobroDetalle
+
+    histories = {}
+    rows = (
+        ListaCobroDetalle.objects.using(using)
+        .filter(idCredito__in=ids)
+        .order_by('idCredito', *HISTORY_ORDER)
+        .values_list('idCredito', *HISTORY_FIELDS)
+    )
+    for id_credito, *row in rows:
+        histories.setdefault(id_credito, []).append(tuple(row))
+    return histories
+
+
+def credit_histories(ids):
+    """{idCredito: [row tuple, ...]} for ids, empty lists for credits without rows.
+
+    The LRU is checked first, then the shared cache; whatever neither holds
+    is read in one query and stored in both. Generations are read before
+    anything else, so rows read before a write committed are never stored
+    where a reader after it would find them.
+    """
+    ids = list(dict.fromkeys(ids))
+    local_generation = _local.generation
+    histories = _local.get_many(ids)
+    missing = [id_credito for id_credito in ids if id_credito not in histories]
+    if missing:
+        generations = _generations(missing)
+        keys = {id_credito: _cache_key(id_credito, generations) for id_credito in missing}
+        shared = cache.get_many(list(keys.values()))
+        found = {id_credito: shared[key] for id_credito, key in keys.items() if key in shared}
+        read = [id_credito for id_credito in missing if id_credito not in found]
+        if read:
+            loaded = read_histories(read)
+            loaded = {id_credito: loaded.get(id_credito, []) for id_credito in read}
+            cache.set_many({keys[id_credito]: rows for id_credito, rows in loaded.items()},
+                           timeout=settings.CREDIT_CACHE_TTL)
+            found.update(loaded)
+        _local.set_many(found, generation=local_generation)
+        histories.update(found)
+    return {id_credito: histories[id_credito] for id_credito in ids}
+
+
+def drop_histories(ids=None):
+    """Drop the cached histories of ids, or of every credit when ids is None"""
+    if ids is None:
+        _new_generations([GENERATION_KEY])
+        _local.clear()
+        return
+    ids = set(ids)
+    _new_generations([_generation_key(id_credito) for id_credito in ids])
+    _local.delete_many(ids)
+
+
+def invalidate_credits(ids, using='default'):
+    """Drop the cached histories of ids (None: every credit) when the current transaction commits"""
+    if ids is not None:
+        ids = {id_credito for id_credito in ids if id_credito is not None}
+        if not ids:
+            return
+        if len(ids) > settings.CREDIT_CACHE_MAX_DROP:
+            ids = None
+    # Dropping them before commit would let a concurrent reader re-cache the old rows
+    transaction.on_commit(partial(drop_histories, ids), using=using)
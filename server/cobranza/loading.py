@@ -0,0 +1,284 @@
+"""Parsing and batch writing for the load_cobranza command.
+
+Input files are read as bytes, one record at a time, so the byte offset
+after every record is known and a load can resume from any batch boundary.
+"""
+import csv
+import hashlib
+import io
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from django.db import connections, transaction
+from django.utils import timezone
+
+from .historial import invalidate_credits
+from .models import CobranzaMensual, ListaCobroDetalle, VersionDatos
+from .partitions import (
+    PARENT_TABLE, create_year_partition, existing_partitions, is_partitioned, partition_table, partition_year
+)
+
+# Columns written by COPY, in order
+LOAD_COLUMNS = [
+    'idListaCobro', 'idCredito', 'consecutivoCobro', 'idBanco', 'montoExigible',
+    'montoCobrar', 'montoCobrado', 'fechaCobroBanco', 'idRespuestaBanco',
+]
+REQUIRED_COLUMNS = ['idListaCobro', 'idCredito', 'consecutivoCobro', 'idBanco', 'montoExigible', 'montoCobrar']
+AMOUNT_COLUMNS = ['montoExigible', 'montoCobrar', 'montoCobrado']
+INT_COLUMNS = ['idListaCobro', 'idCredito', 'idBanco']
+
+# DecimalField(max_digits=10, decimal_places=2)
+CENT = Decimal('0.01')
+MAX_AMOUNT = Decimal('99999999.99')
+
+# Default layout of fixed-width bank result files: (column, start, end)
+# offsets, amounts in cents and dates as YYYYMMDDHHMMSS. Override with
+# --layout pointing to a JSON file with the same keys.
+FIXED_WIDTH_LAYOUT = {
+    'fields': [
+        ['idListaCobro', 0, 10],
+        ['idCredito', 10, 20],
+        ['consecutivoCobro', 20, 30],
+        ['idBanco', 30, 34],
+        ['montoExigible', 34, 46],
+        ['montoCobrar', 46, 58],
+        ['montoCobrado', 58, 70],
+        ['fechaCobroBanco', 70, 84],
+        ['idRespuestaBanco', 84, 88],
+    ],
+    'implied_decimals': 2,
+    'date_format': '%Y%m%d%H%M%S',
+}
+
+
+class RowError(ValueError):
+    """A record that cannot be loaded"""
+
+
+def file_fingerprint(path, size=None):
+    """Size plus a hash of the whole file (or of its first `size` bytes), stable across runs"""
+    if size is None:
+        size = os.path.getsize(path)
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        remaining = size
+        while remaining:
+            chunk = f.read(min(remaining, 2**20))
+            if not chunk:
+                break
+            digest.update(chunk)
+            remaining -= len(chunk)
+    return f'{size}-{digest.hexdigest()}'
+
+
+def appended_load(path, cargas):
+    """The completed load of which the file at path is a copy with records appended, if any"""
+    size = os.path.getsize(path)
+    for carga in cargas:
+        loaded_size = int(carga.huella.partition('-')[0])
+        if not 0 < loaded_size < size:
+            continue
+        with open(path, 'rb') as f:
+            f.seek(loaded_size - 1)
+            # A last line without its newline may have been extended in place
+            if f.read(1) != b'\n':
+                continue
+        if file_fingerprint(path, loaded_size) == carga.huella:
+            return carga
+    return None
+
+
+def load_layout(path=None):
+    if path is None:
+        return FIXED_WIDTH_LAYOUT
+    with open(path) as f:
+        layout = json.load(f)
+    return {**FIXED_WIDTH_LAYOUT, **layout}
+
+
+class _CountingLines:
+    """Binary line iterator that decodes lines and tracks the bytes consumed"""
+
+    def __init__(self, f, encoding):
+        self.f = f
+        self.encoding = encoding
+        self.offset = f.tell()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.f.readline()
+        if not line:
+            raise StopIteration
+        self.offset += len(line)
+        return line.decode(self.encoding)
+
+
+def read_csv(f, encoding='utf-8', delimiter=',', start=0):
+    """Yield (offset after record, {column: text}) for a CSV file with a header row"""
+    lines = _CountingLines(f, encoding)
+    header = next(csv.reader([next(lines)], delimiter=delimiter))
+    header = [name.strip().lstrip('\ufeff') for name in header]
+    missing = [name for name in REQUIRED_COLUMNS if name not in header]
+    if missing:
+        raise RowError(f"CSV header lacks required columns: {', '.join(missing)}")
+    if start > lines.offset:
+        f.seek(start)
+        lines.offset = start
+    for values in csv.reader(lines, delimiter=delimiter):
+        if values:
+            yield lines.offset, dict(zip(header, values))
+
+
+def read_fixed_width(f, layout, encoding='utf-8', start=0):
+    """Yield (offset after record, {column: text}) for a fixed-width file"""
+    f.seek(start)
+    lines = _CountingLines(f, encoding)
+    fields = layout['fields']
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if line.strip():
+            yield lines.offset, {name: line[begin:end].strip() for name, begin, end in fields}
+
+
+def parse_amount(text, implied_decimals=0):
+    try:
+        amount = Decimal(text)
+    except InvalidOperation:
+        raise RowError(f"invalid amount {text!r}")
+    if not amount.is_finite():
+        raise RowError(f"invalid amount {text!r}")
+    if implied_decimals:
+        amount = amount.scaleb(-implied_decimals)
+    cents = amount.quantize(CENT)
+    if cents != amount:
+        raise RowError(f"amount {text!r} has more than 2 decimals")
+    if abs(cents) > MAX_AMOUNT:
+        raise RowError(f"amount {text!r} out of range")
+    return cents
+
+
+def parse_fecha(text, date_format=None, tz=None):
+    """Aware datetime; naive values are taken to be in tz (default: the current time zone)"""
+    try:
+        if date_format:
+            fecha = datetime.strptime(text, date_format)
+        else:
+            fecha = datetime.fromisoformat(text.replace('Z', '+00:00'))
+    except ValueError:
+        raise RowError(f"invalid date {text!r}")
+    if fecha.tzinfo is None:
+        fecha = fecha.replace(tzinfo=tz or timezone.get_current_timezone())
+    return fecha
+
+
+def convert(record, implied_decimals=0, date_format=None, tz=None):
+    """Typed LOAD_COLUMNS values of one input record"""
+    for name in REQUIRED_COLUMNS:
+        if not record.get(name):
+            raise RowError(f"{name} is empty")
+    row = {}
+    for name in INT_COLUMNS:
+        try:
+            row[name] = int(record[name])
+        except ValueError:
+            raise RowError(f"invalid {name} {record[name]!r}")
+    row['consecutivoCobro'] = record['consecutivoCobro']
+    row['montoExigible'] = parse_amount(record['montoExigible'], implied_decimals)
+    row['montoCobrar'] = parse_amount(record['montoCobrar'], implied_decimals)
+    row['montoCobrado'] = parse_amount(record.get('montoCobrado') or '0', implied_decimals)
+    fecha = record.get('fechaCobroBanco')
+    row['fechaCobroBanco'] = parse_fecha(fecha, date_format, tz) if fecha else None
+    row['idRespuestaBanco'] = record.get('idRespuestaBanco') or None
+    return row
+
+
+def _copy_rows(connection, rows):
+    """COPY rows into the partitioned table, creating missing yearly partitions first"""
+    if is_partitioned(connection):
+        years = {partition_year(row['fechaCobroBanco']) for row in rows if row['fechaCobroBanco'] is not None}
+        existing = existing_partitions(connection)
+        for year in sorted(year for year in years if partition_table(year) not in existing):
+            create_year_partition(connection, year)
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerows(
+        [row[name].isoformat() if name == 'fechaCobroBanco' and row[name] is not None else row[name]
+         for name in LOAD_COLUMNS]
+        for row in rows
+    )
+    buffer.seek(0)
+    columns = ', '.join(f'"{name}"' for name in LOAD_COLUMNS)
+    with connection.cursor() as cursor:
+        cursor.copy_expert(f'COPY "{PARENT_TABLE}" ({columns}) FROM STDIN WITH (FORMAT csv)', buffer)
+
+
+def write_batch(connection, rows, carga, posicion, registro, rechazadas):
+    """Insert one batch and advance the load's checkpoint in the same transaction"""
+    with transaction.atomic(using=connection.alias):
+        if connection.vendor == 'postgresql':
+            _copy_rows(connection, rows)
+            CobranzaMensual.objects.using(connection.alias).add_rows(rows)
+            invalidate_credits({row['idCredito'] for row in rows}, connection.alias)
+            VersionDatos.bump(connection.alias)
+        else:
+            # bulk_create keeps the rollup and data version current itself
+            ListaCobroDetalle.objects.using(connection.alias).bulk_create(
+                [ListaCobroDetalle(**row) for row in rows]
+            )
+        carga.posicion = posicion
+        carga.registro = registro
+        carga.filas += len(rows)
+        carga.rechazadas = rechazadas
+        carga.save(using=connection.alias)
+
+
+class BatchWriter:
+    """Commits batches with write_batch() on a background thread.
+
+    Batches are written one at a time and in order, while the caller parses
+    the next one; COPY and the commit release the GIL, so parsing and
+    database work overlap. The thread uses its own database connection,
+    closed by close().
+    """
+
+    def __init__(self, carga, using='default', on_commit=None):
+        self.carga = carga
+        self.using = using
+        self.on_commit = on_commit
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='load-cobranza')
+        self.pending = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def _write(self, rows, posicion, registro, rechazadas):
+        write_batch(connections[self.using], rows, self.carga, posicion, registro, rechazadas)
+        if self.on_commit is not None:
+            self.on_commit(self.carga)
+
+    def submit(self, rows, posicion, registro, rechazadas):
+        """Queue a batch once the previous one is committed; re-raises its error"""
+        self.wait()
+        self.pending = self.executor.submit(self._write, rows, posicion, registro, rechazadas)
+
+    def wait(self):
+        if self.pending is not None:
+            pending, self.pending = self.pending, None
+            pending.result()
+
+    def close(self):
+        try:
+            self.wait()
+        finally:
+            self.executor.submit(connections.close_all).result()
+            self.executor.shutdown()
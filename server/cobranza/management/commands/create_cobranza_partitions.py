@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from cobranza.partitions import (
+    PARENT_TABLE, create_year_partition, existing_partitions, is_partitioned, partition_table
+)
+
+
+class Command(BaseCommand):
+    help = "Create yearly ListaCobroDetalle partitions ahead of time (PostgreSQL)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--years-ahead', type=int, default=1,
+            help='Create partitions up to this many years after the current one (default: 1)'
+        )
+        parser.add_argument(
+            '--from-year', type=int,
+            help='First year to check (default: the current year)'
+        )
+
+    def handle(self, *args, **options):
+        if not is_partitioned(connection):
+            raise CommandError(f'"{PARENT_TABLE}" is not a partitioned PostgreSQL table')
+
+        first_year = options['from_year'] or timezone.now().year
+        last_year = timezone.now().year + options['years_ahead']
+        existing = existing_partitions(connection)
+
+        for year in range(first_year, last_year + 1):
+            if partition_table(year) in existing:
+                self.stdout.write(f"{partition_table(year)} already exists")
+                continue
+            with transaction.atomic():
+                table = create_year_partition(connection, year)
+            self.stdout.write(self.style.SUCCESS(f"Created {table}"))
@@ -0,0 +1,127 @@
+import time
+from collections import deque
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from cobranza.loading import (
+    BatchWriter, RowError, appended_load, convert, file_fingerprint, load_layout, read_csv, read_fixed_width
+)
+from cobranza.models import CargaCobranza
+
+
+class Command(BaseCommand):
+    help = "Load a bank collection result file (CSV or fixed-width) into ListaCobroDetalle"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to load')
+        parser.add_argument('--format', choices=['csv', 'fixed'], default='csv')
+        parser.add_argument('--layout', help='JSON fixed-width layout (default: cobranza.loading.FIXED_WIDTH_LAYOUT)')
+        parser.add_argument('--encoding', default='utf-8')
+        parser.add_argument('--delimiter', default=',', help='CSV delimiter (default: ,)')
+        parser.add_argument(
+            '--batch-size', type=int, default=50_000,
+            help='Rows per COPY and per committed checkpoint (default: 50000)'
+        )
+        parser.add_argument(
+            '--max-errors', type=int, default=0,
+            help='Invalid records to skip before aborting (default: 0)'
+        )
+        parser.add_argument(
+            '--rejects',
+            help='Append skipped records and their errors to this file, as their batches are committed'
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        try:
+            huella = file_fingerprint(path)
+        except OSError as e:
+            raise CommandError(f"Cannot read {path}: {e}")
+
+        defaults = {'archivo': path, 'formato': options['format']}
+        previa = None
+        if not CargaCobranza.objects.filter(huella=huella).exists():
+            # A file that only grew since it was loaded continues where that load ended
+            previa = appended_load(path, CargaCobranza.objects.filter(
+                archivo=path, formato=options['format'], completada=True
+            ).order_by('-posicion'))
+            if previa is not None:
+                defaults.update(posicion=previa.posicion, registro=previa.registro,
+                                filas=previa.filas, rechazadas=previa.rechazadas)
+        carga, created = CargaCobranza.objects.get_or_create(huella=huella, defaults=defaults)
+        if carga.completada:
+            self.stdout.write(f"{path} was already loaded ({carga.filas:,} rows)")
+            return
+        if created and previa is not None:
+            self.stdout.write(f"Loading records appended to {path} after {carga.filas:,} rows (byte {carga.posicion:,})")
+        elif not created:
+            self.stdout.write(f"Resuming {path} after {carga.filas:,} rows (byte {carga.posicion:,})")
+
+        layout = load_layout(options['layout'])
+        implied_decimals = layout['implied_decimals'] if options['format'] == 'fixed' else 0
+        date_format = layout['date_format'] if options['format'] == 'fixed' else None
+        tz = timezone.get_current_timezone()
+        rejects = open(options['rejects'], 'a', encoding='utf-8') if options['rejects'] else None
+
+        loaded_at_start = carga.filas
+        start = time.perf_counter()
+        # Reject lines of each submitted batch; written once the batch commits,
+        # so records read again after a resume are not rejected twice
+        rejected = deque()
+
+        def report(carga):
+            lines = rejected.popleft()
+            if rejects is not None:
+                rejects.writelines(lines)
+                rejects.flush()
+            rows = carga.filas - loaded_at_start
+            self.stdout.write(
+                f"{carga.filas:,} rows committed ({rows / (time.perf_counter() - start):,.0f} rows/s)"
+            )
+
+        registro = carga.registro
+        rechazadas = carga.rechazadas
+        try:
+            with open(path, 'rb') as f, BatchWriter(carga, on_commit=report) as writer:
+                if options['format'] == 'csv':
+                    records = read_csv(f, options['encoding'], options['delimiter'], start=carga.posicion)
+                else:
+                    records = read_fixed_width(f, layout, options['encoding'], start=carga.posicion)
+                batch = []
+                batch_rejects = []
+                posicion = carga.posicion
+                for posicion, record in records:
+                    registro += 1
+                    try:
+                        batch.append(convert(record, implied_decimals, date_format, tz))
+                    except RowError as e:
+                        rechazadas += 1
+                        batch_rejects.append(f"{path}\trecord {registro}\t{e}\t{record}\n")
+                        if rechazadas > options['max_errors']:
+                            raise CommandError(f"Record {registro}: {e}")
+                        continue
+                    if len(batch) == options['batch_size']:
+                        rejected.append(batch_rejects)
+                        writer.submit(batch, posicion, registro, rechazadas)
+                        batch, batch_rejects = [], []
+                writer.wait()
+                if batch or registro != carga.registro:
+                    rejected.append(batch_rejects)
+                    writer.submit(batch, posicion, registro, rechazadas)
+        except RowError as e:
+            raise CommandError(str(e))
+        except UnicodeDecodeError as e:
+            raise CommandError(f"Record {registro + 1}: {e}; check --encoding")
+        finally:
+            if rejects is not None:
+                rejects.close()
+
+        carga.completada = True
+        carga.save()
+        elapsed = time.perf_counter() - start
+        rows = carga.filas - loaded_at_start
+        self.stdout.write(self.style.SUCCESS(
+            f"Loaded {rows:,} rows in {elapsed:.1f}s ({rows / elapsed:,.0f} rows/s), "
+            f"{rechazadas:,} rejected"
+        ))
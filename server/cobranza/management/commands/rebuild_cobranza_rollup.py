@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from cobranza.models import CobranzaMensual
+
+
+class Command(BaseCommand):
+    help = "Recompute the CobranzaMensual rollup from ListaCobroDetalle"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--year', type=int, action='append', dest='years',
+            help='Only rebuild this year (repeatable; default: every year)'
+        )
+
+    def handle(self, *args, **options):
+        months = CobranzaMensual.objects.rebuild(options['years'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {months} monthly bank totals"))
@@ -0,0 +1,215 @@
+from datetime import datetime, timezone
+
+from django.db import migrations, models
+
+PARENT_TABLE = 'ListaCobroDetalle'
+DEFAULT_PARTITION = 'ListaCobroDetalle_default'
+YEARLY_TABLES = {
+    2022: 'ListaCobroDetalle2022',
+    2023: 'ListaCobroDetalle2023',
+    2024: 'ListaCobroDetalle2024',
+    2025: 'ListaCobroDetalle2025',
+}
+COLUMNS = [
+    'idListaCobro', 'idCredito', 'consecutivoCobro', 'idBanco', 'montoExigible',
+    'montoCobrar', 'montoCobrado', 'fechaCobroBanco', 'idRespuestaBanco',
+]
+
+
+def partition_postgresql(cursor):
+    """Turn the yearly tables into partitions of a new range-partitioned parent"""
+    cursor.execute(
+        f'CREATE TABLE "{PARENT_TABLE}" (LIKE "{YEARLY_TABLES[2022]}") '
+        f'PARTITION BY RANGE ("fechaCobroBanco")'
+    )
+    cursor.execute(f'CREATE SEQUENCE "{PARENT_TABLE}_id_seq" OWNED BY "{PARENT_TABLE}".id')
+    cursor.execute(
+        f'ALTER TABLE "{PARENT_TABLE}" ALTER COLUMN id '
+        f'SET DEFAULT nextval(\'"{PARENT_TABLE}_id_seq"\')'
+    )
+    cursor.execute(f'CREATE TABLE "{DEFAULT_PARTITION}" PARTITION OF "{PARENT_TABLE}" (PRIMARY KEY (id)) DEFAULT')
+
+    last_id = 0
+    for year, table in YEARLY_TABLES.items():
+        lower = f'{year}-01-01T00:00:00+00:00'
+        upper = f'{year + 1}-01-01T00:00:00+00:00'
+
+        # Every yearly table numbered its rows from 1; shift ids so they stay
+        # unique across partitions and Django can keep using id as the key
+        cursor.execute(f'SELECT MIN(id), MAX(id) FROM "{table}"')
+        min_id, max_id = cursor.fetchone()
+        if min_id is not None and min_id <= last_id:
+            shift = last_id - min_id + 1
+            cursor.execute(
+                "SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(%s) AND contype = 'p'",
+                [f'"{table}"']
+            )
+            primary_key = cursor.fetchone()[0]
+            cursor.execute(f'ALTER TABLE "{table}" DROP CONSTRAINT "{primary_key}"')
+            cursor.execute(f'UPDATE "{table}" SET id = id + %s', [shift])
+            cursor.execute(f'ALTER TABLE "{table}" ADD PRIMARY KEY (id)')
+            max_id += shift
+        if max_id is not None:
+            last_id = max(last_id, max_id)
+
+        # New ids come from the parent's sequence from now on
+        cursor.execute(f'ALTER TABLE "{table}" ALTER COLUMN id DROP IDENTITY IF EXISTS')
+        cursor.execute(f'ALTER TABLE "{table}" ALTER COLUMN id DROP DEFAULT')
+
+        # Undated rows and rows dated outside the table's year go to the default partition
+        cursor.execute(
+            f'''
+            WITH moved AS (
+                DELETE FROM "{table}"
+                WHERE "fechaCobroBanco" IS NULL
+                   OR "fechaCobroBanco" < %s OR "fechaCobroBanco" >= %s
+                RETURNING *
+            )
+            INSERT INTO "{DEFAULT_PARTITION}" SELECT * FROM moved
+            ''',
+            [lower, upper]
+        )
+        # Rows of this year that earlier tables moved to the default partition
+        # come back first, otherwise the attach is rejected
+        cursor.execute(
+            f'''
+            WITH moved AS (
+                DELETE FROM "{DEFAULT_PARTITION}"
+                WHERE "fechaCobroBanco" >= %s AND "fechaCobroBanco" < %s
+                RETURNING *
+            )
+            INSERT INTO "{table}" SELECT * FROM moved
+            ''',
+            [lower, upper]
+        )
+        cursor.execute(
+            f'ALTER TABLE "{PARENT_TABLE}" ATTACH PARTITION "{table}" '
+            f"FOR VALUES FROM ('{lower}') TO ('{upper}')"
+        )
+
+    cursor.execute(
+        "SELECT setval(%s, %s, %s)",
+        [f'"{PARENT_TABLE}_id_seq"', max(last_id, 1), last_id > 0]
+    )
+
+
+def split_postgresql(cursor):
+    """Undo partition_postgresql: detach the yearly tables and drop the parent.
+
+    Rows outside the yearly tables' years (the default partition and any
+    later yearly partitions) go to the nearest year's table, undated rows to
+    the last one. Ids stay as they are; each table numbers new rows after
+    its highest id again.
+    """
+    years = list(YEARLY_TABLES)
+    for table in YEARLY_TABLES.values():
+        cursor.execute(f'ALTER TABLE "{PARENT_TABLE}" DETACH PARTITION "{table}"')
+    cursor.execute(
+        f'INSERT INTO "{YEARLY_TABLES[years[0]]}" SELECT * FROM "{PARENT_TABLE}" WHERE "fechaCobroBanco" < %s',
+        [f'{years[0]}-01-01T00:00:00+00:00']
+    )
+    cursor.execute(
+        f'INSERT INTO "{YEARLY_TABLES[years[-1]]}" SELECT * FROM "{PARENT_TABLE}" '
+        f'WHERE "fechaCobroBanco" >= %s OR "fechaCobroBanco" IS NULL',
+        [f'{years[-1]}-01-01T00:00:00+00:00']
+    )
+    for table in YEARLY_TABLES.values():
+        cursor.execute(f'ALTER TABLE "{table}" ALTER COLUMN id ADD GENERATED BY DEFAULT AS IDENTITY')
+        cursor.execute(
+            f'SELECT setval(pg_get_serial_sequence(%s, \'id\'), COALESCE(MAX(id), 1), MAX(id) IS NOT NULL) '
+            f'FROM "{table}"',
+            [f'"{table}"']
+        )
+    # The default and later yearly partitions go with it
+    cursor.execute(f'DROP TABLE "{PARENT_TABLE}"')
+
+
+def merge_yearly_tables(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            partition_postgresql(cursor)
+        return
+
+    # Other backends (tests, local SQLite) get a plain table with the same rows
+    schema_editor.create_model(apps.get_model('cobranza', 'ListaCobroDetalle'))
+    qn = schema_editor.quote_name
+    columns = ', '.join(qn(column) for column in COLUMNS)
+    for table in YEARLY_TABLES.values():
+        schema_editor.execute(
+            f'INSERT INTO {qn(PARENT_TABLE)} ({columns}) '
+            f'SELECT {columns} FROM {qn(table)} ORDER BY id'
+        )
+        schema_editor.execute(f'DROP TABLE {qn(table)}')
+
+
+def split_into_yearly_tables(apps, schema_editor):
+    """Reverse of merge_yearly_tables; rows go to their year's table, as split_postgresql places them"""
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            split_postgresql(cursor)
+        return
+
+    qn = schema_editor.quote_name
+    columns = ', '.join(qn(column) for column in ['id'] + COLUMNS)
+    years = list(YEARLY_TABLES)
+    for year, table in YEARLY_TABLES.items():
+        schema_editor.create_model(apps.get_model('cobranza', table))
+        conditions, params = [], []
+        if year != years[0]:
+            conditions.append(f'{qn("fechaCobroBanco")} >= %s')
+            params.append(connection.ops.adapt_datetimefield_value(datetime(year, 1, 1, tzinfo=timezone.utc)))
+        if year != years[-1]:
+            conditions.append(f'{qn("fechaCobroBanco")} < %s')
+            params.append(connection.ops.adapt_datetimefield_value(datetime(year + 1, 1, 1, tzinfo=timezone.utc)))
+        where = ' AND '.join(conditions)
+        if year == years[-1]:
+            where = f'{where} OR {qn("fechaCobroBanco")} IS NULL'
+        schema_editor.execute(
+            f'INSERT INTO {qn(table)} ({columns}) SELECT {columns} FROM {qn(PARENT_TABLE)} WHERE {where} ORDER BY id',
+            params
+        )
+    schema_editor.delete_model(apps.get_model('cobranza', 'ListaCobroDetalle'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cobranza', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='ListaCobroDetalle',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('idListaCobro', models.IntegerField()),
+                        ('idCredito', models.IntegerField()),
+                        ('consecutivoCobro', models.CharField(max_length=20)),
+                        ('idBanco', models.IntegerField()),
+                        ('montoExigible', models.DecimalField(decimal_places=2, max_digits=10)),
+                        ('montoCobrar', models.DecimalField(decimal_places=2, max_digits=10)),
+                        ('montoCobrado', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                        ('fechaCobroBanco', models.DateTimeField(blank=True, null=True)),
+                        ('idRespuestaBanco', models.CharField(blank=True, max_length=20, null=True)),
+                    ],
+                    options={
+                        'db_table': 'ListaCobroDetalle',
+                    },
+                ),
+            ],
+        ),
+        migrations.RunPython(merge_yearly_tables, split_into_yearly_tables, elidable=False),
+        # On PostgreSQL the yearly tables live on as partitions of ListaCobroDetalle
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.DeleteModel(name='ListaCobroDetalle2022'),
+                migrations.DeleteModel(name='ListaCobroDetalle2023'),
+                migrations.DeleteModel(name='ListaCobroDetalle2024'),
+                migrations.DeleteModel(name='ListaCobroDetalle2025'),
+            ],
+        ),
+    ]
@@ -0,0 +1,40 @@
+from django.db import migrations, models
+
+BRIN_INDEX = 'cobro_fecha_brin'
+
+
+def create_brin_index(apps, schema_editor):
+    # Rows arrive roughly in fechaCobroBanco order, so a BRIN index answers
+    # date-range scans for a few pages of storage. PostgreSQL only.
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            f'CREATE INDEX "{BRIN_INDEX}" ON "ListaCobroDetalle" USING brin ("fechaCobroBanco")'
+        )
+
+
+def drop_brin_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(f'DROP INDEX IF EXISTS "{BRIN_INDEX}"')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cobranza', '0002_listacobrodetalle'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='listacobrodetalle',
+            index=models.Index(fields=['idCredito', 'fechaCobroBanco'], name='cobro_credito_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='listacobrodetalle',
+            index=models.Index(fields=['idBanco', 'fechaCobroBanco'], name='cobro_banco_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='listacobrodetalle',
+            index=models.Index(fields=['fechaCobroBanco', 'id'], name='cobro_fecha_id_idx'),
+        ),
+        migrations.RunPython(create_brin_index, drop_brin_index),
+    ]
@@ -0,0 +1,59 @@
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Case, Count, DecimalField, F, Sum, Value, When
+from django.db.models.functions import ExtractMonth, ExtractYear
+
+
+def fill_rollup(apps, schema_editor):
+    # Same aggregation as ListaCobroDetalleQuerySet.monthly_totals()
+    ListaCobroDetalle = apps.get_model('cobranza', 'ListaCobroDetalle')
+    CobranzaMensual = apps.get_model('cobranza', 'CobranzaMensual')
+    eficiencia = Case(
+        When(montoCobrar=0, then=Value(Decimal(0))),
+        default=F('montoCobrado') * Decimal(100) / F('montoCobrar'),
+        output_field=DecimalField(max_digits=30, decimal_places=10),
+    )
+    totals = (
+        ListaCobroDetalle.objects
+        .filter(fechaCobroBanco__isnull=False)
+        .annotate(year=ExtractYear('fechaCobroBanco'), month=ExtractMonth('fechaCobroBanco'))
+        .values('year', 'month', 'idBanco')
+        .annotate(
+            # Before montoCobrar/montoCobrado, whose sums shadow the columns
+            sumaEficiencia=Sum(eficiencia),
+            registros=Count('id'),
+            montoCobrar=Sum('montoCobrar'),
+            montoCobrado=Sum('montoCobrado'),
+        )
+        .order_by()
+    )
+    CobranzaMensual.objects.bulk_create(CobranzaMensual(**total) for total in totals)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cobranza', '0003_listacobrodetalle_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CobranzaMensual',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.IntegerField()),
+                ('month', models.IntegerField()),
+                ('idBanco', models.IntegerField()),
+                ('registros', models.IntegerField(default=0)),
+                ('montoCobrar', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('montoCobrado', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('sumaEficiencia', models.DecimalField(decimal_places=10, default=0, max_digits=30)),
+            ],
+            options={
+                'db_table': 'CobranzaMensual',
+                'constraints': [models.UniqueConstraint(fields=('year', 'month', 'idBanco'), name='cobranza_mensual_key')],
+            },
+        ),
+        migrations.RunPython(fill_rollup, migrations.RunPython.noop),
+    ]
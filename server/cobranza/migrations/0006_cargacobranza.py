@@ -0,0 +1,30 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cobranza', '0005_versiondatos'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CargaCobranza',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('archivo', models.CharField(max_length=500)),
+                ('huella', models.CharField(max_length=80, unique=True)),
+                ('formato', models.CharField(max_length=10)),
+                ('posicion', models.BigIntegerField(default=0)),
+                ('registro', models.BigIntegerField(default=0)),
+                ('filas', models.BigIntegerField(default=0)),
+                ('rechazadas', models.BigIntegerField(default=0)),
+                ('completada', models.BooleanField(default=False)),
+                ('iniciada', models.DateTimeField(auto_now_add=True)),
+                ('actualizada', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'CargaCobranza',
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cobranza', '0006_cargacobranza'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='listacobrodetalle',
+            index=models.Index(
+                fields=['idCredito', 'fechaCobroBanco', 'id'],
+                include=('idListaCobro', 'consecutivoCobro', 'idBanco', 'montoExigible', 'montoCobrar',
+                         'montoCobrado', 'idRespuestaBanco'),
+                name='cobro_credito_historial_idx',
+            ),
+        ),
+        migrations.RemoveIndex(
+            model_name='listacobrodetalle',
+            name='cobro_credito_fecha_idx',
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cobranza', '0007_listacobrodetalle_historial_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='versiondatos',
+            name='ediciones',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -1,6 +1,145 @@
-from django.db import models
+from datetime import datetime
+from decimal import Decimal
+from functools import partial
 
-class ListaCobroDetalle2022(models.Model):
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import Case, Count, DecimalField, F, Max, Min, Q, Sum, Value, When
+from django.db.models.functions import ExtractMonth, ExtractYear
+from django.utils import timezone
+
+from .historial import invalidate_credits
+from .partitions import year_bounds
+from .scoring import credit_scores
+
+# Detail columns that feed the monthly rollup
+ROLLUP_FIELDS = ['idBanco', 'montoCobrar', 'montoCobrado', 'fechaCobroBanco']
+
+EFICIENCIA_FIELD = DecimalField(max_digits=30, decimal_places=10)
+# Per-row efficiency in percent; rows with nothing to collect count as 0
+EFICIENCIA = Case(
+    When(montoCobrar=0, then=Value(Decimal(0))),
+    default=F('montoCobrado') * Decimal(100) / F('montoCobrar'),
+    output_field=EFICIENCIA_FIELD,
+)
+
+
+def rollup_key(row, tz=None):
+    """(year, month, idBanco) a detail row is counted under, None when undated"""
+    fecha = row['fechaCobroBanco']
+    if fecha is None:
+        return None
+    fecha = fecha.astimezone(tz or timezone.get_current_timezone())
+    return fecha.year, fecha.month, row['idBanco']
+
+
+def month_bounds(year, month):
+    """Inclusive lower and exclusive upper fechaCobroBanco bound for a month"""
+    tz = timezone.get_current_timezone()
+    upper = (year + 1, 1) if month == 12 else (year, month + 1)
+    return datetime(year, month, 1, tzinfo=tz), datetime(*upper, 1, tzinfo=tz)
+
+
+class ListaCobroDetalleQuerySet(models.QuerySet):
+
+    def for_year(self, year):
+        """Rows dated in `year`; a range filter, so PostgreSQL prunes other partitions"""
+        lower, upper = year_bounds(year)
+        return self.filter(fechaCobroBanco__gte=lower, fechaCobroBanco__lt=upper)
+
+    def years(self):
+        """Years spanned by the dated rows, oldest first"""
+        bounds = self.aggregate(first=Min('fechaCobroBanco'), last=Max('fechaCobroBanco'))
+        if bounds['first'] is None:
+            return []
+        return list(range(bounds['first'].year, bounds['last'].year + 1))
+
+    def monthly_totals(self):
+        """Rollup sums of these rows grouped by (year, month, idBanco)"""
+        return (
+            self.filter(fechaCobroBanco__isnull=False)
+            .annotate(year=ExtractYear('fechaCobroBanco'), month=ExtractMonth('fechaCobroBanco'))
+            .values('year', 'month', 'idBanco')
+            .annotate(
+                # Before montoCobrar/montoCobrado, whose sums shadow the columns
+                sumaEficiencia=Sum(EFICIENCIA),
+                registros=Count('id'),
+                montoCobrar=Sum('montoCobrar'),
+                montoCobrado=Sum('montoCobrado'),
+            )
+            .order_by()
+        )
+
+    def credit_scores(self, current_date, table=None):
+        """One scored row per credit, see cobranza.scoring"""
+        return credit_scores(self, current_date, table)
+
+    def bulk_create(self, objs, *args, **kwargs):
+        with transaction.atomic(using=self.db):
+            created = super().bulk_create(objs, *args, **kwargs)
+            rollup = CobranzaMensual.objects.using(self.db)
+            conflicts = bool(kwargs.get('ignore_conflicts') or kwargs.get('update_conflicts'))
+            if conflicts:
+                # Which rows were written is unknown; recount their months
+                rollup.refresh({rollup_key(obj.rollup_row()) for obj in created} - {None})
+            else:
+                rollup.add_rows(obj.rollup_row() for obj in created)
+            invalidate_credits({obj.idCredito for obj in created}, self.db)
+            VersionDatos.bump(self.db, edit=conflicts)
+        return created
+
+    def _credits(self, kwargs):
+        """idCredito of the rows an update with kwargs touches, before and after it.
+
+        None when there are more than CREDIT_CACHE_MAX_DROP of them: every
+        history is dropped then, and the LIMIT spares listing them all.
+        """
+        limit = settings.CREDIT_CACHE_MAX_DROP
+        credits = set(self.order_by().values_list('idCredito', flat=True).distinct()[:limit + 1])
+        if len(credits) > limit:
+            return None
+        if isinstance(kwargs.get('idCredito'), int):
+            credits.add(kwargs['idCredito'])
+        return credits
+
+    def update(self, **kwargs):
+        if not set(kwargs) & set(ROLLUP_FIELDS):
+            with transaction.atomic(using=self.db):
+                invalidate_credits(self._credits(kwargs), self.db)
+                updated = super().update(**kwargs)
+                VersionDatos.bump(self.db, edit=True)
+            return updated
+        with transaction.atomic(using=self.db):
+            pks = list(self.values_list('pk', flat=True))
+            keys = CobranzaMensual.keys_of(self)
+            invalidate_credits(self._credits(kwargs), self.db)
+            updated = super().update(**kwargs)
+            keys |= CobranzaMensual.keys_of(self.model.objects.using(self.db).filter(pk__in=pks))
+            CobranzaMensual.objects.using(self.db).refresh(keys)
+            VersionDatos.bump(self.db, edit=True)
+        return updated
+
+    update.alters_data = True
+
+    def delete(self):
+        with transaction.atomic(using=self.db):
+            keys = CobranzaMensual.keys_of(self)
+            invalidate_credits(self._credits({}), self.db)
+            deleted = super().delete()
+            CobranzaMensual.objects.using(self.db).refresh(keys)
+            VersionDatos.bump(self.db, edit=True)
+        return deleted
+
+    delete.alters_data = True
+
+
+class ListaCobroDetalle(models.Model):
+    """Collection attempt per credit.
+
+    On PostgreSQL the table is range-partitioned by year on fechaCobroBanco
+    (see cobranza/partitions.py); rows without a date live in the default
+    partition.
+    """
     idListaCobro = models.IntegerField()
     idCredito = models.IntegerField()
     consecutivoCobro = models.CharField(max_length=20)
@@ -11,59 +150,253 @@ class ListaCobroDetalle2022(models.Model):
     fechaCobroBanco = models.DateTimeField(null=True, blank=True)
     idRespuestaBanco = models.CharField(max_length=20, null=True, blank=True)
 
+    objects = ListaCobroDetalleQuerySet.as_manager()
+
     class Meta:
-        db_table = 'ListaCobroDetalle2022'
+        db_table = 'ListaCobroDetalle'
+        # A BRIN index on fechaCobroBanco is added on PostgreSQL by migration 0003
+        indexes = [
+            # Covers a credit's whole history (cobranza/historial.py), so lookups are index-only on PostgreSQL
+            models.Index(
+                fields=['idCredito', 'fechaCobroBanco', 'id'],
+                include=['idListaCobro', 'consecutivoCobro', 'idBanco', 'montoExigible', 'montoCobrar',
+                         'montoCobrado', 'idRespuestaBanco'],
+                name='cobro_credito_historial_idx',
+            ),
+            models.Index(fields=['idBanco', 'fechaCobroBanco'], name='cobro_banco_fecha_idx'),
+            # Keyset pagination of /api/collection-details/ walks (fechaCobroBanco, id)
+            models.Index(fields=['fechaCobroBanco', 'id'], name='cobro_fecha_id_idx'),
+        ]
         
     def __str__(self):
         return f"Lista Cobro {self.idListaCobro} - Crédito {self.idCredito}"
 
-class ListaCobroDetalle2023(models.Model):
-    idListaCobro = models.IntegerField()
-    idCredito = models.IntegerField()
-    consecutivoCobro = models.CharField(max_length=20)
+    def rollup_row(self):
+        """Current rollup field values, cleaned the way they are stored"""
+        row = {name: self._meta.get_field(name).to_python(getattr(self, name)) for name in ROLLUP_FIELDS}
+        if row['fechaCobroBanco'] is not None and timezone.is_naive(row['fechaCobroBanco']):
+            row['fechaCobroBanco'] = timezone.make_aware(row['fechaCobroBanco'])
+        return row
+
+    def save(self, *args, **kwargs):
+        using = kwargs.get('using') or self._state.db or 'default'
+        with transaction.atomic(using=using):
+            old = None
+            credits = {self.idCredito}
+            if not self._state.adding and self.pk is not None:
+                old = type(self)._base_manager.using(using).filter(pk=self.pk).values(
+                    'idCredito', *ROLLUP_FIELDS
+                ).first()
+                if old is not None:
+                    credits.add(old.pop('idCredito'))
+            super().save(*args, **kwargs)
+            new = self.rollup_row()
+            update_fields = kwargs.get('update_fields')
+            if old is not None and update_fields is not None:
+                # Fields left out of update_fields keep their stored values
+                new = {name: new[name] if name in update_fields else old[name] for name in ROLLUP_FIELDS}
+            if new != old:
+                rollup = CobranzaMensual.objects.using(using)
+                if old is not None:
+                    rollup.add_rows([old], sign=-1)
+                rollup.add_rows([new])
+            invalidate_credits(credits, using)
+            VersionDatos.bump(using, edit=old is not None)
+
+    def delete(self, *args, **kwargs):
+        using = kwargs.get('using') or self._state.db or 'default'
+        with transaction.atomic(using=using):
+            old = type(self)._base_manager.using(using).filter(pk=self.pk).values(*ROLLUP_FIELDS).first()
+            deleted = super().delete(*args, **kwargs)
+            if old is not None:
+                CobranzaMensual.objects.using(using).add_rows([old], sign=-1)
+            invalidate_credits({self.idCredito}, using)
+            VersionDatos.bump(using, edit=True)
+        return deleted
+
+
+class CobranzaMensualQuerySet(models.QuerySet):
+
+    def add_rows(self, rows, sign=1):
+        """Add (sign=1) or remove (sign=-1) detail rows from their months' totals.
+
+        rows are dicts holding ROLLUP_FIELDS; undated rows are ignored.
+        """
+        totals = {}
+        tz = timezone.get_current_timezone()
+        for row in rows:
+            key = rollup_key(row, tz)
+            if key is None:
+                continue
+            cobrar = Decimal(row['montoCobrar'])
+            cobrado = Decimal(row['montoCobrado'])
+            eficiencia = cobrado * 100 / cobrar if cobrar else Decimal(0)
+            total = totals.setdefault(key, [0, Decimal(0), Decimal(0), Decimal(0)])
+            total[0] += 1
+            total[1] += cobrar
+            total[2] += cobrado
+            total[3] += eficiencia
+
+        for (year, month, id_banco), (registros, cobrar, cobrado, eficiencia) in totals.items():
+            # get_or_create handles a concurrent insert of the same month; the
+            # sums are then applied in the database so concurrent updates add up
+            mensual, _ = self.get_or_create(year=year, month=month, idBanco=id_banco)
+            self.filter(pk=mensual.pk).update(
+                registros=F('registros') + sign * registros,
+                montoCobrar=F('montoCobrar') + sign * cobrar,
+                montoCobrado=F('montoCobrado') + sign * cobrado,
+                sumaEficiencia=F('sumaEficiencia') + sign * eficiencia,
+            )
+
+    def refresh(self, keys):
+        """Recompute the given (year, month, idBanco) totals from the detail rows"""
+        if not keys:
+            return
+        rows = Q()
+        for year, month, id_banco in keys:
+            lower, upper = month_bounds(year, month)
+            rows |= Q(idBanco=id_banco, fechaCobroBanco__gte=lower, fechaCobroBanco__lt=upper)
+        totals = ListaCobroDetalle.objects.using(self.db).filter(rows).monthly_totals()
+
+        with transaction.atomic(using=self.db):
+            stale = Q()
+            for year, month, id_banco in keys:
+                stale |= Q(year=year, month=month, idBanco=id_banco)
+            self.filter(stale).delete()
+            self.bulk_create(CobranzaMensual(**total) for total in totals)
+
+    def rebuild(self, years=None):
+        """Recompute every month, or only those of `years`, from the detail rows"""
+        details = ListaCobroDetalle.objects.using(self.db).all()
+        stale = self.all()
+        if years is not None:
+            in_years = Q()
+            for year in years:
+                lower, upper = year_bounds(year)
+                in_years |= Q(fechaCobroBanco__gte=lower, fechaCobroBanco__lt=upper)
+            details = details.filter(in_years)
+            stale = stale.filter(year__in=years)
+        totals = list(details.monthly_totals())
+
+        with transaction.atomic(using=self.db):
+            stale.delete()
+            self.bulk_create(CobranzaMensual(**total) for total in totals)
+            # Rebuilds follow loads that bypassed the ORM, which may have changed any row
+            VersionDatos.bump(self.db, edit=True)
+        return len(totals)
+
+
+class CobranzaMensual(models.Model):
+    """Monthly collection totals per bank, kept in step with ListaCobroDetalle.
+
+    Saves, deletes and bulk_create/update/delete through the ORM update it
+    incrementally; loads that bypass the ORM call refresh() or rebuild()
+    (see the rebuild_cobranza_rollup command).
+    """
+    year = models.IntegerField()
+    month = models.IntegerField()
     idBanco = models.IntegerField()
-    montoExigible = models.DecimalField(max_digits=10, decimal_places=2)
-    montoCobrar = models.DecimalField(max_digits=10, decimal_places=2)
-    montoCobrado = models.DecimalField(max_digits=10, decimal_places=2, default=0)
-    fechaCobroBanco = models.DateTimeField(null=True, blank=True)
-    idRespuestaBanco = models.CharField(max_length=20, null=True, blank=True)
+    registros = models.IntegerField(default=0)
+    montoCobrar = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    montoCobrado = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    # Sum of per-row efficiency; promedio_eficiencia is sumaEficiencia / registros
+    sumaEficiencia = models.DecimalField(max_digits=30, decimal_places=10, default=0)
+
+    objects = CobranzaMensualQuerySet.as_manager()
 
     class Meta:
-        db_table = 'ListaCobroDetalle2023'
-        
+        db_table = 'CobranzaMensual'
+        constraints = [
+            models.UniqueConstraint(fields=['year', 'month', 'idBanco'], name='cobranza_mensual_key'),
+        ]
+
     def __str__(self):
-        return f"Lista Cobro {self.idListaCobro} - Crédito {self.idCredito}"
+        return f"{self.year}-{self.month:02d} Banco {self.idBanco}"
 
-class ListaCobroDetalle2024(models.Model):
-    idListaCobro = models.IntegerField()
-    idCredito = models.IntegerField()
-    consecutivoCobro = models.CharField(max_length=20)
-    idBanco = models.IntegerField()
-    montoExigible = models.DecimalField(max_digits=10, decimal_places=2)
-    montoCobrar = models.DecimalField(max_digits=10, decimal_places=2)
-    montoCobrado = models.DecimalField(max_digits=10, decimal_places=2, default=0)
-    fechaCobroBanco = models.DateTimeField(null=True, blank=True)
-    idRespuestaBanco = models.CharField(max_length=20, null=True, blank=True)
+    @staticmethod
+    def keys_of(details):
+        """(year, month, idBanco) keys touched by a ListaCobroDetalle queryset"""
+        return {
+            (row['year'], row['month'], row['idBanco'])
+            for row in details.filter(fechaCobroBanco__isnull=False)
+            .annotate(year=ExtractYear('fechaCobroBanco'), month=ExtractMonth('fechaCobroBanco'))
+            .values('year', 'month', 'idBanco')
+            .distinct()
+            .order_by()
+        }
+
+
+
+class VersionDatos(models.Model):
+    """Counter bumped whenever collection data changes.
+
+    API responses are cached and tagged (ETag/Last-Modified) by this version,
+    so a bump invalidates them everywhere at once. ediciones only counts the
+    bumps that changed or deleted existing rows: clients that keep rows they
+    already fetched must drop them when it moves (see collection_stats).
+    """
+    version = models.BigIntegerField(default=0)
+    ediciones = models.BigIntegerField(default=0)
+    modificado = models.DateTimeField(default=timezone.now)
 
     class Meta:
-        db_table = 'ListaCobroDetalle2024'
-        
+        db_table = 'VersionDatos'
+
     def __str__(self):
-        return f"Lista Cobro {self.idListaCobro} - Crédito {self.idCredito}"
+        return f"v{self.version} ({self.modificado:%Y-%m-%d %H:%M:%S})"
 
-class ListaCobroDetalle2025(models.Model):
-    idListaCobro = models.IntegerField()
-    idCredito = models.IntegerField()
-    consecutivoCobro = models.CharField(max_length=20)
-    idBanco = models.IntegerField()
-    montoExigible = models.DecimalField(max_digits=10, decimal_places=2)
-    montoCobrar = models.DecimalField(max_digits=10, decimal_places=2)
-    montoCobrado = models.DecimalField(max_digits=10, decimal_places=2, default=0)
-    fechaCobroBanco = models.DateTimeField(null=True, blank=True)
-    idRespuestaBanco = models.CharField(max_length=20, null=True, blank=True)
+    @property
+    def tag(self):
+        # The timestamp keeps tags unique if the counter is ever reset with the data
+        return f"{self.version}-{self.modificado:%Y%m%d%H%M%S%f}"
+
+    @classmethod
+    def current(cls, using='default'):
+        version, _ = cls.objects.using(using).get_or_create(pk=1)
+        return version
+
+    @classmethod
+    def bump(cls, using='default', edit=False):
+        """Advance the version once the transaction that changed the data commits.
+
+        edit says whether the transaction changed or deleted existing rows
+        rather than only adding new ones. Updating the row inside that
+        transaction would hold its lock until the commit and queue every
+        other writer behind it; after the commit it is one short statement
+        of its own.
+        """
+        transaction.on_commit(partial(cls.advance, using, edit), using=using)
+
+    @classmethod
+    def advance(cls, using='default', edit=False):
+        updated = cls.objects.using(using).filter(pk=1).update(
+            version=F('version') + 1, ediciones=F('ediciones') + int(edit), modificado=timezone.now()
+        )
+        if not updated:
+            cls.objects.using(using).get_or_create(pk=1, defaults={'version': 1, 'ediciones': int(edit)})
+
+
+class CargaCobranza(models.Model):
+    """Progress of a load_cobranza run over one input file.
+
+    posicion and filas advance in the same transaction as each batch, so a
+    failed run resumes right after its last committed batch.
+    """
+    archivo = models.CharField(max_length=500)
+    # Size and hash of the whole file; identifies the file across runs
+    huella = models.CharField(max_length=80, unique=True)
+    formato = models.CharField(max_length=10)
+    posicion = models.BigIntegerField(default=0)
+    registro = models.BigIntegerField(default=0)
+    filas = models.BigIntegerField(default=0)
+    rechazadas = models.BigIntegerField(default=0)
+    completada = models.BooleanField(default=False)
+    iniciada = models.DateTimeField(auto_now_add=True)
+    actualizada = models.DateTimeField(auto_now=True)
 
     class Meta:
-        db_table = 'ListaCobroDetalle2025'
-        
+        db_table = 'CargaCobranza'
+
     def __str__(self):
-        return f"Lista Cobro {self.idListaCobro} - Crédito {self.idCredito}"
\ No newline at end of file
+        estado = 'completa' if self.completada else f'en byte {self.posicion}'
+        return f"{self.archivo} ({self.filas} filas, {estado})"
@@ -0,0 +1,80 @@
+"""Yearly range partitions of the ListaCobroDetalle table (PostgreSQL only)."""
+from datetime import datetime, timezone
+
+PARENT_TABLE = 'ListaCobroDetalle'
+DEFAULT_PARTITION = 'ListaCobroDetalle_default'
+
+
+def partition_table(year):
+    return f'{PARENT_TABLE}{year}'
+
+
+def year_bounds(year):
+    """Inclusive lower and exclusive upper fechaCobroBanco bound for a year"""
+    return (
+        datetime(year, 1, 1, tzinfo=timezone.utc),
+        datetime(year + 1, 1, 1, tzinfo=timezone.utc),
+    )
+
+
+def partition_year(fecha):
+    """Year of the partition an aware fechaCobroBanco belongs to; year_bounds are in UTC"""
+    return fecha.astimezone(timezone.utc).year
+
+
+def is_partitioned(connection):
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)",
+            [f'"{PARENT_TABLE}"']
+        )
+        return cursor.fetchone() is not None
+
+
+def existing_partitions(connection):
+    """Names of the partitions currently attached to the parent table"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT child.relname
+            FROM pg_inherits
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE pg_inherits.inhparent = to_regclass(%s)
+            """,
+            [f'"{PARENT_TABLE}"']
+        )
+        return {row[0] for row in cursor.fetchall()}
+
+
+def create_year_partition(connection, year):
+    """Create and attach the partition for `year`.
+
+    Rows for that year that already landed in the default partition are
+    moved into the new partition before it is attached, otherwise the attach
+    would be rejected.
+    """
+    table = partition_table(year)
+    lower, upper = year_bounds(year)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'CREATE TABLE "{table}" '
+            f'(LIKE "{PARENT_TABLE}" INCLUDING DEFAULTS, PRIMARY KEY (id))'
+        )
+        cursor.execute(
+            f'''
+            WITH moved AS (
+                DELETE FROM "{DEFAULT_PARTITION}"
+                WHERE "fechaCobroBanco" >= %s AND "fechaCobroBanco" < %s
+                RETURNING *
+            )
+            INSERT INTO "{table}" SELECT * FROM moved
+            ''',
+            [lower, upper]
+        )
+        cursor.execute(
+            f'ALTER TABLE "{PARENT_TABLE}" ATTACH PARTITION "{table}" '
+            f"FOR VALUES FROM ('{lower.isoformat()}') TO ('{upper.isoformat()}')"
+        )
+    return table
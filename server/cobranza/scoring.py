@@ -0,0 +1,152 @@
+"""Credit scoring in SQL, mirroring the client's scoring.summarize_credits.
+
+Rows of a credit are taken in (fechaCobroBanco, id) order with undated rows
+last, as the client sees them. Every row scores -1 when montoCobrar differs
+from montoCobrado, +1 when it matches and +1 when montoExigible was fully
+collected, weighted by a recency multiplier over 28-day buckets. The first
+row gives idBanco, the last row the amounts and date, and the last row with
+montoCobrado > 0 the emisor. The emission comes from the configuracion
+decision table. score_history applies the same rules in Python to a single
+credit whose rows are already in memory.
+"""
+from datetime import timedelta
+
+from django.db.models import Case, CharField, F, IntegerField, Q, Sum, Value, When, Window
+from django.db.models.functions import FirstValue, LastValue, RowNumber
+from django.db.models.expressions import RowRange
+
+from configuracion.decision import decision_table
+
+RECENCY_BUCKET_DAYS = 28
+RECENCY_MULTIPLIERS = [6, 5, 4, 3, 2]
+
+# Per-credit result columns; banco is the idBanco of the credit's first row
+SCORE_FIELDS = [
+    'idCredito', 'banco', 'points', 'monto', 'montoExigible', 'montoCobrar',
+    'montoCobrado', 'fechaCobroBanco', 'lastEmisor', 'emisionUsada',
+]
+
+
+def recency_multiplier(current_date):
+    """6 for rows at most 28 whole days old, down to 2 at 140 days, 1 after that or undated"""
+    # (current_date - fecha) has at most 28 * k whole days exactly when
+    # fecha is later than current_date - (28 * k + 1) days
+    return Case(
+        *[
+            When(fechaCobroBanco__gt=current_date - timedelta(days=RECENCY_BUCKET_DAYS * bucket + 1),
+                 then=Value(multiplier))
+            for bucket, multiplier in enumerate(RECENCY_MULTIPLIERS, start=1)
+        ],
+        default=Value(1),
+        output_field=IntegerField(),
+    )
+
+
+# montoExigible and montoCobrado are never NULL, so every row is complete
+ROW_POINT_DELTA = (
+    Case(When(montoCobrar=F('montoCobrado'), then=Value(1)), default=Value(-1))
+    + Case(When(montoExigible=F('montoCobrado'), then=Value(1)), default=Value(0))
+)
+
+
+def emission_case(table):
+    """CASE picking the emission name from the rules of a decision table; NULL when none matches"""
+    whens = []
+    for regla in table['reglas']:
+        condition = Q()
+        if regla['idBanco'] is not None:
+            condition &= Q(banco=regla['idBanco'])
+        if regla['bancosExcluidos']:
+            condition &= ~Q(banco__in=regla['bancosExcluidos'])
+        if regla['emisoresPrevios']:
+            condition &= Q(lastEmisor__in=regla['emisoresPrevios'])
+        if regla['soloIncumplidos']:
+            condition &= Q(points__lt=0) | ~Q(montoExigible=F('montoCobrado'))
+        if not condition:
+            # A rule without criteria matches every credit left
+            return Case(*whens, default=Value(regla['emision']), output_field=CharField())
+        whens.append(When(condition, then=Value(regla['emision'])))
+    return Case(*whens, default=Value(None), output_field=CharField())
+
+
+def credit_scores(queryset, current_date, table=None):
+    """One row per credit of queryset with its SCORE_FIELDS, ordered by idCredito.
+
+    Everything is computed with window functions over the credit's rows, so
+    only the per-credit results leave the database. table defaults to the
+    cached configuracion decision table.
+    """
+    credit = [F('idCredito')]
+    newest_first = [F('fechaCobroBanco').desc(nulls_first=True), F('id').desc()]
+    paid = Q(montoCobrado__gt=0)
+    emission = emission_case(table or decision_table())
+    return (
+        queryset
+        .annotate(
+            rank=Window(RowNumber(), partition_by=credit, order_by=newest_first),
+            points=Window(Sum(ROW_POINT_DELTA * recency_multiplier(current_date)), partition_by=credit),
+            sumExigible=Window(Sum('montoExigible'), partition_by=credit),
+            sumCobrado=Window(Sum('montoCobrado'), partition_by=credit),
+            banco=Window(LastValue('idBanco'), partition_by=credit, order_by=newest_first,
+                         frame=RowRange(start=None, end=None)),
+            lastEmisor=Window(
+                FirstValue(Case(When(paid, then=F('idRespuestaBanco')))),
+                partition_by=credit,
+                order_by=[Case(When(paid, then=Value(0)), default=Value(1)), *newest_first],
+            ),
+        )
+        .filter(rank=1)
+        .annotate(monto=F('sumExigible') - F('sumCobrado'), emisionUsada=emission)
+        .order_by('idCredito')
+    )
+
+
+def row_multiplier(fecha, current_date):
+    """recency_multiplier of one row"""
+    if fecha is not None:
+        for bucket, multiplier in enumerate(RECENCY_MULTIPLIERS, start=1):
+            if fecha > current_date - timedelta(days=RECENCY_BUCKET_DAYS * bucket + 1):
+                return multiplier
+    return 1
+
+
+def row_point_delta(row):
+    """ROW_POINT_DELTA of one row"""
+    return ((1 if row['montoCobrar'] == row['montoCobrado'] else -1)
+            + (1 if row['montoExigible'] == row['montoCobrado'] else 0))
+
+
+def match_emission(table, score):
+    """emission_case for one credit's score"""
+    for regla in table['reglas']:
+        if regla['idBanco'] is not None and score['banco'] != regla['idBanco']:
+            continue
+        if score['banco'] in regla['bancosExcluidos']:
+            continue
+        if regla['emisoresPrevios'] and score['lastEmisor'] not in regla['emisoresPrevios']:
+            continue
+        if regla['soloIncumplidos'] and not (
+            score['points'] < 0 or score['montoExigible'] != score['montoCobrado']
+        ):
+            continue
+        return regla['emision']
+    return None
+
+
+def score_history(id_credito, rows, current_date, table=None):
+    """SCORE_FIELDS of one credit from its rows (dicts), oldest first with undated rows last"""
+    last = rows[-1]
+    paid = [row for row in rows if row['montoCobrado'] > 0]
+    score = {
+        'idCredito': id_credito,
+        'banco': rows[0]['idBanco'],
+        'points': sum(row_point_delta(row) * row_multiplier(row['fechaCobroBanco'], current_date) for row in rows),
+        'monto': sum(row['montoExigible'] for row in rows) - sum(row['montoCobrado'] for row in rows),
+        'montoExigible': last['montoExigible'],
+        'montoCobrar': last['montoCobrar'],
+        'montoCobrado': last['montoCobrado'],
+        'fechaCobroBanco': last['fechaCobroBanco'],
+        'lastEmisor': paid[-1]['idRespuestaBanco'] if paid else None,
+    }
+    score['emisionUsada'] = match_emission(table or decision_table(), score)
+    return score
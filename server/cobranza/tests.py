@@ -1,3 +1,539 @@
-from django.test import TestCase
+import random
+import sys
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from importlib import import_module
+from io import StringIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import F
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from . import loading, scoring
+from .historial import HISTORY_FIELDS, HISTORY_ORDER, LRUCache, credit_histories, drop_histories, read_histories
+from .loading import RowError, convert, parse_amount
+from .models import CargaCobranza, CobranzaMensual, ListaCobroDetalle, VersionDatos
+from .partitions import existing_partitions, partition_table, partition_year
+
+
+def make_detalle(fecha, id_banco=12, cobrar=100, cobrado=100, id_credito=1, emisor=None):
+    return ListaCobroDetalle.objects.create(
+        idListaCobro=1, idCredito=id_credito, consecutivoCobro='1', idBanco=id_banco,
+        montoExigible=cobrar, montoCobrar=cobrar, montoCobrado=cobrado, fechaCobroBanco=fecha,
+        idRespuestaBanco=emisor,
+    )
+
+
+class ListaCobroDetalleQuerySetTests(TestCase):
+
+    def test_for_year_and_years(self):
+        make_detalle(datetime(2023, 12, 31, 23, 59, tzinfo=timezone.utc))
+        make_detalle(datetime(2024, 1, 1, tzinfo=timezone.utc))
+        make_detalle(None)
+
+        self.assertEqual(ListaCobroDetalle.objects.for_year(2024).count(), 1)
+        self.assertEqual(ListaCobroDetalle.objects.years(), [2023, 2024])
+
+
+class VersionDatosTests(TestCase):
+
+    def test_bumped_after_commit(self):
+        version = VersionDatos.current().version
+        with self.captureOnCommitCallbacks(execute=True):
+            ListaCobroDetalle.objects.bulk_create([
+                ListaCobroDetalle(idListaCobro=1, idCredito=1, consecutivoCobro='1', idBanco=12,
+                                  montoExigible=1, montoCobrar=1, montoCobrado=1)
+            ])
+            # Writers do not lock the version row until they commit
+            self.assertEqual(VersionDatos.current().version, version)
+        self.assertEqual(VersionDatos.current().version, version + 1)
+
+
+class CobranzaMensualTests(TestCase):
+    march = datetime(2024, 3, 5, tzinfo=timezone.utc)
+    april = datetime(2024, 4, 1, tzinfo=timezone.utc)
+
+    def totals(self):
+        return {
+            (row.year, row.month, row.idBanco): (row.registros, row.montoCobrar, row.montoCobrado, row.sumaEficiencia)
+            for row in CobranzaMensual.objects.filter(registros__gt=0)
+        }
+
+    def assertMatchesRebuild(self):
+        incremental = self.totals()
+        CobranzaMensual.objects.rebuild()
+        self.assertEqual(incremental, self.totals())
+
+    def test_save_and_delete_update_totals(self):
+        detalle = make_detalle(self.march, cobrado=50)
+        make_detalle(self.march, cobrar=0, cobrado=0)
+        make_detalle(None)
+        self.assertEqual(self.totals(), {(2024, 3, 12): (2, Decimal(100), Decimal(50), Decimal(50))})
+
+        detalle.fechaCobroBanco = self.april
+        detalle.save()
+        self.assertEqual(self.totals()[2024, 4, 12], (1, Decimal(100), Decimal(50), Decimal(50)))
+        self.assertEqual(self.totals()[2024, 3, 12], (1, Decimal(0), Decimal(0), Decimal(0)))
+
+        detalle.delete()
+        self.assertNotIn((2024, 4, 12), self.totals())
+        self.assertMatchesRebuild()
+
+    def test_queryset_writes_update_totals(self):
+        ListaCobroDetalle.objects.bulk_create([
+            ListaCobroDetalle(idListaCobro=1, idCredito=n, consecutivoCobro='1', idBanco=2 + n % 2,
+                              montoExigible=100, montoCobrar=100, montoCobrado=n, fechaCobroBanco=self.march)
+            for n in range(10)
+        ])
+        self.assertEqual(self.totals()[2024, 3, 2], (5, Decimal(500), Decimal(20), Decimal(20)))
+
+        ListaCobroDetalle.objects.filter(idBanco=2).update(idBanco=3, fechaCobroBanco=self.april)
+        ListaCobroDetalle.objects.filter(idCredito=9).delete()
+        self.assertEqual(set(self.totals()), {(2024, 3, 3), (2024, 4, 3)})
+        self.assertMatchesRebuild()
+
+    def test_rebuild_command_for_one_year(self):
+        make_detalle(self.march)
+        make_detalle(datetime(2025, 1, 2, tzinfo=timezone.utc))
+        CobranzaMensual.objects.filter(year=2024).update(registros=99)
+
+        call_command('rebuild_cobranza_rollup', year=[2024], stdout=StringIO())
+        self.assertEqual(self.totals()[2024, 3, 12][0], 1)
+        self.assertEqual(self.totals()[2025, 1, 12][0], 1)
+
+
+class PartitionYearTests(TestCase):
+
+    def test_partition_year_is_the_utc_year(self):
+        mexico_city = timezone(timedelta(hours=-6))
+        self.assertEqual(partition_year(datetime(2024, 12, 31, 20, 0, tzinfo=mexico_city)), 2025)
+        self.assertEqual(partition_year(datetime(2025, 1, 1, 0, 0, tzinfo=timezone.utc)), 2025)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Partitioning requires PostgreSQL')
+class PartitionTests(TestCase):
+
+    def test_rows_are_routed_to_yearly_partitions(self):
+        detalle = make_detalle(datetime(2024, 6, 1, tzinfo=timezone.utc))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT tableoid::regclass::text FROM "ListaCobroDetalle" WHERE id = %s', [detalle.id]
+            )
+            self.assertEqual(cursor.fetchone()[0], f'"{partition_table(2024)}"')
+
+    def test_command_moves_rows_out_of_default_partition(self):
+        detalle = make_detalle(datetime(2031, 3, 1, tzinfo=timezone.utc))
+        call_command('create_cobranza_partitions', from_year=2031, years_ahead=2031 - datetime.now().year,
+                     stdout=StringIO())
+
+        self.assertIn(partition_table(2031), existing_partitions(connection))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT tableoid::regclass::text FROM "ListaCobroDetalle" WHERE id = %s', [detalle.id]
+            )
+            self.assertEqual(cursor.fetchone()[0], f'"{partition_table(2031)}"')
+
+    def test_migration_moves_rows_dated_in_other_years(self):
+        migration = import_module('cobranza.migrations.0002_listacobrodetalle')
+        rows = {
+            # yearly table: fechaCobroBanco of the rows it held before partitioning
+            2022: ['2022-05-01', '2025-02-01'],
+            2023: ['2023-05-01', '2024-03-01', '2030-01-01', None],
+            2024: ['2024-05-01'],
+            2025: [],
+        }
+        with connection.cursor() as cursor:
+            # A scratch schema, so the migration's tables do not clash with the migrated ones
+            cursor.execute('CREATE SCHEMA partition_migration')
+            cursor.execute('SET LOCAL search_path TO partition_migration')
+            try:
+                for year, fechas in rows.items():
+                    table = migration.YEARLY_TABLES[year]
+                    cursor.execute(
+                        f'CREATE TABLE "{table}" (id bigint GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY, '
+                        '"idListaCobro" integer NOT NULL, "idCredito" integer NOT NULL, '
+                        '"consecutivoCobro" varchar(20) NOT NULL, "idBanco" integer NOT NULL, '
+                        '"montoExigible" numeric(10, 2) NOT NULL, "montoCobrar" numeric(10, 2) NOT NULL, '
+                        '"montoCobrado" numeric(10, 2) NOT NULL, "fechaCobroBanco" timestamptz NULL, '
+                        '"idRespuestaBanco" varchar(20) NULL)'
+                    )
+                    for fecha in fechas:
+                        cursor.execute(
+                            f'INSERT INTO "{table}" ("idListaCobro", "idCredito", "consecutivoCobro", "idBanco", '
+                            '"montoExigible", "montoCobrar", "montoCobrado", "fechaCobroBanco") '
+                            "VALUES (1, %s, '1', 12, 100, 100, 100, %s)",
+                            [year, fecha]
+                        )
+
+                migration.partition_postgresql(cursor)
+                cursor.execute(
+                    'SELECT "fechaCobroBanco"::date::text, tableoid::regclass::text '
+                    'FROM "ListaCobroDetalle" ORDER BY "fechaCobroBanco"'
+                )
+                partitions = cursor.fetchall()
+                cursor.execute('SELECT COUNT(DISTINCT id) FROM "ListaCobroDetalle"')
+                distinct_ids = cursor.fetchone()[0]
+
+                migration.split_postgresql(cursor)
+                cursor.execute(' UNION ALL '.join(
+                    f'SELECT "fechaCobroBanco"::date::text, {year} FROM "{table}"'
+                    for year, table in migration.YEARLY_TABLES.items()
+                ) + ' ORDER BY 1')
+                split = cursor.fetchall()
+                cursor.execute('SELECT to_regclass(%s)', ['"ListaCobroDetalle"'])
+                parent = cursor.fetchone()[0]
+            finally:
+                cursor.execute('RESET search_path')
+
+        self.assertEqual(partitions, [
+            ('2022-05-01', '"ListaCobroDetalle2022"'),
+            ('2023-05-01', '"ListaCobroDetalle2023"'),
+            ('2024-03-01', '"ListaCobroDetalle2024"'),
+            ('2024-05-01', '"ListaCobroDetalle2024"'),
+            ('2025-02-01', '"ListaCobroDetalle2025"'),
+            ('2030-01-01', '"ListaCobroDetalle_default"'),
+            (None, '"ListaCobroDetalle_default"'),
+        ])
+        self.assertEqual(distinct_ids, len(partitions))
+        # Rolled back, rows outside the yearly tables' years go to the last one
+        self.assertEqual(split, [
+            ('2022-05-01', 2022), ('2023-05-01', 2023), ('2024-03-01', 2024), ('2024-05-01', 2024),
+            ('2025-02-01', 2025), ('2030-01-01', 2025), (None, 2025),
+        ])
+        self.assertIsNone(parent)
+
+
+CSV_HEADER = 'idListaCobro,idCredito,consecutivoCobro,idBanco,montoExigible,montoCobrar,montoCobrado,fechaCobroBanco,idRespuestaBanco\n'
+
+
+class LoadCobranzaTests(TransactionTestCase):
+    """Batches are committed from the loader's writer thread, outside any test transaction"""
+
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def write(self, name, text):
+        path = Path(self.tmp.name) / name
+        path.write_text(text)
+        return str(path)
+
+    def load(self, *args, **options):
+        call_command('load_cobranza', *args, stdout=StringIO(), **options)
+
+    def csv_file(self, rows=10):
+        lines = [
+            f'{n},{100 + n},1,12,150.00,150.00,{n}.50,2024-0{1 + n % 3}-15T09:00:00,00\n'
+            for n in range(rows)
+        ]
+        return self.write('cobros.csv', CSV_HEADER + ''.join(lines))
+
+    def test_parse_amount(self):
+        self.assertEqual(parse_amount('12.5'), Decimal('12.50'))
+        self.assertEqual(parse_amount('000001250', implied_decimals=2), Decimal('12.50'))
+        for text in ['12.505', 'NaN', 'doce', '100000000']:
+            with self.assertRaises(RowError):
+                parse_amount(text)
+
+    def test_convert_rejects_malformed_ids(self):
+        record = {'idListaCobro': '1', 'idCredito': '100', 'consecutivoCobro': '1', 'idBanco': '12',
+                  'montoExigible': '10.00', 'montoCobrar': '10.00'}
+        self.assertEqual(convert(record)['idCredito'], 100)
+        for text in ['--5', '+-3', '²', 'doce']:
+            with self.assertRaisesMessage(RowError, f'invalid idCredito {text!r}'):
+                convert({**record, 'idCredito': text})
+
+    def test_loads_csv_in_batches(self):
+        path = self.csv_file()
+        self.load(path, batch_size=3)
+
+        self.assertEqual(ListaCobroDetalle.objects.count(), 10)
+        detalle = ListaCobroDetalle.objects.get(idCredito=104)
+        self.assertEqual(detalle.montoCobrado, Decimal('4.50'))
+        self.assertEqual(detalle.fechaCobroBanco, datetime(2024, 2, 15, 9, tzinfo=timezone.utc))
+        self.assertEqual(CobranzaMensual.objects.get(year=2024, month=1).registros, 4)
+        carga = CargaCobranza.objects.get()
+        self.assertTrue(carga.completada)
+        self.assertEqual(carga.filas, 10)
+
+        # The same file is not loaded twice
+        self.load(path)
+        self.assertEqual(ListaCobroDetalle.objects.count(), 10)
+
+    def test_fixed_width_layout(self):
+        line = f'{1:>10}{555:>10}{"2":>10}{14:>4}{15000:>12}{15000:>12}{7525:>12}20250301093000{"04":>4}\n'
+        path = self.write('cobros.txt', line + f'{2:>10}{556:>10}{"1":>10}{14:>4}{100:>12}{100:>12}{0:>12}{"":14}{"":4}\n')
+        self.load(path, format='fixed')
+
+        detalle = ListaCobroDetalle.objects.get(idCredito=555)
+        self.assertEqual(detalle.montoCobrado, Decimal('75.25'))
+        self.assertEqual(detalle.fechaCobroBanco, datetime(2025, 3, 1, 9, 30, tzinfo=timezone.utc))
+        self.assertEqual(detalle.idRespuestaBanco, '04')
+        self.assertIsNone(ListaCobroDetalle.objects.get(idCredito=556).fechaCobroBanco)
+
+    def test_invalid_records(self):
+        path = self.write('cobros.csv', CSV_HEADER + '1,100,1,12,10.00,10.00,0,2024-01-01,00\n'
+                          '2,101,1,12,diez,10.00,0,2024-01-01,00\n'
+                          '3,102,1,12,10.00,10.00,0,2024-01-01,00\n')
+        with self.assertRaisesMessage(CommandError, 'Record 2: invalid amount'):
+            self.load(path)
+        self.assertEqual(ListaCobroDetalle.objects.count(), 0)
+
+        rejects = Path(self.tmp.name) / 'rejects.tsv'
+        self.load(path, max_errors=1, rejects=str(rejects))
+        self.assertEqual(ListaCobroDetalle.objects.count(), 2)
+        self.assertIn('record 2', rejects.read_text())
+
+    def test_file_identity_covers_every_byte(self):
+        path = self.csv_file()
+        self.load(path)
+
+        # Same size and first MiB, different last record
+        text = Path(path).read_text()
+        Path(path).write_text(text.replace('109,1,12,150.00,150.00,9.50', '109,1,12,150.00,150.00,8.50'))
+        self.load(path)
+        self.assertEqual(ListaCobroDetalle.objects.count(), 20)
+        self.assertTrue(ListaCobroDetalle.objects.filter(idCredito=109, montoCobrado=Decimal('8.50')).exists())
+
+        # Records appended to a loaded file are loaded on their own
+        with open(path, 'a') as f:
+            f.write('10,110,1,12,150.00,150.00,1.00,2024-03-15T09:00:00,00\n')
+        self.load(path)
+        self.assertEqual(ListaCobroDetalle.objects.count(), 21)
+        self.assertEqual(CargaCobranza.objects.latest('id').filas, 11)
+
+    def test_resumes_after_last_committed_batch(self):
+        path = self.csv_file()
+        write_batch = loading.write_batch
+        calls = []
+
+        def failing_write_batch(connection, rows, *args):
+            calls.append(len(rows))
+            if len(calls) == 3:
+                raise ConnectionError('connection lost')
+            write_batch(connection, rows, *args)
+
+        with mock.patch('cobranza.loading.write_batch', failing_write_batch):
+            with self.assertRaises(ConnectionError):
+                self.load(path, batch_size=3)
+        self.assertEqual(ListaCobroDetalle.objects.count(), 6)
+
+        self.load(path, batch_size=3)
+        self.assertEqual(
+            sorted(ListaCobroDetalle.objects.values_list('idCredito', flat=True)), list(range(100, 110))
+        )
+        self.assertEqual(CargaCobranza.objects.get().filas, 10)
+
+    def test_resume_does_not_repeat_rejects(self):
+        text = Path(self.csv_file()).read_text()
+        path = self.write('cobros.csv', text.replace('101,1,12,150.00', '101,1,12,diez').replace(
+            '107,1,12,150.00', '107,1,12,diez'))
+        rejects = Path(self.tmp.name) / 'rejects.tsv'
+        write_batch = loading.write_batch
+        calls = []
+
+        def failing_write_batch(connection, rows, *args):
+            calls.append(len(rows))
+            if len(calls) == 3:
+                raise ConnectionError('connection lost')
+            write_batch(connection, rows, *args)
+
+        with mock.patch('cobranza.loading.write_batch', failing_write_batch):
+            with self.assertRaises(ConnectionError):
+                self.load(path, batch_size=3, max_errors=2, rejects=str(rejects))
+        # Record 8 was rejected in the batch that never committed
+        self.assertEqual([line.split('\t')[1] for line in rejects.read_text().splitlines()], ['record 2'])
+
+        self.load(path, batch_size=3, max_errors=2, rejects=str(rejects))
+        self.assertEqual([line.split('\t')[1] for line in rejects.read_text().splitlines()],
+                         ['record 2', 'record 8'])
+        self.assertEqual(CargaCobranza.objects.get().rechazadas, 2)
+
+
+class CreditHistoryTests(TestCase):
+    march = datetime(2024, 3, 5, tzinfo=timezone.utc)
+
+    def setUp(self):
+        drop_histories([1, 2, 3])
+
+    def fechas(self, id_credito):
+        return [row[HISTORY_FIELDS.index('fechaCobroBanco')] for row in credit_histories([id_credito])[id_credito]]
+
+    def test_rows_across_years_undated_last(self):
+        make_detalle(None)
+        make_detalle(datetime(2025, 1, 2, tzinfo=timezone.utc))
+        make_detalle(self.march)
+        make_detalle(self.march, id_credito=2)
+
+        self.assertEqual(self.fechas(1), [self.march, datetime(2025, 1, 2, tzinfo=timezone.utc), None])
+        self.assertEqual(list(credit_histories([3, 2, 3])), [3, 2])
+        self.assertEqual(credit_histories([3])[3], [])
+
+    def test_cached_until_a_write_commits(self):
+        detalle = make_detalle(self.march)
+        self.assertEqual(len(self.fechas(1)), 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(len(self.fechas(1)), 1)
+
+        writes = [
+            lambda: make_detalle(None),
+            lambda: ListaCobroDetalle.objects.filter(idCredito=1).update(idRespuestaBanco='05503'),
+            lambda: ListaCobroDetalle.objects.bulk_create([ListaCobroDetalle(
+                idListaCobro=1, idCredito=1, consecutivoCobro='2', idBanco=12, montoExigible=1,
+                montoCobrar=1, montoCobrado=1, fechaCobroBanco=self.march,
+            )]),
+            lambda: ListaCobroDetalle.objects.filter(fechaCobroBanco=None).delete(),
+        ]
+        for write in writes:
+            with self.captureOnCommitCallbacks(execute=True):
+                write()
+            expected = ListaCobroDetalle.objects.filter(idCredito=1).order_by(*HISTORY_ORDER)
+            self.assertEqual(self.fechas(1), list(expected.values_list('fechaCobroBanco', flat=True)))
+        self.assertEqual(len(self.fechas(1)), 2)
+
+        # Moving a row to another credit drops both
+        self.assertEqual(self.fechas(2), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            detalle.idCredito = 2
+            detalle.save()
+        self.assertEqual((len(self.fechas(1)), len(self.fechas(2))), (1, 1))
+        with self.captureOnCommitCallbacks(execute=True):
+            detalle.delete()
+        self.assertEqual(self.fechas(2), [])
+
+    def test_write_during_a_miss_is_not_cached_over(self):
+        make_detalle(self.march)
+
+        def racing_read(ids, using='default'):
+            rows = read_histories(ids, using)
+            # A payment commits after the miss read the rows, before they are stored
+            with self.captureOnCommitCallbacks(execute=True):
+                make_detalle(self.march)
+            return rows
+
+        with mock.patch('cobranza.historial.read_histories', racing_read):
+            self.assertEqual(len(self.fechas(1)), 1)
+        self.assertEqual(len(self.fechas(1)), 2)
+
+    @override_settings(CREDIT_CACHE_MAX_DROP=1)
+    def test_large_writes_drop_every_history(self):
+        make_detalle(self.march)
+        make_detalle(self.march, id_credito=2)
+        self.assertEqual((len(self.fechas(1)), len(self.fechas(2))), (1, 1))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ListaCobroDetalle.objects.update(fechaCobroBanco=None)
+        self.assertEqual((self.fechas(1), self.fechas(2)), ([None], [None]))
+
+    def test_lru_evicts_and_expires(self):
+        lru = LRUCache(maxsize=2, ttl=60)
+        lru.set_many({1: 'a', 2: 'b'})
+        lru.get_many([1])
+        lru.set_many({3: 'c'})
+        self.assertEqual(lru.get_many([1, 2, 3]), {1: 'a', 3: 'c'})
+        with mock.patch('cobranza.historial.time.monotonic', return_value=10**9):
+            self.assertEqual(lru.get_many([1, 3]), {})
+
+
+def import_client():
+    """The client's datathon and scoring modules, or None when its dependencies are missing"""
+    client_dir = str(Path(settings.BASE_DIR).parent / 'client')
+    sys.path.insert(0, client_dir)
+    try:
+        import datathon
+        import scoring
+    except ImportError:
+        return None
+    finally:
+        sys.path.remove(client_dir)
+    return datathon, scoring
+
+
+class CreditScoresTests(TestCase):
+    today = datetime(2025, 6, 1, tzinfo=timezone.utc)
+
+    def scores(self):
+        return {row['idCredito']: row for row in ListaCobroDetalle.objects.credit_scores(self.today).values()}
+
+    def test_recency_buckets_and_emission(self):
+        # 28 whole days old weighs 6, 29 days weighs 5, undated weighs 1
+        make_detalle(self.today - timedelta(days=28, hours=23), id_credito=1, emisor='05503')
+        make_detalle(self.today - timedelta(days=29), id_credito=1, cobrado=40)
+        make_detalle(None, id_credito=1, id_banco=14)
+        make_detalle(self.today - timedelta(days=400), id_credito=2, id_banco=14)
+
+        scores = self.scores()
+        self.assertEqual(scores[1]['points'], 2 * 6 - 5 + 2)
+        self.assertEqual(scores[1]['monto'], Decimal(60))
+        self.assertEqual(scores[1]['banco'], 12)
+        self.assertEqual(scores[1]['lastEmisor'], None)
+        self.assertIsNone(scores[1]['fechaCobroBanco'])
+        self.assertEqual(scores[1]['emisionUsada'], 'bbva_cobrar_mismo')
+        self.assertEqual((scores[2]['points'], scores[2]['emisionUsada']), (2, 'santander_cobrar_mismo'))
+
+    def test_score_history_matches_sql(self):
+        rng = random.Random(11)
+        for credit in range(1, 201):
+            for _ in range(rng.randrange(1, 10)):
+                monto = Decimal(rng.choice(['150', '1250.50', '4']))
+                make_detalle(
+                    self.today - timedelta(days=rng.randrange(-3, 200), hours=rng.randrange(24))
+                    if rng.random() > 0.05 else None,
+                    id_banco=rng.choice([12, 14, 2, 72]), cobrar=monto,
+                    cobrado=rng.choice([monto, monto / 2, Decimal(0)]), id_credito=credit,
+                    emisor=rng.choice(['05503', '06114', '00623', None]),
+                )
+
+        scores = self.scores()
+        for id_credito, rows in read_histories(list(scores)).items():
+            score = scoring.score_history(id_credito, [dict(zip(HISTORY_FIELDS, row)) for row in rows], self.today)
+            self.assertEqual(score, {field: scores[id_credito][field] for field in scoring.SCORE_FIELDS})
+
+    @skipUnless(import_client(), 'Client dependencies are not installed')
+    def test_matches_client_scorer(self):
+        import pandas as pd
+
+        datathon, scoring = import_client()
+        rng = random.Random(5)
+        details = []
+        for credit in range(1, 301):
+            bank = rng.choice([12, 14, 2, 72])
+            monto = Decimal(rng.choice(['150', '1250.50', '4']))
+            for _ in range(rng.randrange(1, 12)):
+                fecha = self.today - timedelta(days=rng.randrange(-3, 200), hours=rng.randrange(24))
+                details.append(ListaCobroDetalle(
+                    idListaCobro=1, idCredito=credit, consecutivoCobro='1', idBanco=bank,
+                    montoExigible=monto, montoCobrar=monto,
+                    montoCobrado=rng.choice([monto, monto, monto / 2, Decimal(0)]),
+                    fechaCobroBanco=fecha if rng.random() > 0.05 else None,
+                    idRespuestaBanco=rng.choice(['05503', '06114', '00623', None]),
+                ))
+        ListaCobroDetalle.objects.bulk_create(details)
+
+        # Rows as the client receives them from /api/collection-details/
+        rows = ListaCobroDetalle.objects.order_by(F('fechaCobroBanco').asc(nulls_last=True), 'id').values()
+        df = pd.DataFrame.from_records(rows)
+        df['fechaCobroBanco'] = pd.to_datetime(df['fechaCobroBanco'], utc=True).dt.tz_localize(None)
+        for column in ['montoExigible', 'montoCobrar', 'montoCobrado']:
+            df[column] = df[column].astype(float)
+        df = df.sort_values(['idCredito', 'fechaCobroBanco'])
+        expected = scoring.summarize_credits(df, self.today.replace(tzinfo=None))
+        emision, _ = datathon.select_emisiones(
+            expected['idBanco'], expected['points'], expected['montoExigible'],
+            expected['montoCobrado'], expected['lastEmisor'],
+        )
+
+        scores = self.scores()
+        self.assertEqual(list(scores), expected.index.tolist())
+        for id_credito, row in expected.iterrows():
+            score = scores[id_credito]
+            self.assertEqual(score['points'], row['points'], id_credito)
+            self.assertAlmostEqual(float(score['monto']), row['monto'], places=6)
+            self.assertEqual(score['banco'], row['idBanco'])
+            self.assertEqual(score['lastEmisor'], None if pd.isna(row['lastEmisor']) else row['lastEmisor'])
+            self.assertEqual(score['emisionUsada'], emision[id_credito])
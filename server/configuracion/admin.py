@@ -1,3 +1,14 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import Emision, ReglaEmision
+
+
+@admin.register(Emision)
+class EmisionAdmin(admin.ModelAdmin):
+    list_display = ['nombre', 'idEmisor', 'comision', 'horaCobro']
+
+
+@admin.register(ReglaEmision)
+class ReglaEmisionAdmin(admin.ModelAdmin):
+    list_display = ['orden', 'emision', 'idBanco', 'bancosExcluidos', 'emisoresPrevios', 'soloIncumplidos']
+    list_select_related = ['emision']
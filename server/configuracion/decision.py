@@ -0,0 +1,62 @@
+"""Emission decision table: the Emision and ReglaEmision rows as one plain dict.
+
+The table is kept in the default cache under the configuration version
+(VersionConfiguracion), which every Emision or ReglaEmision write bumps,
+so scoring and the API read one row per request instead of the whole
+configuration, and a write in any process is seen by all of them. Its shape is what
+/api/emission-table/ serves and the client's emission.DecisionTable reads:
+
+    {'emisiones': [{'nombre', 'idEmisor', 'comision', 'horaCobro'}, ...],
+     'reglas': [{'orden', 'emision', 'idBanco', 'bancosExcluidos', 'emisoresPrevios', 'soloIncumplidos'}, ...]}
+"""
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+
+DECISION_TABLE_KEY = 'configuracion:decision_table'
+
+
+def build_decision_table(using='default'):
+    from .models import Emision, ReglaEmision
+
+    emisiones = [
+        {'nombre': emision.nombre, 'idEmisor': emision.idEmisor,
+         'comision': emision.comision, 'horaCobro': emision.horaCobro}
+        for emision in Emision.objects.using(using).order_by('nombre')
+    ]
+    reglas = [
+        {'orden': regla.orden, 'emision': regla.emision.nombre, 'idBanco': regla.idBanco,
+         'bancosExcluidos': regla.bancos_excluidos, 'emisoresPrevios': regla.emisores,
+         'soloIncumplidos': regla.soloIncumplidos}
+        for regla in ReglaEmision.objects.using(using).select_related('emision').order_by('orden')
+    ]
+    table = {'emisiones': emisiones, 'reglas': reglas}
+    table['tag'] = hashlib.sha1(json.dumps(table, cls=DjangoJSONEncoder, sort_keys=True).encode()).hexdigest()
+    return table
+
+
+def decision_table(using='default'):
+    """The table for the current configuration version, built on first use"""
+    from .models import VersionConfiguracion
+
+    # Read the version before the rows: a table built from older rows is never cached under a newer version
+    key = f'{DECISION_TABLE_KEY}:{VersionConfiguracion.current(using).tag}'
+    table = cache.get(key)
+    if table is None:
+        table = build_decision_table(using)
+        cache.set(key, table)
+    return table
+
+
+def invalidate_decision_table(using='default'):
+    """Bump the configuration version, for writes that skip ConfiguracionModel"""
+    from .models import VersionConfiguracion
+
+    VersionConfiguracion.bump(using)
+
+
+def emisor_mapping(table):
+    """idEmisor per emission name"""
+    return {emision['nombre']: emision['idEmisor'] for emision in table['emisiones']}
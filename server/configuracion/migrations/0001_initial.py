@@ -0,0 +1,42 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Emision',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.CharField(max_length=50, unique=True)),
+                ('idEmisor', models.CharField(max_length=20)),
+                ('comision', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('horaCobro', models.TimeField()),
+            ],
+            options={
+                'db_table': 'Emision',
+                'ordering': ['nombre'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ReglaEmision',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('orden', models.PositiveIntegerField(unique=True)),
+                ('idBanco', models.IntegerField(blank=True, help_text='idBanco of the credit', null=True)),
+                ('emisoresPrevios', models.CharField(blank=True, help_text='Comma-separated idRespuestaBanco values, one of which the last paid attempt used', max_length=200)),
+                ('soloIncumplidos', models.BooleanField(default=False, help_text='Only credits with negative points or whose last attempt was not collected in full')),
+                ('emision', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='reglas', to='configuracion.emision')),
+            ],
+            options={
+                'db_table': 'ReglaEmision',
+                'ordering': ['orden'],
+            },
+        ),
+    ]
@@ -0,0 +1,57 @@
+from datetime import time
+from decimal import Decimal
+
+from django.db import migrations
+
+# The emissions and rules the client used to hard-code in datathon.py
+EMISIONES = [
+    ('bbva_matutino', '05503', Decimal('8'), time(8, 0)),
+    ('bbva_cobrar_mismo', '5923', Decimal('1.6'), time(9, 0)),
+    ('bbva_interbancario', '4750', Decimal('6'), time(9, 0)),
+    ('santander_cobrar_mismo', '00623', Decimal('1.97'), time(9, 30)),
+    ('banamex_cobrar_mismo', '00496', Decimal('1.75'), time(8, 30)),
+    ('banamex_interbancario', '00496', Decimal('1.75'), time(8, 30)),
+]
+
+# (orden, emision, idBanco, emisoresPrevios, soloIncumplidos)
+REGLAS = [
+    (10, 'bbva_matutino', 12, '05503,06114', False),
+    (20, 'bbva_cobrar_mismo', 12, '', False),
+    (30, 'bbva_interbancario', None, '', True),
+    (40, 'santander_cobrar_mismo', 14, '', False),
+    (50, 'banamex_cobrar_mismo', 2, '', False),
+    (60, 'banamex_interbancario', None, '', False),
+]
+
+
+def add_defaults(apps, schema_editor):
+    Emision = apps.get_model('configuracion', 'Emision')
+    ReglaEmision = apps.get_model('configuracion', 'ReglaEmision')
+    db = schema_editor.connection.alias
+    emisiones = {
+        nombre: Emision.objects.using(db).create(nombre=nombre, idEmisor=emisor, comision=comision, horaCobro=hora)
+        for nombre, emisor, comision, hora in EMISIONES
+    }
+    ReglaEmision.objects.using(db).bulk_create(
+        ReglaEmision(orden=orden, emision=emisiones[nombre], idBanco=banco,
+                     emisoresPrevios=previos, soloIncumplidos=incumplidos)
+        for orden, nombre, banco, previos, incumplidos in REGLAS
+    )
+    # Cached tables are keyed by VersionConfiguracion, created after these rows (0003)
+
+
+def remove_defaults(apps, schema_editor):
+    db = schema_editor.connection.alias
+    apps.get_model('configuracion', 'ReglaEmision').objects.using(db).all().delete()
+    apps.get_model('configuracion', 'Emision').objects.using(db).all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('configuracion', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_defaults, remove_defaults),
+    ]
@@ -0,0 +1,37 @@
+from django.db import migrations, models
+from django.db.models import F
+from django.utils import timezone
+
+
+def exclude_bank_12(apps, schema_editor):
+    """The seeded soloIncumplidos rule never applied to bank 12, whatever the rule order"""
+    db = schema_editor.connection.alias
+    ReglaEmision = apps.get_model('configuracion', 'ReglaEmision')
+    updated = ReglaEmision.objects.using(db).filter(
+        orden=30, emision__nombre='bbva_interbancario', idBanco=None, soloIncumplidos=True, bancosExcluidos='',
+    ).update(bancosExcluidos='12')
+    if updated:
+        # Historical models skip ConfiguracionModel, so cached tables are dropped here
+        apps.get_model('configuracion', 'VersionConfiguracion').objects.using(db).filter(pk=1).update(
+            version=F('version') + 1, modificado=timezone.now()
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('configuracion', '0003_version_configuracion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reglaemision',
+            name='bancosExcluidos',
+            field=models.CharField(
+                blank=True, max_length=200,
+                help_text='Comma-separated idBanco values of credits the rule never matches',
+            ),
+        ),
+        # Reversing drops the column, and the exclusion with it
+        migrations.RunPython(exclude_bank_12, migrations.RunPython.noop),
+    ]
@@ -1,3 +1,140 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
+from django.utils import timezone
 
-# Create your models here.
+
+def _invalidate_on_commit(using):
+    # Bumping before commit would let a concurrent reader cache the old rows under the new version
+    transaction.on_commit(lambda: VersionConfiguracion.bump(using), using=using)
+
+
+class VersionConfiguracion(models.Model):
+    """Counter bumped whenever Emision or ReglaEmision rows change.
+
+    The decision table is cached under this version, so a write made by
+    any process reaches every other one on its next read.
+    """
+    version = models.BigIntegerField(default=0)
+    modificado = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'VersionConfiguracion'
+
+    def __str__(self):
+        return f"v{self.version} ({self.modificado:%Y-%m-%d %H:%M:%S})"
+
+    @property
+    def tag(self):
+        # current() recreates a deleted row (a flush or restored dump) at 0; the timestamp
+        # keeps its tags from matching decision tables cached under the old counter
+        return f"{self.version}-{self.modificado:%Y%m%d%H%M%S%f}"
+
+    @classmethod
+    def current(cls, using='default'):
+        version, _ = cls.objects.using(using).get_or_create(pk=1)
+        return version
+
+    @classmethod
+    def bump(cls, using='default'):
+        """Advance the version; call once the changed rows are committed"""
+        updated = cls.objects.using(using).filter(pk=1).update(
+            version=F('version') + 1, modificado=timezone.now()
+        )
+        if not updated:
+            cls.objects.using(using).get_or_create(pk=1, defaults={'version': 1})
+
+
+class ConfiguracionQuerySet(models.QuerySet):
+    """Bulk writes bump the configuration version, like Model.save/delete do"""
+
+    def bulk_create(self, objs, *args, **kwargs):
+        created = super().bulk_create(objs, *args, **kwargs)
+        _invalidate_on_commit(self.db)
+        return created
+
+    def update(self, **kwargs):
+        updated = super().update(**kwargs)
+        _invalidate_on_commit(self.db)
+        return updated
+
+    update.alters_data = True
+
+    def delete(self):
+        deleted = super().delete()
+        _invalidate_on_commit(self.db)
+        return deleted
+
+    delete.alters_data = True
+
+
+class ConfiguracionModel(models.Model):
+    """Base for the tables the emission decision table is built from"""
+
+    objects = ConfiguracionQuerySet.as_manager()
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        _invalidate_on_commit(kwargs.get('using') or self._state.db or 'default')
+
+    def delete(self, *args, **kwargs):
+        using = kwargs.get('using') or self._state.db or 'default'
+        deleted = super().delete(*args, **kwargs)
+        _invalidate_on_commit(using)
+        return deleted
+
+
+class Emision(ConfiguracionModel):
+    """Collection channel a credit can be charged through, with its fee and time of day"""
+    nombre = models.CharField(max_length=50, unique=True)
+    idEmisor = models.CharField(max_length=20)
+    comision = models.DecimalField(max_digits=10, decimal_places=2)
+    horaCobro = models.TimeField()
+
+    class Meta:
+        db_table = 'Emision'
+        ordering = ['nombre']
+
+    def __str__(self):
+        return f"{self.nombre} ({self.idEmisor})"
+
+
+class ReglaEmision(ConfiguracionModel):
+    """Rule choosing a credit's emission.
+
+    Rules are tried by orden and the first one whose criteria all hold wins;
+    blank criteria match any credit, so a rule without criteria catches
+    everything left. Credits no rule matches are not collected.
+    """
+    orden = models.PositiveIntegerField(unique=True)
+    emision = models.ForeignKey(Emision, on_delete=models.PROTECT, related_name='reglas')
+    idBanco = models.IntegerField(null=True, blank=True, help_text='idBanco of the credit')
+    bancosExcluidos = models.CharField(
+        max_length=200, blank=True,
+        help_text='Comma-separated idBanco values of credits the rule never matches',
+    )
+    emisoresPrevios = models.CharField(
+        max_length=200, blank=True,
+        help_text='Comma-separated idRespuestaBanco values, one of which the last paid attempt used',
+    )
+    soloIncumplidos = models.BooleanField(
+        default=False,
+        help_text='Only credits with negative points or whose last attempt was not collected in full',
+    )
+
+    class Meta:
+        db_table = 'ReglaEmision'
+        ordering = ['orden']
+
+    def __str__(self):
+        return f"{self.orden}: {self.emision.nombre}"
+
+    @property
+    def emisores(self):
+        return [emisor.strip() for emisor in self.emisoresPrevios.split(',') if emisor.strip()]
+
+    @property
+    def bancos_excluidos(self):
+        return [int(banco) for banco in self.bancosExcluidos.split(',') if banco.strip()]
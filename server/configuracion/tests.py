@@ -1,3 +1,85 @@
-from django.test import TestCase
+from datetime import datetime, time, timezone
+from decimal import Decimal
+from unittest import skipUnless
 
-# Create your tests here.
+from django.test import TestCase, override_settings
+
+from cobranza.models import ListaCobroDetalle
+from cobranza.tests import import_client, make_detalle
+
+from .decision import build_decision_table, decision_table, invalidate_decision_table
+from .models import Emision, ReglaEmision
+
+
+class DecisionTableTests(TestCase):
+
+    def setUp(self):
+        invalidate_decision_table()
+
+    def test_cached_until_config_changes(self):
+        table = decision_table()
+        # Only the version row is read
+        with self.assertNumQueries(1):
+            self.assertEqual(decision_table(), table)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            emision = Emision.objects.get(nombre='bbva_cobrar_mismo')
+            emision.comision = Decimal('2.10')
+            emision.save()
+        changed = decision_table()
+        self.assertNotEqual(changed['tag'], table['tag'])
+        self.assertIn(Decimal('2.10'), [emision['comision'] for emision in changed['emisiones']])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ReglaEmision.objects.filter(emision__nombre='bbva_matutino').delete()
+        self.assertNotIn('bbva_matutino', [regla['emision'] for regla in decision_table()['reglas']])
+
+    def test_writes_before_commit_keep_cached_table(self):
+        table = decision_table()
+        with self.captureOnCommitCallbacks() as callbacks:
+            Emision.objects.update(comision=Decimal(1))
+            self.assertEqual(decision_table(), table)
+        self.assertEqual(len(callbacks), 1)
+
+    def test_writes_from_other_process_reach_cached_table(self):
+        table = decision_table()
+        # Another worker has its own memory cache; only the database is shared
+        other_process = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                     'LOCATION': 'otro-proceso'}}
+        with override_settings(CACHES=other_process), self.captureOnCommitCallbacks(execute=True):
+            Emision.objects.filter(nombre='bbva_matutino').update(comision=Decimal('9.50'))
+
+        changed = decision_table()
+        self.assertNotEqual(changed['tag'], table['tag'])
+        self.assertIn(Decimal('9.50'), [emision['comision'] for emision in changed['emisiones']])
+
+    def test_rules_drive_sql_emission(self):
+        today = datetime(2025, 6, 1, tzinfo=timezone.utc)
+        make_detalle(datetime(2025, 5, 20, tzinfo=timezone.utc), id_banco=14, id_credito=1)
+        make_detalle(datetime(2025, 5, 20, tzinfo=timezone.utc), id_banco=72, id_credito=2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ReglaEmision.objects.filter(idBanco=14).update(
+                emision=Emision.objects.create(nombre='santander_matutino', idEmisor='00624',
+                                               comision=Decimal(3), horaCobro=time(7, 0))
+            )
+            ReglaEmision.objects.filter(idBanco=None, soloIncumplidos=False).delete()
+        scores = ListaCobroDetalle.objects.credit_scores(today).values_list('idCredito', 'emisionUsada')
+        self.assertEqual(list(scores), [(1, 'santander_matutino'), (2, None)])
+
+    @skipUnless(import_client(), 'Client dependencies are not installed')
+    def test_seeded_rules_match_client_defaults(self):
+        datathon, _ = import_client()
+        from emission import DecisionTable
+
+        seeded = DecisionTable(build_decision_table())
+        default = datathon.DEFAULT_DECISION_TABLE
+        self.assertEqual(seeded.fees, default.fees)
+        self.assertEqual(seeded.hours, default.hours)
+        self.assertEqual(seeded.emisores, default.emisores)
+        self.assertEqual(
+            [(r['emision'], r['idBanco'], list(r['bancosExcluidos']), list(r['emisoresPrevios']), r['soloIncumplidos'])
+             for r in seeded.reglas],
+            [(r['emision'], r['idBanco'], list(r['bancosExcluidos']), list(r['emisoresPrevios']), r['soloIncumplidos'])
+             for r in default.reglas],
+        )
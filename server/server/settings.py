@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
 from pathlib import Path
+import ipaddress
 import os
 from dotenv import load_dotenv
 import dj_database_url
@@ -59,6 +60,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Compresses API responses (streamed ones included) for clients sending Accept-Encoding: gzip
+    'django.middleware.gzip.GZipMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -101,6 +104,87 @@ DATABASES = {
     )
 }
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+#
+# CACHE_URL selects the backend: unset for per-process memory,
+# file:///path/to/dir for a shared directory, redis://host:port/db for Redis
+# (needs the redis package). API responses are keyed by the data version
+# (VersionDatos) and the decision table by the configuration version
+# (VersionConfiguracion), both stored in the database, so entries never go
+# stale in any process and can live until evicted.
+
+CACHE_URL = os.getenv('CACHE_URL', '')
+
+if CACHE_URL.startswith(('redis://', 'rediss://')):
+    CACHES = {'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': CACHE_URL,
+        'TIMEOUT': None,
+    }}
+elif CACHE_URL.startswith('file://'):
+    CACHES = {'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': CACHE_URL[len('file://'):],
+        'TIMEOUT': None,
+    }}
+else:
+    CACHES = {'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'credifiel',
+        'TIMEOUT': None,
+    }}
+
+# Credit history cache (cobranza/historial.py)
+#
+# /api/credits/ keeps up to CREDIT_CACHE_SIZE credit histories per process
+# for CREDIT_CACHE_LOCAL_TTL seconds, in front of the shared cache above,
+# where they live for CREDIT_CACHE_TTL seconds. Writes drop the histories
+# of the credits they touch, so the TTLs only bound how long other
+# processes and writes outside Django can serve stale rows. Writes touching
+# more than CREDIT_CACHE_MAX_DROP credits drop every history instead of
+# listing the credits.
+
+CREDIT_CACHE_SIZE = int(os.getenv('CREDIT_CACHE_SIZE', 10000))
+CREDIT_CACHE_LOCAL_TTL = float(os.getenv('CREDIT_CACHE_LOCAL_TTL', 5))
+CREDIT_CACHE_TTL = int(os.getenv('CREDIT_CACHE_TTL', 300))
+CREDIT_CACHE_MAX_DROP = int(os.getenv('CREDIT_CACHE_MAX_DROP', 1000))
+
+# SQLite ignores the INCLUDE columns of the covering credit history index;
+# PostgreSQL answers history lookups from it alone
+SILENCED_SYSTEM_CHECKS = ['models.W040']
+
+# Async API views (api/async_views.py)
+#
+# API_ASYNC_VIEWS=1 routes /api/ to the async views; run under ASGI
+# (e.g. uvicorn server.asgi:application) to benefit. API_DB_POOL_SIZE is the
+# number of database connections they may hold per process.
+
+API_ASYNC_VIEWS = os.getenv('API_ASYNC_VIEWS', '') == '1'
+API_DB_POOL_SIZE = int(os.getenv('API_DB_POOL_SIZE', 4))
+
+# Request metrics (api/metrics.py)
+#
+# API_METRICS=0 turns off the latency, SQL and response size metrics served
+# at /api/metrics. Statements slower than API_SLOW_QUERY_MS are counted and
+# the latest API_SLOW_QUERY_SAMPLES of them are kept, by statement hash.
+# /api/metrics answers 404 unless the client address is in
+# API_METRICS_ALLOWED_IPS (comma-separated addresses or networks, e.g.
+# 127.0.0.1,10.0.0.0/8), which is empty by default; they are parsed into
+# ip_network objects here, once.
+
+API_METRICS = os.getenv('API_METRICS', '1') == '1'
+API_SLOW_QUERY_MS = float(os.getenv('API_SLOW_QUERY_MS', 200))
+API_SLOW_QUERY_SAMPLES = int(os.getenv('API_SLOW_QUERY_SAMPLES', 20))
+API_METRICS_ALLOWED_IPS = [
+    ipaddress.ip_network(ip.strip(), strict=False)
+    for ip in os.getenv('API_METRICS_ALLOWED_IPS', '').split(',') if ip.strip()
+]
+
+if API_METRICS:
+    # First, so the time spent in the other middleware is measured too
+    MIDDLEWARE.insert(0, 'api.middleware.metrics_middleware')
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 